@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+HTTP serving benchmark - Date: 2026-10-18
+Compares the old layout (MCP on one uvicorn in a thread, plugin/OAuth app on
+another) with the single-port app, in one and several worker processes.
+Each client thread alternates GET /.well-known/ai-plugin.json and an MCP
+tools/list call over its own keep-alive connections.
+
+    python bench_http.py                          # 16 clients, 10 s per mode
+    python bench_http.py --workers 4 --clients 64
+"""
+import argparse
+import http.client
+import json
+import os
+import secrets
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+INIT = {"jsonrpc": "2.0", "id": 1, "method": "initialize",
+        "params": {"protocolVersion": "2025-03-26", "capabilities": {}, "clientInfo": {"name": "bench", "version": "1"}}}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def serve(mode: str, plugin_port: int, mcp_port: int, workers: int) -> None:
+    """Server side, run in a child process."""
+    import logging
+    import uvicorn
+    logging.disable(logging.WARNING)
+    sys.stdout = open(os.devnull, "w")            # the module prints its tool list on import
+    import plain_mail_http as server
+    if mode == "split":
+        # the pre-unification layout: two uvicorn servers, two event loops, one process
+        threading.Thread(target=uvicorn.run, args=(server.app,), daemon=True,
+                         kwargs=dict(host="127.0.0.1", port=mcp_port, log_level="warning")).start()
+        uvicorn.run(server.plugin_app, host="127.0.0.1", port=plugin_port, log_level="warning", lifespan="off")
+    elif workers > 1:
+        uvicorn.run("plain_mail_http:plugin_app", host="127.0.0.1", port=plugin_port,
+                    workers=workers, log_level="warning")
+    else:
+        uvicorn.run(server.plugin_app, host="127.0.0.1", port=plugin_port, log_level="warning")
+
+
+def wait_for(port: int, timeout: float = 30.0) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), 0.2).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"server on port {port} did not start")
+
+
+def client(plugin_port: int, mcp_port: int, token: str, stop: float, samples: dict) -> None:
+    plugin = http.client.HTTPConnection("127.0.0.1", plugin_port)
+    mcp = http.client.HTTPConnection("127.0.0.1", mcp_port)
+    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json",
+               "Accept": "application/json, text/event-stream"}
+    mcp.request("POST", "/mcp", json.dumps(INIT), headers)
+    resp = mcp.getresponse()
+    resp.read()
+    headers["mcp-session-id"] = resp.getheader("mcp-session-id")
+    mcp.request("POST", "/mcp", json.dumps({"jsonrpc": "2.0", "method": "notifications/initialized"}), headers)
+    mcp.getresponse().read()
+    call = json.dumps({"jsonrpc": "2.0", "id": 2, "method": "tools/list"})
+    while time.time() < stop:
+        start = time.perf_counter()
+        plugin.request("GET", "/.well-known/ai-plugin.json")
+        plugin.getresponse().read()
+        samples["static"].append(time.perf_counter() - start)
+        start = time.perf_counter()
+        mcp.request("POST", "/mcp", call, headers)
+        resp = mcp.getresponse()
+        resp.read()
+        if resp.status != 200:
+            raise RuntimeError(f"tools/list answered {resp.status}")
+        samples["mcp"].append(time.perf_counter() - start)
+
+
+def run_mode(mode: str, workers: int, args, env: dict, token: str) -> None:
+    plugin_port = free_port()
+    mcp_port = free_port() if mode == "split" else plugin_port
+    proc = subprocess.Popen([sys.executable, __file__, "--serve", mode, "--workers", str(workers),
+                             "--ports", f"{plugin_port},{mcp_port}"], cwd=HERE, env=env)
+    try:
+        wait_for(plugin_port)
+        wait_for(mcp_port)
+        time.sleep(1.0 if workers > 1 else 0.2)
+        samples = {"static": [], "mcp": []}
+        stop = time.time() + args.seconds
+        threads = [threading.Thread(target=client, args=(plugin_port, mcp_port, token, stop, samples))
+                   for _ in range(args.clients)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        proc.terminate()
+        proc.wait()
+    label = mode if mode == "split" else f"unified x{workers}"
+    for kind in ("static", "mcp"):
+        lat = sorted(samples[kind])
+        p50 = statistics.median(lat) * 1000
+        p99 = lat[int(len(lat) * 0.99) - 1] * 1000
+        print(f"{label:<14}{kind:<8}{len(lat) / args.seconds:>10.0f}{p50:>10.1f}{p99:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--serve", help=argparse.SUPPRESS)
+    parser.add_argument("--ports", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        plugin_port, mcp_port = map(int, args.ports.split(","))
+        serve(args.serve, plugin_port, mcp_port, args.workers)
+        return
+
+    import oauth_store
+    tmp = tempfile.mkdtemp(prefix="bench-http-")
+    env = dict(os.environ, OAUTH_TOKEN_DB=os.path.join(tmp, "tokens.sqlite3"),
+               MAIL_SPOOL_PATH=os.path.join(tmp, "outbox.sqlite3"), MAIL_CAPS_REFRESH_SECONDS="86400")
+    token = secrets.token_urlsafe(32)
+    oauth_store.SQLiteTokenStore(env["OAUTH_TOKEN_DB"]).put(
+        "access", token, {"user_id": "default", "scopes": ["email:read", "email:write"],
+                          "expires_at": time.time() + 3600}, 3600)
+
+    print(f"{args.clients} clients, {args.seconds:.0f} s per mode, {os.cpu_count()} CPUs")
+    print(f"{'mode':<14}{'route':<8}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    modes = [("split", 1), ("unified", 1)] + ([("unified", args.workers)] if args.workers > 1 else [])
+    for mode, workers in modes:
+        run_mode(mode, workers, args, env, token)
+
+
+if __name__ == "__main__":
+    main()
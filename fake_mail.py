@@ -0,0 +1,1078 @@
+#!/usr/bin/env python3
+"""
+fake_mail.py – Local stand-in POP3, IMAP and SMTP servers for benchmarks and tests.
+
+One asyncio loop serves all three over loopback, from a synthetic store, so
+the clients here can be measured reproducibly and offline:
+
+    POP3    USER/PASS, CAPA, STAT, LIST, UIDL, TOP, RETR, DELE, RSET, NOOP,
+            QUIT (commits deletions); PIPELINING; STLS; one session per
+            maildrop ("-ERR [IN-USE]" for a second login, like real servers)
+    IMAP    LOGIN, CAPABILITY, LIST, SELECT/EXAMINE, [UID] SEARCH / FETCH /
+            STORE, EXPUNGE, CLOSE, IDLE (new mail shows up as "* n EXISTS"),
+            literals, STARTTLS, COMPRESS=DEFLATE
+    SMTP    EHLO, AUTH PLAIN/LOGIN, MAIL/RCPT/DATA, PIPELINING, CHUNKING
+            (BDAT), STARTTLS; accepted mail is kept in Store.sent and, with
+            loopback, delivered to the INBOX
+
+Store describes the mailboxes: how many messages, how big, with or without
+an attachment, how many are flagged; messages are generated on demand from
+their UID, so a 100 000 message mailbox costs little memory.  Faults
+describes what goes wrong and how slowly: round-trip latency (charged
+whenever the server waits for the client, so pipelined commands share one
+round trip), a bandwidth cap per connection, and per-command probabilities
+of an error reply (fail), a dropped connection (drop) or no answer at all
+(hang).  Command names are the protocol verbs (RETR, FETCH, DATA, ...),
+CONNECT for the greeting, or * for every command.
+
+In a script::
+
+    with fake_mail.FakeMail(fake_mail.Store(messages=500), fake_mail.Faults(latency=0.02)) as fake:
+        os.environ.update(fake.env())           # MAIL_HOST, MAIL_POP_PORT, ...
+        ...
+        fake.faults.hang["*"] = 1.0             # faults can change while running
+
+From a shell, serve until interrupted, or run a command against the servers::
+
+    python fake_mail.py --messages 1000 --latency 0.05 --kbps 2000
+    python fake_mail.py --fail RETR=0.1 -- python test_mail_connection.py
+
+env() says MAIL_SSL=0: the clients connect in plaintext and, for IMAP (and
+SMTP), upgrade with STARTTLS, which mail_mcp always does.  So pass tls=True
+to FakeMail when a script talks to mail_mcp; the command line offers
+STARTTLS unless --no-tls.  smoke_fake_mail.py drives both servers this way.
+"""
+import os, re, ssl, sys, zlib, time, base64, random, asyncio, argparse, tempfile, threading, subprocess, logging
+from collections import Counter
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+LOG = logging.getLogger("fake_mail")
+
+HANG_SECONDS = 3600.0
+CHUNK = 16384                   # write size when bandwidth is capped
+
+SENDERS = ["Alice Example <alice@example.com>", "Build Bot <ci@builds.example.org>",
+           "=?UTF-8?Q?J=C3=BCrgen_M=C3=BCller?= <jm@example.de>", "noreply@tickets.example.net"]
+SUBJECTS = ["Re: quarterly report draft", "[CI] pipeline #{n} passed",
+            "Invoice {n} for October", "Meeting notes {n} - action items"]
+_WORDS = ("the quarterly numbers look fine but the invoice for october is still missing please "
+          "send the meeting notes before friday and check whether the pipeline passed on main "
+          "we should move the review to next week unless the build breaks again").split()
+
+
+def _lines(seed: int = 0, count: int = 4096) -> List[bytes]:
+    rng = random.Random(seed)
+    out = []
+    for _ in range(count):
+        words, width = [], 0
+        while width < 66:
+            word = rng.choice(_WORDS)
+            words.append(word)
+            width += len(word) + 1
+        out.append(" ".join(words).capitalize().encode() + b"\r\n")
+    return out
+
+
+_TEXT = _lines()
+
+
+# ---------------- the store ---------------- #
+
+class Folder:
+    """Messages by UID, oldest first, with their flags."""
+
+    def __init__(self, name: str, make: Optional[Callable[[int], bytes]] = None, count: int = 0,
+                 flagged: float = 0.0):
+        self.name = name
+        self.uidvalidity = int(time.time())
+        self._make = make
+        self._extra: Dict[int, bytes] = {}          # delivered / appended messages
+        self.uids: List[int] = list(range(1, count + 1))
+        self.uidnext = count + 1
+        every = round(1 / flagged) if flagged > 0 else 0
+        self.flags: Dict[int, Set[str]] = {uid: ({"\\Flagged"} if every and uid % every == 0 else set())
+                                           for uid in self.uids}
+        self._sizes: Dict[int, int] = {}
+        self.pop_locked = False
+        self.watchers: Set[asyncio.Queue] = set()    # IDLE sessions
+
+    def raw(self, uid: int) -> bytes:
+        return self._extra[uid] if uid in self._extra else self._make(uid)
+
+    def size(self, uid: int) -> int:
+        if uid not in self._sizes:
+            self._sizes[uid] = len(self.raw(uid))
+        return self._sizes[uid]
+
+    def add(self, raw: bytes, flags: Iterable[str] = ()) -> int:
+        """Append a message (on the server's loop); returns its UID."""
+        uid = self.uidnext
+        self.uidnext += 1
+        self._extra[uid] = raw if raw.endswith(b"\r\n") else raw + b"\r\n"
+        self.uids.append(uid)
+        self.flags[uid] = set(flags)
+        for watcher in list(self.watchers):
+            watcher.put_nowait(len(self.uids))
+        return uid
+
+    def remove(self, uids: Iterable[int]) -> List[int]:
+        """Drop *uids*; returns the sequence numbers they had, highest first."""
+        gone = set(uids)
+        seqs = [i + 1 for i, uid in enumerate(self.uids) if uid in gone]
+        self.uids = [uid for uid in self.uids if uid not in gone]
+        for uid in gone:
+            self.flags.pop(uid, None)
+            self._extra.pop(uid, None)
+            self._sizes.pop(uid, None)
+        return sorted(seqs, reverse=True)
+
+
+class Store:
+    """
+    Synthetic mailboxes.  The INBOX (and each of *folders*) starts with
+    *messages* messages of about *size* body bytes, plus a base64 attachment
+    of *attachment* bytes when non-zero and *extra_headers* filler headers;
+    one in 1/*flagged* is flagged.  With *loopback*, mail accepted over SMTP
+    is also delivered to the INBOX.
+    """
+
+    def __init__(self, messages: int = 100, size: int = 2000, attachment: int = 0, extra_headers: int = 0,
+                 flagged: float = 0.1, folders: Iterable[str] = (), loopback: bool = True, seed: int = 0):
+        self.size = size
+        self.attachment = attachment
+        self.extra_headers = extra_headers
+        self.seed = seed
+        self.loopback = loopback
+        self.sent: List[Tuple[str, List[str], bytes]] = []
+        self.folders: Dict[str, Folder] = {}
+        for name in ["INBOX", *folders]:
+            self.folders[name] = Folder(name, lru_cache(maxsize=1024)(lambda uid, name=name: self.message(name, uid)),
+                                        messages, flagged)
+
+    def message(self, folder: str, uid: int) -> bytes:
+        """The synthetic message *uid* of *folder* (the same bytes every time)."""
+        n = uid + self.seed
+        date = datetime(2026, 9, 1, tzinfo=timezone.utc) + timedelta(minutes=17 * uid)
+        head = [f"From: {SENDERS[n % len(SENDERS)]}",
+                "To: Fake User <fake@example.com>",
+                f"Subject: {SUBJECTS[n % len(SUBJECTS)].format(n=n)}",
+                f"Date: {format_datetime(date)}",
+                f"Message-ID: <{uid}.{self.seed}.{folder.lower()}@fake.example>",
+                "MIME-Version: 1.0"]
+        head += [f"X-Filler-{i}: {'x' * 40}" for i in range(self.extra_headers)]
+        start = (n * 7) % len(_TEXT)
+        body = b"".join(_TEXT[(start + i) % len(_TEXT)] for i in range(max(1, self.size // 72)))
+        if not self.attachment:
+            head.append("Content-Type: text/plain; charset=utf-8")
+            return ("\r\n".join(head) + "\r\n\r\n").encode() + body
+        boundary = f"=_fake_{uid}"
+        blob = base64.encodebytes(random.Random(n).randbytes(self.attachment)).replace(b"\n", b"\r\n")
+        head.append(f'Content-Type: multipart/mixed; boundary="{boundary}"')
+        return (("\r\n".join(head) + f"\r\n\r\n--{boundary}\r\nContent-Type: text/plain; charset=utf-8\r\n\r\n").encode()
+                + body + (f"--{boundary}\r\nContent-Type: application/octet-stream\r\n"
+                          f'Content-Disposition: attachment; filename="file{uid}.bin"\r\n'
+                          "Content-Transfer-Encoding: base64\r\n\r\n").encode()
+                + blob + f"--{boundary}--\r\n".encode())
+
+    def deliver(self, mail_from: str, rcpts: List[str], raw: bytes) -> None:
+        self.sent.append((mail_from, rcpts, raw))
+        if self.loopback:
+            self.folders["INBOX"].add(raw)
+
+
+# ---------------- faults ---------------- #
+
+class Faults:
+    """
+    *latency* seconds (plus up to *jitter*) per round trip, *bandwidth*
+    bytes/s per connection towards the client (0 = no cap), and per-command
+    probabilities in *fail*, *drop* and *hang* (see the module docstring).
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, bandwidth: int = 0,
+                 fail: Optional[Dict[str, float]] = None, drop: Optional[Dict[str, float]] = None,
+                 hang: Optional[Dict[str, float]] = None, seed: Optional[int] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.fail = dict(fail or {})
+        self.drop = dict(drop or {})
+        self.hang = dict(hang or {})
+        self._rng = random.Random(seed)
+
+    @staticmethod
+    def rates(spec: str) -> Dict[str, float]:
+        """``"RETR=0.1,CONNECT=0.5"`` -> {"RETR": 0.1, "CONNECT": 0.5}; a bare name means 1.0."""
+        out = {}
+        for item in filter(None, (part.strip() for part in spec.split(","))):
+            name, _, rate = item.partition("=")
+            out[name.strip().upper()] = float(rate) if rate else 1.0
+        return out
+
+    def hits(self, table: Dict[str, float], command: str) -> bool:
+        rate = table.get(command, table.get("*", 0.0))
+        return rate > 0 and self._rng.random() < rate
+
+    async def round_trip(self) -> None:
+        delay = self.latency + (self._rng.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class _Drop(Exception):
+    """Close the connection without a word."""
+
+
+# ---------------- connections ---------------- #
+
+class _Conn:
+    """One client connection: buffered line reads, throttled writes, TLS and DEFLATE."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, service: "_Service"):
+        self.reader = reader
+        self.writer = writer
+        self.service = service
+        self.faults = service.faults
+        self.stats = service.stats
+        self.tls = False
+        self.inflate = self.deflate = None
+        self._buf = bytearray()
+
+    async def _fill(self) -> bool:
+        chunk = await self.reader.read(65536)
+        if not chunk:
+            return False
+        self.stats["bytes_in"] += len(chunk)
+        self._buf += self.inflate.decompress(chunk) if self.inflate else chunk
+        return True
+
+    async def readline(self, round_trip: bool = True) -> Optional[bytes]:
+        """Next line without its CRLF, None at EOF.  Waiting for it costs a round trip."""
+        waited = False
+        while b"\n" not in self._buf:
+            if not await self._fill():
+                return None
+            waited = True
+        if waited and round_trip:
+            await self.faults.round_trip()
+        line, _, rest = bytes(self._buf).partition(b"\n")
+        self._buf = bytearray(rest)
+        return line.rstrip(b"\r")
+
+    async def read(self, n: int) -> Optional[bytes]:
+        while len(self._buf) < n:
+            if not await self._fill():
+                return None
+        data, self._buf = bytes(self._buf[:n]), self._buf[n:]
+        return data
+
+    async def send(self, data: bytes) -> None:
+        if self.deflate:
+            data = self.deflate.compress(data) + self.deflate.flush(zlib.Z_SYNC_FLUSH)
+        self.stats["bytes_out"] += len(data)
+        rate = self.faults.bandwidth
+        if not rate:
+            self.writer.write(data)
+            await self.writer.drain()
+            return
+        for start in range(0, len(data), CHUNK):
+            piece = data[start:start + CHUNK]
+            self.writer.write(piece)
+            await self.writer.drain()
+            await asyncio.sleep(len(piece) / rate)
+
+    async def start_tls(self, context: ssl.SSLContext) -> None:
+        await self.writer.start_tls(context)
+        self.tls = True
+
+    def compress(self) -> None:
+        self.inflate = zlib.decompressobj(-zlib.MAX_WBITS)
+        self.deflate = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+
+
+class _Service:
+    """One protocol's listener; subclasses implement session()."""
+
+    proto = ""
+    refusal = b""               # greeting when CONNECT fails
+
+    def __init__(self, store: Store, faults: Faults, stats: Counter, users: Optional[Dict[str, str]],
+                 tls: Optional[ssl.SSLContext]):
+        self.store = store
+        self.faults = faults
+        self.stats = stats
+        self.users = users
+        self.tls = tls
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        conn = _Conn(reader, writer, self)
+        self.stats[f"{self.proto}_connections"] += 1
+        try:
+            if await self.fault(conn, "CONNECT"):
+                await conn.send(self.refusal)
+            else:
+                await self.session(conn)
+        except (_Drop, ConnectionError, asyncio.IncompleteReadError, ssl.SSLError):
+            pass
+        except asyncio.CancelledError:          # stop() with the client still connected
+            pass
+        except Exception:
+            LOG.exception("fake %s session failed", self.proto)
+        finally:
+            writer.close()
+
+    async def fault(self, conn: _Conn, command: str) -> bool:
+        """Apply the faults for *command*: hang or drop here, True if it should fail."""
+        self.stats[f"{self.proto} {command}"] += 1
+        if self.faults.hits(self.faults.hang, command):
+            self.stats["hung"] += 1
+            await asyncio.sleep(HANG_SECONDS)
+            raise _Drop()
+        if self.faults.hits(self.faults.drop, command):
+            self.stats["dropped"] += 1
+            raise _Drop()
+        if self.faults.hits(self.faults.fail, command):
+            self.stats["failed"] += 1
+            return True
+        return False
+
+    def login(self, user: str, password: str) -> bool:
+        return self.users is None or self.users.get(user) == password
+
+    async def session(self, conn: _Conn) -> None:
+        raise NotImplementedError
+
+
+def _dotted(raw: bytes) -> bytes:
+    """A multi-line POP3 / SMTP payload: dot-stuffed, CRLF.CRLF terminated."""
+    data = re.sub(rb"(?m)^\.", b"..", raw)
+    if not data.endswith(b"\r\n"):
+        data += b"\r\n"
+    return data + b".\r\n"
+
+
+# ---------------- POP3 ---------------- #
+
+class POP3Service(_Service):
+    proto = "pop"
+    refusal = b"-ERR [SYS/TEMP] service unavailable\r\n"
+
+    async def session(self, conn: _Conn) -> None:
+        folder = self.store.folders["INBOX"]
+        user = None
+        ordinals: List[int] = []             # UIDs by message number, fixed for the session
+        deleted: Set[int] = set()
+        locked = False
+        await conn.send(b"+OK fake POP3 server ready\r\n")
+        try:
+            while True:
+                line = await conn.readline()
+                if line is None:
+                    return
+                cmd, _, arg = line.decode("utf-8", "replace").partition(" ")
+                cmd, args = cmd.upper(), arg.split()
+                if await self.fault(conn, cmd):
+                    await conn.send(b"-ERR injected failure\r\n")
+                    continue
+
+                def message(i: int = 0) -> Optional[int]:
+                    try:
+                        n = int(args[i])
+                    except (IndexError, ValueError):
+                        return None
+                    uid = ordinals[n - 1] if 0 < n <= len(ordinals) else None
+                    return None if uid in deleted or uid not in folder.flags else uid
+
+                if cmd == "CAPA":
+                    caps = ["TOP", "UIDL", "USER", "PIPELINING", "RESP-CODES"] + (["STLS"] if self.tls and not conn.tls else [])
+                    await conn.send(b"+OK\r\n" + "".join(f"{c}\r\n" for c in caps).encode() + b".\r\n")
+                elif cmd == "STLS" and self.tls and not conn.tls and not locked:
+                    await conn.send(b"+OK begin TLS\r\n")
+                    await conn.start_tls(self.tls)
+                elif cmd == "USER":
+                    user = arg
+                    await conn.send(b"+OK\r\n")
+                elif cmd == "PASS":
+                    if locked or user is None or not self.login(user, arg):
+                        await conn.send(b"-ERR [AUTH] invalid login\r\n")
+                    elif folder.pop_locked:
+                        await conn.send(b"-ERR [IN-USE] mailbox locked by another session\r\n")
+                    else:
+                        folder.pop_locked = locked = True
+                        ordinals = list(folder.uids)
+                        await conn.send(f"+OK {len(ordinals)} messages\r\n".encode())
+                elif cmd == "QUIT":
+                    if locked:
+                        folder.remove(deleted)
+                        folder.pop_locked = locked = False
+                    await conn.send(b"+OK bye\r\n")
+                    return
+                elif cmd == "NOOP" and locked:
+                    await conn.send(b"+OK\r\n")
+                elif not locked:
+                    await conn.send(b"-ERR log in first\r\n")
+                elif cmd == "STAT":
+                    live = [uid for uid in ordinals if uid not in deleted]
+                    await conn.send(f"+OK {len(live)} {sum(folder.size(uid) for uid in live)}\r\n".encode())
+                elif cmd in ("LIST", "UIDL"):
+                    value = folder.size if cmd == "LIST" else (lambda uid: f"uid-{folder.uidvalidity}-{uid}")
+                    if args:
+                        uid = message()
+                        await conn.send(f"+OK {args[0]} {value(uid)}\r\n".encode() if uid else b"-ERR no such message\r\n")
+                    else:
+                        rows = "".join(f"{n} {value(uid)}\r\n" for n, uid in enumerate(ordinals, 1) if uid not in deleted)
+                        await conn.send(f"+OK\r\n{rows}.\r\n".encode())
+                elif cmd in ("TOP", "RETR"):
+                    uid = message()
+                    if uid is None:
+                        await conn.send(b"-ERR no such message\r\n")
+                        continue
+                    raw = folder.raw(uid)
+                    if cmd == "TOP":
+                        head, _, body = raw.partition(b"\r\n\r\n")
+                        lines = int(args[1]) if len(args) > 1 and args[1].isdigit() else 0
+                        raw = head + b"\r\n\r\n" + b"".join(body.splitlines(keepends=True)[:lines])
+                    await conn.send(f"+OK {len(raw)} octets\r\n".encode() + _dotted(raw))
+                elif cmd == "DELE":
+                    uid = message()
+                    if uid is not None:
+                        deleted.add(uid)
+                    await conn.send(b"+OK deleted\r\n" if uid else b"-ERR no such message\r\n")
+                elif cmd == "RSET":
+                    deleted.clear()
+                    await conn.send(b"+OK\r\n")
+                else:
+                    await conn.send(b"-ERR unknown command\r\n")
+        finally:
+            if locked:                       # no QUIT: nothing is deleted
+                folder.pop_locked = False
+
+
+# ---------------- IMAP ---------------- #
+
+class _Bad(ValueError):
+    """A command the fake cannot parse; answered with BAD."""
+
+
+_TOKEN = re.compile(r'"((?:[^"\\]|\\.)*)"|([()])|([^\s()"]+)')
+_LITERAL = re.compile(rb"\{(\d+)(\+?)\}$")
+_FETCH_ITEM = re.compile(r"(BODY\.PEEK|BODY|BINARY\.PEEK|BINARY)\[([^\]]*)\](?:<(\d+)\.(\d+)>)?|([A-Z0-9.]+)")
+_SEARCH_FLAGS = {"FLAGGED": ("\\Flagged", True), "UNFLAGGED": ("\\Flagged", False),
+                 "SEEN": ("\\Seen", True), "UNSEEN": ("\\Seen", False),
+                 "DELETED": ("\\Deleted", True), "UNDELETED": ("\\Deleted", False),
+                 "ANSWERED": ("\\Answered", True), "UNANSWERED": ("\\Answered", False),
+                 "DRAFT": ("\\Draft", True), "UNDRAFT": ("\\Draft", False)}
+_SEARCH_TEXT = {"TEXT": None, "BODY": None, "SUBJECT": "Subject", "FROM": "From", "TO": "To", "CC": "Cc"}
+
+
+def _tokens(text: str) -> List[str]:
+    """Atoms and (unquoted) strings; parentheses are dropped."""
+    out = []
+    for quoted, paren, atom in _TOKEN.findall(text):
+        if not paren:
+            out.append(re.sub(r"\\(.)", r"\1", quoted) if atom == "" else atom)
+    return out
+
+
+def _quote(text: str) -> str:
+    return '"' + text.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _header_fields(raw: bytes, names: Optional[Set[str]], exclude: bool = False) -> bytes:
+    """The header block, or only (or all but) the fields in *names*, CRLF terminated."""
+    head = raw.partition(b"\r\n\r\n")[0] + b"\r\n"
+    if names is None:
+        return head + b"\r\n"
+    fields: List[bytes] = []
+    for line in head.splitlines(keepends=True):
+        if line[:1] in (b" ", b"\t") and fields:
+            fields[-1] += line
+        else:
+            fields.append(line)
+    keep = [f for f in fields if (f.partition(b":")[0].strip().decode("ascii", "replace").upper() in names) != exclude]
+    return b"".join(keep) + b"\r\n"
+
+
+class IMAPService(_Service):
+    proto = "imap"
+    refusal = b"* BYE service unavailable\r\n"
+
+    def caps(self, conn: _Conn) -> str:
+        caps = ["IMAP4rev1", "IDLE", "UIDPLUS", "AUTH=PLAIN"]
+        if not conn.deflate:
+            caps.append("COMPRESS=DEFLATE")
+        if self.tls and not conn.tls:
+            caps.append("STARTTLS")
+        return " ".join(caps)
+
+    async def _command(self, conn: _Conn) -> Optional[bytes]:
+        """One command line, literals included (as quoted strings)."""
+        line = await conn.readline()
+        if line is None:
+            return None
+        parts = []
+        while True:
+            literal = _LITERAL.search(line)
+            if not literal:
+                parts.append(line)
+                return b"".join(parts)
+            if not literal.group(2):
+                await conn.send(b"+ Ready for literal data\r\n")
+            data = await conn.read(int(literal.group(1)))
+            rest = await conn.readline()
+            if data is None or rest is None:
+                return None
+            parts.append(line[:literal.start()] + _quote(data.decode("utf-8", "replace")).encode())
+            line = rest
+
+    async def session(self, conn: _Conn) -> None:
+        user = None
+        folder: Optional[Folder] = None
+        readonly = False
+        await conn.send(f"* OK [CAPABILITY {self.caps(conn)}] fake IMAP server ready\r\n".encode())
+        while True:
+            line = await self._command(conn)
+            if line is None:
+                return
+            tag, _, rest = line.decode("utf-8", "replace").partition(" ")
+            cmd, _, args = rest.partition(" ")
+            cmd = cmd.upper()
+            uid = cmd == "UID"
+            if uid:
+                cmd, _, args = args.partition(" ")
+                cmd = cmd.upper()
+            if await self.fault(conn, cmd):
+                await conn.send(f"{tag} NO [UNAVAILABLE] injected failure\r\n".encode())
+                continue
+            try:
+                if cmd == "CAPABILITY":
+                    await conn.send(f"* CAPABILITY {self.caps(conn)}\r\n".encode())
+                elif cmd == "NOOP":
+                    if folder is not None:
+                        await conn.send(f"* {len(folder.uids)} EXISTS\r\n".encode())
+                elif cmd == "LOGOUT":
+                    await conn.send(f"* BYE fake IMAP server logging out\r\n{tag} OK LOGOUT completed\r\n".encode())
+                    return
+                elif cmd == "STARTTLS" and self.tls and not conn.tls and user is None:
+                    await conn.send(f"{tag} OK begin TLS negotiation now\r\n".encode())
+                    await conn.start_tls(self.tls)
+                    continue
+                elif cmd == "COMPRESS" and args.upper() == "DEFLATE" and not conn.deflate:
+                    await conn.send(f"{tag} OK DEFLATE active\r\n".encode())
+                    conn.compress()
+                    continue
+                elif cmd == "LOGIN":
+                    words = _tokens(args)
+                    if len(words) != 2 or not self.login(*words):
+                        await conn.send(f"{tag} NO [AUTHENTICATIONFAILED] invalid login\r\n".encode())
+                        continue
+                    user = words[0]
+                elif user is None:
+                    await conn.send(f"{tag} NO log in first\r\n".encode())
+                    continue
+                elif cmd == "LIST":
+                    ref, pattern = (_tokens(args) + ["", ""])[:2]
+                    regex = re.compile(re.escape(ref + pattern).replace(r"\*", ".*").replace("%", "[^/]*") + "$", re.I)
+                    rows = "".join(f'* LIST (\\HasNoChildren) "/" {_quote(name)}\r\n'
+                                   for name in self.store.folders if pattern == "" or regex.match(name))
+                    await conn.send(rows.encode())
+                elif cmd in ("SELECT", "EXAMINE"):
+                    name = (_tokens(args) or [""])[0]
+                    name = "INBOX" if name.upper() == "INBOX" else name
+                    if name not in self.store.folders:
+                        folder = None
+                        await conn.send(f"{tag} NO [NONEXISTENT] no such mailbox\r\n".encode())
+                        continue
+                    folder, readonly = self.store.folders[name], cmd == "EXAMINE"
+                    await conn.send((f"* {len(folder.uids)} EXISTS\r\n* 0 RECENT\r\n"
+                                     "* FLAGS (\\Answered \\Flagged \\Deleted \\Seen \\Draft)\r\n"
+                                     f"* OK [UIDVALIDITY {folder.uidvalidity}] UIDs valid\r\n"
+                                     f"* OK [UIDNEXT {folder.uidnext}] predicted next UID\r\n"
+                                     f"{tag} OK [{'READ-ONLY' if readonly else 'READ-WRITE'}] {cmd} completed\r\n").encode())
+                    continue
+                elif folder is None:
+                    await conn.send(f"{tag} NO select a mailbox first\r\n".encode())
+                    continue
+                elif cmd == "SEARCH":
+                    found = self._search(folder, _tokens(args))
+                    numbers = found if uid else [folder.uids.index(u) + 1 for u in found]
+                    await conn.send(f"* SEARCH{''.join(f' {n}' for n in numbers)}\r\n".encode())
+                elif cmd == "FETCH":
+                    spec, _, items = args.partition(" ")
+                    await self._fetch(conn, folder, self._set(folder, spec, uid), items, uid, readonly)
+                elif cmd == "STORE":
+                    spec, _, rest = args.partition(" ")
+                    await self._store(conn, folder, self._set(folder, spec, uid), rest, uid, readonly)
+                elif cmd in ("EXPUNGE", "CLOSE", "UNSELECT"):
+                    if not readonly and cmd != "UNSELECT":
+                        seqs = folder.remove([u for u in folder.uids if "\\Deleted" in folder.flags[u]])
+                        if cmd == "EXPUNGE":
+                            await conn.send("".join(f"* {n} EXPUNGE\r\n" for n in seqs).encode())
+                    if cmd != "EXPUNGE":
+                        folder = None
+                elif cmd == "IDLE":
+                    await self._idle(conn, tag, folder)
+                    continue
+                else:
+                    await conn.send(f"{tag} BAD unknown command\r\n".encode())
+                    continue
+            except _Bad as exc:
+                await conn.send(f"{tag} BAD {exc}\r\n".encode())
+                continue
+            await conn.send(f"{tag} OK {'UID ' if uid else ''}{cmd} completed\r\n".encode())
+
+    @staticmethod
+    def _set(folder: Folder, spec: str, uid: bool) -> List[int]:
+        """UIDs named by a sequence set (of UIDs when *uid*), in mailbox order."""
+        if not folder.uids:
+            return []
+        top = folder.uids[-1] if uid else len(folder.uids)
+        wanted: Set[int] = set()
+        try:
+            for part in spec.split(","):
+                lo, _, hi = part.partition(":")
+                lo = top if lo == "*" else int(lo)
+                hi = lo if not hi else top if hi == "*" else int(hi)
+                wanted.update(range(min(lo, hi), max(lo, hi) + 1))
+        except ValueError:
+            raise _Bad("invalid sequence set") from None
+        if uid:
+            return [u for u in folder.uids if u in wanted]
+        return [folder.uids[n - 1] for n in sorted(wanted) if 0 < n <= len(folder.uids)]
+
+    def _search(self, folder: Folder, words: List[str]) -> List[int]:
+        tests: List[Callable[[int], bool]] = []
+        i = 0
+        while i < len(words):
+            key = words[i].upper()
+            i += 1
+            if key == "ALL":
+                continue
+            if key == "CHARSET":
+                i += 1
+            elif key in _SEARCH_FLAGS:
+                flag, present = _SEARCH_FLAGS[key]
+                tests.append(lambda u, f=flag, p=present: (f in folder.flags[u]) == p)
+            elif key in _SEARCH_TEXT and i < len(words):
+                needle, field = words[i].lower().encode(), _SEARCH_TEXT[key]
+                i += 1
+                if field is None:
+                    tests.append(lambda u, n=needle: n in folder.raw(u).lower())
+                else:
+                    names = {field.upper()}
+                    tests.append(lambda u, n=needle, s=names: n in _header_fields(folder.raw(u), s).lower())
+            elif key == "UID" and i < len(words):
+                allowed = set(self._set(folder, words[i], True))
+                i += 1
+                tests.append(lambda u, a=allowed: u in a)
+            elif re.fullmatch(r"[\d*:,]+", key):
+                allowed = set(self._set(folder, key, False))
+                tests.append(lambda u, a=allowed: u in a)
+            else:
+                raise _Bad(f"unsupported search key {key}")
+        return [u for u in folder.uids if all(test(u) for test in tests)]
+
+    async def _fetch(self, conn: _Conn, folder: Folder, uids: List[int], items: str, uid: bool,
+                     readonly: bool) -> None:
+        items = items.strip()
+        if items.startswith("(") and items.endswith(")"):
+            items = items[1:-1]
+        macros = {"FAST": "FLAGS INTERNALDATE RFC822.SIZE", "ALL": "FLAGS INTERNALDATE RFC822.SIZE"}
+        items = macros.get(items.upper(), items)
+        wanted = [m.groups() for m in _FETCH_ITEM.finditer(items.upper())]
+        if not wanted:
+            raise _Bad("nothing to fetch")
+        out = bytearray()
+        for u in uids:
+            raw = folder.raw(u)
+            parts: List[bytes] = [f"UID {u}".encode()] if uid else []
+            marks_seen = False
+            for kind, section, offset, length, simple in wanted:
+                if simple:
+                    if simple == "UID":
+                        if not uid:
+                            parts.append(f"UID {u}".encode())
+                        continue
+                    if simple == "FLAGS":
+                        parts.append(f"FLAGS ({' '.join(sorted(folder.flags[u]))})".encode())
+                        continue
+                    if simple == "RFC822.SIZE":
+                        parts.append(f"RFC822.SIZE {len(raw)}".encode())
+                        continue
+                    if simple == "INTERNALDATE":
+                        date = datetime(2026, 9, 1, tzinfo=timezone.utc) + timedelta(minutes=17 * u)
+                        parts.append(f'INTERNALDATE "{date.strftime("%d-%b-%Y %H:%M:%S +0000")}"'.encode())
+                        continue
+                    kind, section = {"RFC822": ("BODY", ""), "RFC822.HEADER": ("BODY.PEEK", "HEADER"),
+                                     "RFC822.TEXT": ("BODY", "TEXT")}.get(simple, (None, None))
+                    if kind is None:
+                        raise _Bad(f"unsupported fetch item {simple}")
+                    name = simple
+                else:
+                    name = f"{kind.replace('.PEEK', '')}[{section}]" + (f"<{offset}>" if offset else "")
+                data = self._section(raw, section)
+                if offset:
+                    data = data[int(offset):int(offset) + int(length)]
+                marks_seen |= not kind.endswith(".PEEK")
+                parts.append(f"{name} {{{len(data)}}}\r\n".encode() + data)
+            if marks_seen and not readonly and "\\Seen" not in folder.flags[u]:
+                folder.flags[u].add("\\Seen")
+                if not any(w[4] == "FLAGS" for w in wanted):
+                    parts.append(f"FLAGS ({' '.join(sorted(folder.flags[u]))})".encode())
+            out += f"* {folder.uids.index(u) + 1} FETCH (".encode() + b" ".join(parts) + b")\r\n"
+        await conn.send(bytes(out))
+
+    @staticmethod
+    def _section(raw: bytes, section: str) -> bytes:
+        if section == "":
+            return raw
+        if section == "HEADER":
+            return _header_fields(raw, None)
+        if section == "TEXT":
+            return raw.partition(b"\r\n\r\n")[2]
+        fields = re.fullmatch(r"HEADER\.FIELDS(\.NOT)?\s*\(([^)]*)\)", section)
+        if fields:
+            return _header_fields(raw, set(fields.group(2).split()), exclude=bool(fields.group(1)))
+        raise _Bad(f"unsupported section {section}")
+
+    async def _store(self, conn: _Conn, folder: Folder, uids: List[int], rest: str, uid: bool,
+                     readonly: bool) -> None:
+        match = re.fullmatch(r"([+-]?)FLAGS(\.SILENT)?\s+\(?([^)]*)\)?", rest.strip(), re.I)
+        if not match:
+            raise _Bad("invalid STORE")
+        if readonly:
+            raise _Bad("mailbox is read-only")
+        op, silent, names = match.group(1), match.group(2), set(match.group(3).split())
+        out = []
+        for u in uids:
+            flags = folder.flags[u]
+            if op == "+":
+                flags |= names
+            elif op == "-":
+                flags -= names
+            else:
+                flags.clear()
+                flags |= names
+            if not silent:
+                out.append(f"* {folder.uids.index(u) + 1} FETCH ({f'UID {u} ' if uid else ''}"
+                           f"FLAGS ({' '.join(sorted(flags))}))\r\n")
+        await conn.send("".join(out).encode())
+
+    async def _idle(self, conn: _Conn, tag: str, folder: Folder) -> None:
+        news: asyncio.Queue = asyncio.Queue()
+        folder.watchers.add(news)
+        await conn.send(b"+ idling\r\n")
+        done = asyncio.ensure_future(conn.readline(round_trip=False))
+        try:
+            while True:
+                arrived = asyncio.ensure_future(news.get())
+                await asyncio.wait({done, arrived}, return_when=asyncio.FIRST_COMPLETED)
+                if arrived.done():
+                    await conn.send(f"* {arrived.result()} EXISTS\r\n".encode())
+                else:
+                    arrived.cancel()
+                if done.done():
+                    break
+        finally:
+            folder.watchers.discard(news)
+            if not done.done():
+                done.cancel()
+        if done.result() is None:
+            raise _Drop()
+        await conn.send(f"{tag} OK IDLE terminated\r\n".encode())
+
+
+# ---------------- SMTP ---------------- #
+
+class SMTPService(_Service):
+    proto = "smtp"
+    refusal = b"554 5.3.2 service unavailable\r\n"
+    max_size = 50 << 20
+
+    async def session(self, conn: _Conn) -> None:
+        mail_from: Optional[str] = None
+        rcpts: List[str] = []
+        chunks: List[bytes] = []
+        authed = self.users is None
+        await conn.send(b"220 fake.example ESMTP fake SMTP server ready\r\n")
+        while True:
+            line = await conn.readline()
+            if line is None:
+                return
+            verb, _, arg = line.decode("utf-8", "replace").partition(" ")
+            verb = verb.upper()
+            if verb == "BDAT":                       # the chunk follows the command at once
+                words = arg.split()
+                size = int(words[0]) if words and words[0].isdigit() else -1
+                data = await conn.read(size) if size >= 0 else b""
+                if data is None:
+                    return
+            if await self.fault(conn, verb):
+                await conn.send(b"451 4.3.0 injected failure\r\n")
+                continue
+            if verb in ("EHLO", "HELO"):
+                mail_from, rcpts, chunks = None, [], []
+                if verb == "HELO":
+                    await conn.send(b"250 fake.example\r\n")
+                    continue
+                exts = ["PIPELINING", "CHUNKING", "8BITMIME", "SMTPUTF8", "ENHANCEDSTATUSCODES",
+                        f"SIZE {self.max_size}", "AUTH PLAIN LOGIN"]
+                if self.tls and not conn.tls:
+                    exts.append("STARTTLS")
+                lines = ["fake.example"] + exts
+                await conn.send("".join(f"250{'-' if i < len(lines) - 1 else ' '}{text}\r\n"
+                                        for i, text in enumerate(lines)).encode())
+            elif verb == "STARTTLS" and self.tls and not conn.tls:
+                await conn.send(b"220 2.0.0 ready to start TLS\r\n")
+                await conn.start_tls(self.tls)
+                mail_from, rcpts, chunks = None, [], []
+            elif verb == "AUTH":
+                authed = await self._auth(conn, arg.split())
+                await conn.send(b"235 2.7.0 authenticated\r\n" if authed else b"535 5.7.8 invalid login\r\n")
+            elif verb == "MAIL":
+                address = re.match(r"(?i)FROM:\s*<([^>]*)>", arg)
+                if not authed:
+                    await conn.send(b"530 5.7.0 authentication required\r\n")
+                elif not address or mail_from is not None:
+                    await conn.send(b"503 5.5.1 bad sequence of commands\r\n")
+                else:
+                    mail_from, rcpts, chunks = address.group(1), [], []
+                    await conn.send(b"250 2.1.0 sender ok\r\n")
+            elif verb == "RCPT":
+                address = re.match(r"(?i)TO:\s*<([^>]*)>", arg)
+                if mail_from is None or not address:
+                    await conn.send(b"503 5.5.1 need MAIL first\r\n")
+                elif address.group(1).lower().startswith("reject"):
+                    await conn.send(b"550 5.1.1 mailbox unavailable\r\n")
+                else:
+                    rcpts.append(address.group(1))
+                    await conn.send(b"250 2.1.5 recipient ok\r\n")
+            elif verb == "DATA":
+                if not rcpts:
+                    await conn.send(b"554 5.5.1 no valid recipients\r\n")
+                    continue
+                await conn.send(b"354 end data with <CR><LF>.<CR><LF>\r\n")
+                body = bytearray()
+                while True:
+                    piece = await conn.readline(round_trip=False)
+                    if piece is None:
+                        return
+                    if piece == b".":
+                        break
+                    body += (piece[1:] if piece.startswith(b".") else piece) + b"\r\n"
+                self.store.deliver(mail_from, rcpts, bytes(body))
+                self.stats["smtp_messages"] += 1
+                mail_from, rcpts = None, []
+                await conn.send(b"250 2.0.0 queued\r\n")
+            elif verb == "BDAT":
+                if not rcpts or size < 0:
+                    await conn.send(b"503 5.5.1 no valid recipients\r\n")
+                    continue
+                chunks.append(data)
+                if "LAST" not in arg.upper():
+                    await conn.send(f"250 2.0.0 {size} octets received\r\n".encode())
+                    continue
+                self.store.deliver(mail_from, rcpts, b"".join(chunks))
+                self.stats["smtp_messages"] += 1
+                mail_from, rcpts, chunks = None, [], []
+                await conn.send(b"250 2.0.0 queued\r\n")
+            elif verb == "RSET":
+                mail_from, rcpts, chunks = None, [], []
+                await conn.send(b"250 2.0.0 ok\r\n")
+            elif verb == "NOOP":
+                await conn.send(b"250 2.0.0 ok\r\n")
+            elif verb == "VRFY":
+                await conn.send(b"252 2.1.5 cannot verify\r\n")
+            elif verb == "QUIT":
+                await conn.send(b"221 2.0.0 bye\r\n")
+                return
+            else:
+                await conn.send(b"500 5.5.2 unknown command\r\n")
+
+    async def _auth(self, conn: _Conn, words: List[str]) -> bool:
+        mech = words[0].upper() if words else ""
+        try:
+            if mech == "PLAIN":
+                if len(words) > 1:
+                    token = words[1]
+                else:
+                    await conn.send(b"334 \r\n")
+                    token = (await conn.readline() or b"").decode()
+                _, user, password = base64.b64decode(token).decode("utf-8").split("\0")
+            elif mech == "LOGIN":
+                if len(words) > 1:
+                    user = base64.b64decode(words[1]).decode("utf-8")
+                else:
+                    await conn.send(b"334 VXNlcm5hbWU6\r\n")
+                    user = base64.b64decode(await conn.readline() or b"").decode("utf-8")
+                await conn.send(b"334 UGFzc3dvcmQ6\r\n")
+                password = base64.b64decode(await conn.readline() or b"").decode("utf-8")
+            else:
+                return False
+        except ValueError:
+            return False
+        return self.login(user, password)
+
+
+# ---------------- running them ---------------- #
+
+def self_signed() -> ssl.SSLContext:
+    """A server context with a throwaway self-signed certificate for localhost (needs openssl)."""
+    with tempfile.TemporaryDirectory() as tmp:
+        cert, key = os.path.join(tmp, "cert.pem"), os.path.join(tmp, "key.pem")
+        try:
+            subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "2",
+                            "-subj", "/CN=localhost", "-keyout", key, "-out", cert],
+                           check=True, capture_output=True)
+        except (OSError, subprocess.CalledProcessError) as exc:
+            raise RuntimeError(f"could not make a self-signed certificate with openssl: {exc}") from exc
+        context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        context.load_cert_chain(cert, key)
+    return context
+
+
+class FakeMail:
+    """
+    POP3, IMAP and SMTP stand-ins on one event loop in a background thread.
+    A port of 0 picks a free one, None leaves that protocol off.  With
+    *users* ({user: password}) only those logins work; by default any does.
+    *tls* (True for a self-signed certificate, or a server SSLContext)
+    offers STLS / STARTTLS.
+    """
+
+    def __init__(self, store: Optional[Store] = None, faults: Optional[Faults] = None, host: str = "127.0.0.1",
+                 pop_port: Optional[int] = 0, imap_port: Optional[int] = 0, smtp_port: Optional[int] = 0,
+                 users: Optional[Dict[str, str]] = None, tls=False):
+        self.store = store or Store()
+        self.faults = faults or Faults()
+        self.host = host
+        self.ports: Dict[str, Optional[int]] = {"pop": pop_port, "imap": imap_port, "smtp": smtp_port}
+        self.users = users
+        self.stats: Counter = Counter()
+        context = self_signed() if tls is True else tls or None
+        self._services = {proto: cls(self.store, self.faults, self.stats, users, context) for proto, cls in
+                          (("pop", POP3Service), ("imap", IMAPService), ("smtp", SMTPService))}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stop: Optional[asyncio.Event] = None
+        self._thread: Optional[threading.Thread] = None
+
+    async def serve(self, ready: Optional[threading.Event] = None) -> None:
+        """Listen until stop(); ports are known once *ready* is set."""
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        servers = []
+        try:
+            for proto, port in self.ports.items():
+                if port is not None:
+                    server = await asyncio.start_server(self._services[proto].handle, self.host, port)
+                    self.ports[proto] = server.sockets[0].getsockname()[1]
+                    servers.append(server)
+        finally:
+            if ready is not None:
+                ready.set()
+        try:
+            await self._stop.wait()
+        finally:
+            for server in servers:
+                server.close()
+                await server.wait_closed()
+
+    def start(self) -> "FakeMail":
+        ready = threading.Event()
+        failed: List[BaseException] = []
+
+        def run():
+            try:
+                asyncio.run(self.serve(ready))
+            except BaseException as exc:     # e.g. the port is taken
+                failed.append(exc)
+                ready.set()
+
+        self._thread = threading.Thread(target=run, name="fake-mail", daemon=True)
+        self._thread.start()
+        ready.wait()
+        if failed:
+            raise failed[0]
+        return self
+
+    def stop(self) -> None:
+        if self._loop is not None and self._stop is not None:
+            self._loop.call_soon_threadsafe(self._stop.set)
+        if self._thread is not None:
+            self._thread.join(5)
+
+    def __enter__(self) -> "FakeMail":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def deliver(self, raw: bytes, folder: str = "INBOX") -> None:
+        """Add a message from another thread (IDLE sessions hear about it)."""
+        self._loop.call_soon_threadsafe(self.store.folders[folder].add, raw)
+
+    def env(self, user: Optional[str] = None, password: Optional[str] = None) -> Dict[str, str]:
+        """MAIL_* settings pointing the servers here at the fakes (plaintext)."""
+        if user is None:
+            user, password = next(iter(self.users.items())) if self.users else ("fake@example.com", "fake")
+        env = {"MAIL_HOST": self.host, "MAIL_USER": user, "MAIL_PASS": password or "", "MAIL_SSL": "0",
+               "MAIL_ALLOW_SELF_SIGNED": "1"}
+        names = {"pop": "MAIL_POP_PORT", "imap": "MAIL_IMAP_PORT", "smtp": "MAIL_SMTP_PORT"}
+        env.update((names[proto], str(port)) for proto, port in self.ports.items() if port is not None)
+        return env
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Local fake POP3/IMAP/SMTP servers.",
+                                     epilog="Anything after -- is run with the MAIL_* settings pointing here.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--pop-port", type=int, default=0)
+    parser.add_argument("--imap-port", type=int, default=0)
+    parser.add_argument("--smtp-port", type=int, default=0)
+    parser.add_argument("--messages", type=int, default=100, help="messages per folder")
+    parser.add_argument("--size", type=int, default=2000, help="body bytes per message")
+    parser.add_argument("--attachment", type=int, default=0, help="attachment bytes per message")
+    parser.add_argument("--extra-headers", type=int, default=0)
+    parser.add_argument("--flagged", type=float, default=0.1, help="fraction of messages flagged")
+    parser.add_argument("--folders", default="", help="comma-separated folders besides INBOX")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per round trip")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--kbps", type=int, default=0, help="bandwidth cap per connection, 0 = none")
+    parser.add_argument("--fail", default="", help='error replies, e.g. "RETR=0.1,FETCH=0.05"')
+    parser.add_argument("--drop", default="", help="dropped connections, same form")
+    parser.add_argument("--hang", default="", help="commands never answered, same form")
+    parser.add_argument("--user", help="only this login works (with --password)")
+    parser.add_argument("--password", default="fake")
+    parser.add_argument("--tls", action=argparse.BooleanOptionalAction, default=True,
+                        help="offer STARTTLS with a self-signed certificate (default; mail_mcp insists on it)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("command", nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+
+    store = Store(args.messages, args.size, args.attachment, args.extra_headers, args.flagged,
+                  [f for f in args.folders.split(",") if f], seed=args.seed)
+    faults = Faults(args.latency, args.jitter, args.kbps * 1000 // 8, Faults.rates(args.fail),
+                    Faults.rates(args.drop), Faults.rates(args.hang), seed=args.seed)
+    fake = FakeMail(store, faults, args.host, args.pop_port, args.imap_port, args.smtp_port,
+                    {args.user: args.password} if args.user else None, args.tls)
+    command = args.command[1:] if args.command[:1] == ["--"] else args.command
+    code = 0
+    with fake:
+        env = fake.env()
+        if command:
+            code = subprocess.call(command, env={**os.environ, **env})
+        else:
+            print("".join(f"export {k}={v}\n" for k, v in env.items()), end="", flush=True)
+            try:
+                threading.Event().wait()
+            except KeyboardInterrupt:
+                pass
+    print(dict(fake.stats), file=sys.stderr)
+    return code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,85 @@
+"""
+http_static.py – Static HTTP responses rendered once and served from memory.
+
+A ``StaticResource`` holds a body plus its gzip (and, when the optional
+``brotli`` package is installed, brotli) encodings, each with a strong
+ETag.  ``respond`` picks the encoding from Accept-Encoding and answers
+``If-None-Match`` with 304, so pollers that revalidate get an empty reply.
+"""
+import gzip, json, hashlib
+from typing import Dict, List, Tuple
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+try:
+    import brotli
+except ImportError:             # gzip only
+    brotli = None
+
+MIN_COMPRESS = 256              # smaller bodies are not worth an encoding
+
+
+def _accepted(header: str) -> Dict[str, float]:
+    out: Dict[str, float] = {}
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            out[name.lower()] = q
+    return out
+
+
+class StaticResource:
+    """One precomputed representation per content coding."""
+
+    def __init__(self, body: bytes, media_type: str, max_age: int = 3600):
+        self.media_type = media_type
+        self.cache_control = f"public, max-age={max_age}"
+        tag = hashlib.sha256(body).hexdigest()[:32]
+        # (coding, body, etag) in preference order; identity last
+        self.variants: List[Tuple[str, bytes, str]] = []
+        if len(body) >= MIN_COMPRESS:
+            if brotli is not None:
+                self._add("br", brotli.compress(body, quality=11), body, tag)
+            self._add("gzip", gzip.compress(body, 9, mtime=0), body, tag)
+        self.variants.append(("identity", body, f'"{tag}"'))
+        self._etags = {etag for _, _, etag in self.variants}
+
+    def _add(self, coding: str, encoded: bytes, body: bytes, tag: str) -> None:
+        if len(encoded) < len(body):
+            self.variants.append((coding, encoded, f'"{tag}-{coding}"'))
+
+    def _choose(self, accept_encoding: str) -> Tuple[str, bytes, str]:
+        accepted = _accepted(accept_encoding)
+        for variant in self.variants[:-1]:
+            if accepted.get(variant[0], accepted.get("*", 0.0)) > 0:
+                return variant
+        return self.variants[-1]
+
+    async def respond(self, request: Request) -> Response:
+        coding, body, etag = self._choose(request.headers.get("accept-encoding", ""))
+        headers = {"ETag": etag, "Cache-Control": self.cache_control, "Vary": "Accept-Encoding"}
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and (if_none_match.strip() == "*" or
+                              self._etags & {t.strip().removeprefix("W/") for t in if_none_match.split(",")}):
+            return Response(status_code=304, headers=headers)
+        if coding != "identity":
+            headers["Content-Encoding"] = coding
+        return Response(body, media_type=self.media_type, headers=headers)
+
+
+def json_resource(obj, max_age: int = 3600) -> StaticResource:
+    body = json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return StaticResource(body, "application/json", max_age)
+
+
+def file_resource(path: str, media_type: str, max_age: int = 86400) -> StaticResource:
+    with open(path, "rb") as fp:
+        return StaticResource(fp.read(), media_type, max_age)
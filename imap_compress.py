@@ -0,0 +1,95 @@
+"""
+imap_compress.py – RFC 4978 COMPRESS=DEFLATE for imaplib connections.
+
+``enable(imap)`` issues ``COMPRESS DEFLATE`` and, once the server says OK,
+swaps the connection's reader and ``send`` for raw-deflate streams.  Every
+later command and response (headers, bodies, literals) goes over the wire
+compressed; imaplib itself is none the wiser.
+"""
+import imaplib, threading, zlib, logging
+from typing import Dict
+
+LOG = logging.getLogger("imap_compress")
+
+# imaplib refuses commands it does not know about
+imaplib.Commands.setdefault("COMPRESS", ("AUTH", "SELECTED"))
+
+_lock = threading.Lock()
+_stats = {"wire_in": 0, "plain_in": 0, "wire_out": 0, "plain_out": 0}
+
+
+class DeflateStream:
+    """Reader/writer pair standing in for ``imap.file`` and ``imap.send``."""
+
+    def __init__(self, raw_file, sock, level: int = 6):
+        self._raw = raw_file
+        self._sock = sock
+        self._inflate = zlib.decompressobj(-zlib.MAX_WBITS)
+        self._deflate = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        self._buf = bytearray()
+
+    def _fill(self) -> bool:
+        chunk = self._raw.read1(65536)
+        if not chunk:
+            return False
+        plain = self._inflate.decompress(chunk)
+        self._buf += plain
+        _count("wire_in", len(chunk), "plain_in", len(plain))
+        return True
+
+    def read(self, size: int) -> bytes:
+        while len(self._buf) < size and self._fill():
+            pass
+        data = bytes(self._buf[:size])
+        del self._buf[:size]
+        return data
+
+    def readline(self, limit: int = -1) -> bytes:
+        while True:
+            end = self._buf.find(b"\n")
+            if end >= 0:
+                end += 1
+                break
+            if 0 < limit <= len(self._buf) or not self._fill():
+                end = len(self._buf)
+                break
+        if limit > 0:
+            end = min(end, limit)
+        line = bytes(self._buf[:end])
+        del self._buf[:end]
+        return line
+
+    def send(self, data: bytes) -> None:
+        wire = self._deflate.compress(data) + self._deflate.flush(zlib.Z_SYNC_FLUSH)
+        self._sock.sendall(wire)
+        _count("wire_out", len(wire), "plain_out", len(data))
+
+    def close(self) -> None:
+        self._raw.close()
+
+
+def enable(imap: imaplib.IMAP4, level: int = 6) -> bool:
+    """Negotiate COMPRESS=DEFLATE; returns False if the server declined."""
+    try:
+        typ, data = imap._simple_command("COMPRESS", "DEFLATE")
+    except imaplib.IMAP4.error as e:
+        LOG.debug("COMPRESS DEFLATE refused: %s", e)
+        return False
+    if typ != "OK":
+        return False
+    stream = DeflateStream(imap.file, imap.sock, level)
+    imap.file = stream
+    imap.send = stream.send
+    return True
+
+
+def _count(wire_key: str, wire: int, plain_key: str, plain: int) -> None:
+    with _lock:
+        _stats[wire_key] += wire
+        _stats[plain_key] += plain
+
+
+def stats() -> Dict[str, int]:
+    """Cumulative compressed (wire) vs uncompressed (plain) byte counts."""
+    with _lock:
+        return dict(_stats)
@@ -0,0 +1,216 @@
+"""
+mail_accounts.py – Per-user mailboxes for one multi-account server.
+
+Account settings are cheap dicts: the MAIL_* environment is the "default"
+account, and MAIL_ACCOUNTS_FILE (JSON, keep it chmod 600) may add more::
+
+    {"alice": {"host": "mail.example.com", "user": "alice@example.com",
+               "password": "...", "pop_port": 995, "smtp_port": 465, "ssl": true}}
+
+The live state of an account (its POP mailbox actor, SMTP session pool,
+concurrency slots) is built on first use and dropped once the account has
+been idle for MAIL_ACCOUNT_IDLE_SECONDS, so an extra mailbox only costs
+memory while it is in use; its small send limiter is kept so quotas
+survive eviction.  Capabilities and TLS tickets stay keyed by host
+(mail_caps, mail_tls) since they describe the server, not the user.
+"""
+import os, json, poplib, smtplib, secrets, threading, time, logging
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+import mail_caps
+import mail_health
+import mail_limits
+import mail_smtp
+import mail_tls
+import metrics
+import pop_actor
+import rate_limit
+
+LOG = logging.getLogger("mail_accounts")
+
+DEFAULT_ACCOUNT = "default"
+
+
+def _flag(value) -> bool:
+    return str(value) not in ("0", "false", "False", "None", "")
+
+
+class Account:
+    """One mailbox: its settings plus the pools and limits built for it."""
+
+    def __init__(self, account_id: str, cfg: Dict, max_concurrency: int = 4,
+                 limiter: Optional[rate_limit.SendLimiter] = None, header_cache=None):
+        self.id = account_id
+        self.host = cfg["host"]
+        self.user = cfg["user"]
+        self.password = cfg["password"]
+        self.pop_port = int(cfg.get("pop_port", 110))
+        self.smtp_port = int(cfg.get("smtp_port", 587))
+        self.use_ssl = _flag(cfg.get("ssl", False))
+        self.allow_self_signed = _flag(cfg.get("allow_self_signed", False))
+        self.smtp_pool = mail_smtp.session_pool(
+            self.connect_smtp, lambda: mail_limits.upstream("smtp", self.host, self.smtp_port),
+            name=f"smtp:{account_id}")
+        # the one POP session: tool calls queue commands instead of logging in
+        self.mailbox = pop_actor.MailboxActor(
+            self.connect_pop, lambda conn: mail_caps.ensure("pop", self.host, self.pop_port, conn),
+            header_cache, self.user, name=account_id,
+            breaker=mail_health.breaker("pop", self.host, self.pop_port),
+            host_limit=mail_limits.host_limit("pop", self.host, self.pop_port))
+        self.limiter = limiter or rate_limit.from_env(key=self.user)
+        self.last_used = time.monotonic()
+        self.active = 0
+        self._slots = mail_limits.Bulkhead(f"account:{account_id}", max_concurrency)
+
+    def connect_pop(self) -> poplib.POP3:
+        """Open a logged-in POP3 session, resuming the last TLS session if any."""
+        with metrics.command("pop", "CONNECT"):
+            if self.use_ssl:
+                tls = mail_tls.resuming("pop", self.host, self.pop_port, verify=not self.allow_self_signed)
+                conn = poplib.POP3_SSL(self.host, self.pop_port, context=tls, timeout=mail_health.connect_timeout())
+            else:
+                tls = None
+                conn = poplib.POP3(self.host, self.pop_port, mail_health.connect_timeout())
+        mail_health.arm(conn)
+        with metrics.command("pop", "AUTH"):
+            conn.user(self.user)
+            conn.pass_(self.password)
+        if tls:
+            tls.save()
+        return conn
+
+    def connect_smtp(self) -> smtplib.SMTP:
+        """Open a logged-in SMTP session and note its EHLO extensions."""
+        tls = mail_tls.resuming("smtp", self.host, self.smtp_port, verify=not self.allow_self_signed)
+        with metrics.command("smtp", "CONNECT"):
+            if self.smtp_port == 465 or self.use_ssl:
+                smtp = smtplib.SMTP_SSL(self.host, self.smtp_port, context=tls, timeout=mail_health.connect_timeout())
+            else:
+                smtp = smtplib.SMTP(self.host, self.smtp_port, timeout=mail_health.connect_timeout())
+                try:
+                    smtp.starttls(context=tls)
+                except Exception:
+                    pass
+        mail_health.arm(smtp)
+        with metrics.command("smtp", "AUTH"):
+            smtp.login(self.user, self.password)
+        tls.save()
+        mail_caps.record("smtp", self.host, self.smtp_port, mail_caps.smtp_caps(smtp))
+        return smtp
+
+    def close(self) -> None:
+        self.mailbox.close()
+        self.smtp_pool.close_all()
+
+
+class AccountRegistry:
+    """
+    Account settings by id, with live Account objects created on demand and
+    evicted after *idle_ttl* seconds without a call in progress.
+    """
+
+    def __init__(self, configs: Dict[str, Dict], idle_ttl: float = 900.0, max_concurrency: int = 4,
+                 header_cache=None):
+        self._configs = configs
+        self._by_address = {cfg["user"].lower(): account_id for account_id, cfg in configs.items()}
+        self._idle_ttl = idle_ttl
+        self._max_concurrency = max_concurrency
+        self._header_cache = header_cache
+        self._live: Dict[str, Account] = {}
+        # outlive eviction, or an idle hour would reset an hourly quota
+        self._limiters: Dict[str, rate_limit.SendLimiter] = {}
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+
+    def ids(self) -> List[str]:
+        return list(self._configs)
+
+    def __contains__(self, account_id: str) -> bool:
+        return account_id in self._configs
+
+    def get(self, account_id: str) -> Account:
+        """Live account for *account_id*; KeyError if it is not configured."""
+        cfg = self._configs[account_id]
+        self._sweep()
+        with self._lock:
+            account = self._live.get(account_id)
+            if account is None:
+                limiter = self._limiters.get(account_id)
+                if limiter is None:     # provider quotas are per mailbox
+                    limiter = self._limiters[account_id] = rate_limit.from_env(key=cfg["user"])
+                account = self._live[account_id] = Account(account_id, cfg, self._max_concurrency, limiter,
+                                                             self._header_cache)
+            account.last_used = time.monotonic()
+            return account
+
+    def for_address(self, address: str) -> Account:
+        """Account whose mailbox is *address* (the queue routes by sender)."""
+        return self.get(self._by_address[address.lower()])
+
+    def verify(self, account_id: str, password: str) -> bool:
+        """Check a login against the account's mail password."""
+        cfg = self._configs.get(account_id)
+        return cfg is not None and secrets.compare_digest(cfg["password"].encode(), password.encode())
+
+    @contextmanager
+    def use(self, account_id: str) -> Iterator[Account]:
+        """Hold one of the account's concurrency slots for a tool call (Overloaded if too many wait)."""
+        account = self.get(account_id)
+        with account._slots.slot():
+            with self._lock:
+                account.active += 1
+            try:
+                yield account
+            finally:
+                with self._lock:
+                    account.active -= 1
+                    account.last_used = time.monotonic()
+
+    def live_count(self) -> int:
+        with self._lock:
+            return len(self._live)
+
+    def _sweep(self) -> None:
+        now = time.monotonic()
+        if now - self._last_sweep < min(60.0, self._idle_ttl):
+            return
+        with self._lock:
+            self._last_sweep = now
+            idle = [a for a in self._live.values()
+                    if a.active == 0 and now - a.last_used > self._idle_ttl]
+            for account in idle:
+                del self._live[account.id]
+        for account in idle:
+            LOG.debug("evicting idle account %s", account.id)
+            account.close()
+
+
+def load_configs() -> Dict[str, Dict]:
+    """The MAIL_* default account (if MAIL_USER is set) plus MAIL_ACCOUNTS_FILE entries."""
+    configs: Dict[str, Dict] = {}
+    if os.getenv("MAIL_USER"):
+        configs[DEFAULT_ACCOUNT] = {
+            "host": os.getenv("MAIL_HOST"),
+            "user": os.getenv("MAIL_USER"),
+            "password": os.getenv("MAIL_PASS", ""),
+            "pop_port": os.getenv("MAIL_POP_PORT", "110"),
+            "smtp_port": os.getenv("MAIL_SMTP_PORT", "587"),
+            "ssl": os.getenv("MAIL_SSL", "0"),
+            "allow_self_signed": os.getenv("MAIL_ALLOW_SELF_SIGNED", "0") in ("1", "true", "True"),
+        }
+    path = os.getenv("MAIL_ACCOUNTS_FILE")
+    if path:
+        with open(path) as fp:
+            configs.update(json.load(fp))
+    return configs
+
+
+def from_env(configs: Optional[Dict[str, Dict]] = None, header_cache=None) -> AccountRegistry:
+    """Registry configured from MAIL_ACCOUNT_IDLE_SECONDS / MAIL_ACCOUNT_CONCURRENCY."""
+    return AccountRegistry(
+        load_configs() if configs is None else configs,
+        idle_ttl=float(os.getenv("MAIL_ACCOUNT_IDLE_SECONDS", "900")),
+        max_concurrency=int(os.getenv("MAIL_ACCOUNT_CONCURRENCY", "4")),
+        header_cache=header_cache,
+    )
@@ -0,0 +1,94 @@
+"""
+mail_caps.py – Cache of what the mail host supports (POP3 CAPA, IMAP
+CAPABILITY, SMTP EHLO), probed at startup and refreshed in the background.
+
+Fast paths ask ``get()`` / ``supports()`` instead of trying a command and
+falling back when the server rejects it.  ``ensure()`` probes over a live
+connection on a cache miss, so the first call after startup still works
+before the background probe has finished.
+"""
+import os, threading, time, logging, poplib, imaplib, smtplib
+from typing import Callable, Dict, Optional, Tuple
+
+LOG = logging.getLogger("mail_caps")
+
+REFRESH_SECONDS = float(os.getenv("MAIL_CAPS_REFRESH_SECONDS", "3600"))
+
+_lock = threading.Lock()
+_caps: Dict[Tuple[str, str, int], Tuple[Dict[str, str], float]] = {}
+
+
+def pop_caps(conn: poplib.POP3) -> Dict[str, str]:
+    """CAPA keywords (PIPELINING, UIDL, TOP, SASL ...) -> their arguments."""
+    try:
+        caps = conn.capa()
+    except poplib.error_proto:          # pre-RFC 2449 server: no CAPA at all
+        return {}
+    return {name.upper(): " ".join(args) for name, args in caps.items()}
+
+
+def imap_caps(conn: imaplib.IMAP4) -> Dict[str, str]:
+    """CAPABILITY atoms (IDLE, CONDSTORE, QRESYNC, LITERAL+, COMPRESS=DEFLATE ...)."""
+    ok, data = conn.capability()       # post-login list may differ from the greeting
+    atoms = data[0].split() if ok == "OK" and data and data[0] else []
+    return {atom.decode().upper(): "" for atom in atoms} or {c: "" for c in conn.capabilities}
+
+
+def smtp_caps(conn: smtplib.SMTP) -> Dict[str, str]:
+    """EHLO extensions (PIPELINING, CHUNKING, SIZE ...) -> their arguments."""
+    conn.ehlo_or_helo_if_needed()
+    return {name.upper(): value for name, value in conn.esmtp_features.items()}
+
+
+_PROBES: Dict[str, Callable] = {"pop": pop_caps, "imap": imap_caps, "smtp": smtp_caps}
+
+
+def record(proto: str, host: str, port: int, caps: Dict[str, str]) -> Dict[str, str]:
+    with _lock:
+        _caps[(proto, host, port)] = (caps, time.monotonic())
+    return caps
+
+
+def get(proto: str, host: str, port: int) -> Optional[Dict[str, str]]:
+    """Cached capabilities, or None if this host has not been probed yet."""
+    entry = _caps.get((proto, host, port))
+    return entry[0] if entry else None
+
+
+def supports(proto: str, host: str, port: int, name: str) -> Optional[bool]:
+    """True / False from the cache, None when unknown."""
+    caps = get(proto, host, port)
+    return None if caps is None else name.upper() in caps
+
+
+def ensure(proto: str, host: str, port: int, conn) -> Dict[str, str]:
+    """Cached capabilities; probe over the live *conn* on a miss or when stale."""
+    entry = _caps.get((proto, host, port))
+    if entry and time.monotonic() - entry[1] < REFRESH_SECONDS:
+        return entry[0]
+    return record(proto, host, port, _PROBES[proto](conn))
+
+
+def smtp_size_limit(host: str, port: int) -> Optional[int]:
+    """Maximum message size from EHLO SIZE, or None if unknown / unlimited."""
+    value = (get("smtp", host, port) or {}).get("SIZE", "")
+    return int(value) if value.isdigit() and int(value) > 0 else None
+
+
+def start_refresh(probe: Callable[[], None], interval: float = REFRESH_SECONDS) -> threading.Thread:
+    """
+    Run *probe* now and then every *interval* seconds on a daemon thread.
+    *probe* opens its own connections and calls ``record()``.
+    """
+    def loop():
+        while True:
+            try:
+                probe()
+                LOG.info("mail capabilities: %s", {k[0]: sorted(v[0]) for k, v in _caps.items()})
+            except Exception as e:
+                LOG.warning("capability probe failed: %s", e)
+            time.sleep(interval)
+
+    thread = threading.Thread(target=loop, name="mail-caps", daemon=True)
+    thread.start()
+    return thread
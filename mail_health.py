@@ -0,0 +1,251 @@
+"""
+mail_health.py – Keep a stalled mail host from stalling the server.
+
+* Timeouts: connect and greeting get MAIL_CONNECT_TIMEOUT seconds, every
+  later socket read MAIL_IO_TIMEOUT, and neither may outlast the deadline
+  of the tool call being served.
+* Deadlines: each tool call gets MCP_REQUEST_TIMEOUT seconds (set it to
+  the clients' request timeout; the MCP SDKs default to 60) less a small
+  margin, so the server answers before the client gives up.
+* Circuit breaker per host: after MAIL_BREAKER_FAILURES connection
+  failures in a row, calls fail fast with HostUnavailable for
+  MAIL_BREAKER_RESET_SECONDS, then a single trial call is let through.
+* Stale answers: read tools remember their last good result and return it,
+  each item marked ``"stale": true``, while the host is down or too slow.
+"""
+import os, time, imaplib, smtplib, threading, contextvars, logging
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Optional, Tuple
+
+import metrics
+
+LOG = logging.getLogger("mail_health")
+
+CONNECT_TIMEOUT = float(os.getenv("MAIL_CONNECT_TIMEOUT", "10"))
+IO_TIMEOUT = float(os.getenv("MAIL_IO_TIMEOUT", "30"))
+REQUEST_TIMEOUT = float(os.getenv("MCP_REQUEST_TIMEOUT", "60"))
+MARGIN = 2.0                    # seconds kept back to send the reply
+
+
+class DeadlineExceeded(TimeoutError):
+    """The tool call's time budget ran out before the mail host answered."""
+
+
+class HostUnavailable(ConnectionError):
+    """The host's circuit is open; retrying after *retry_after* seconds may succeed."""
+
+    def __init__(self, host: str, retry_after: float):
+        super().__init__(f"Mail host {host} is unavailable; retry in {retry_after:.0f} s.")
+        self.host = host
+        self.retry_after = retry_after
+
+
+# ---------------- deadlines and timeouts ---------------- #
+
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("mail_deadline", default=None)
+
+
+def deadline(seconds: float = REQUEST_TIMEOUT - MARGIN):
+    """Bound the upstream work in this block; an outer deadline still applies."""
+    return until(time.monotonic() + seconds)
+
+
+@contextmanager
+def until(end: Optional[float]) -> Iterator[Optional[float]]:
+    """Same, with an absolute monotonic() *end* (None adds no bound)."""
+    outer = _deadline.get()
+    if end is not None and outer is not None:
+        end = min(end, outer)
+    token = _deadline.set(end if end is not None else outer)
+    try:
+        yield _deadline.get()
+    finally:
+        _deadline.reset(token)
+
+
+def current_deadline() -> Optional[float]:
+    """monotonic() time the current call must finish by, if any."""
+    return _deadline.get()
+
+
+def remaining() -> Optional[float]:
+    end = _deadline.get()
+    return None if end is None else max(0.0, end - time.monotonic())
+
+
+def timeout(limit: float = IO_TIMEOUT, end: Optional[float] = None) -> float:
+    """Socket timeout for the next operation: *limit*, capped by the deadline."""
+    end = _deadline.get() if end is None else end
+    if end is None:
+        return limit
+    left = end - time.monotonic()
+    if left <= 0:
+        raise DeadlineExceeded("Deadline exceeded before contacting the mail host.")
+    return min(limit, left)
+
+
+def connect_timeout() -> float:
+    return timeout(CONNECT_TIMEOUT)
+
+
+def arm(conn, end: Optional[float] = None):
+    """Set the read timeout on a POP3 / IMAP4 / SMTP connection's socket."""
+    sock = getattr(conn, "sock", None)
+    if sock is not None:
+        sock.settimeout(timeout(IO_TIMEOUT, end))
+    return conn
+
+
+def deadline_middleware():
+    """
+    FastMCP middleware running each tool call under deadline().  Sync tools
+    run in worker threads, which inherit the deadline, and every socket
+    timeout they get is capped by it -- so a stalled host costs a call at
+    most its budget, and the thread is free again.
+    """
+    from fastmcp.server.middleware import Middleware
+
+    class ToolDeadline(Middleware):
+        async def on_call_tool(self, context, call_next):
+            with deadline():
+                return await call_next(context)
+
+    return ToolDeadline()
+
+
+# ---------------- circuit breaker ---------------- #
+
+def is_host_failure(exc: BaseException) -> bool:
+    """True for errors that say the host is down or stalled, not that it said no."""
+    if isinstance(exc, (HostUnavailable, DeadlineExceeded)):
+        return False
+    if isinstance(exc, smtplib.SMTPException):          # SMTP replies are OSErrors too
+        return isinstance(exc, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError))
+    return isinstance(exc, (OSError, EOFError, imaplib.IMAP4.abort))
+
+
+class CircuitBreaker:
+    """Closed -> open after *failures* host failures in a row -> half-open after *reset* s."""
+
+    def __init__(self, name: str, failures: int = 5, reset: float = 30.0):
+        self.name = name
+        self._threshold = max(1, failures)
+        self._reset = reset
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            return "half-open" if self._trial or time.monotonic() - self._opened_at >= self._reset else "open"
+
+    def before(self) -> None:
+        """Raise HostUnavailable unless a call may go to the host now."""
+        with self._lock:
+            if self._opened_at is None:
+                return
+            wait = self._opened_at + self._reset - time.monotonic()
+            if wait > 0 or self._trial:
+                raise HostUnavailable(self.name, max(wait, 1.0))
+            self._trial = True          # half-open: this call probes the host
+
+    def record(self, exc: Optional[BaseException] = None) -> None:
+        """Outcome of a call let through by before(); None means success."""
+        with self._lock:
+            if exc is not None and not is_host_failure(exc):
+                if isinstance(exc, (HostUnavailable, DeadlineExceeded)):
+                    self._trial = False         # no verdict; let the next call probe
+                    return
+                exc = None                      # the host answered, just not with OK
+            if exc is None:
+                if self._opened_at is not None:
+                    LOG.info("%s: host answering again, circuit closed", self.name)
+                self._failures = 0
+                self._opened_at = None
+                self._trial = False
+                return
+            self._failures += 1
+            if self._trial or self._failures >= self._threshold:
+                if self._opened_at is None:
+                    LOG.warning("%s: %d failures in a row (%s), circuit open", self.name, self._failures, exc)
+                self._opened_at = time.monotonic()
+                self._trial = False
+
+
+_breakers: Dict[Tuple[str, str, int], CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker(proto: str, host: str, port: int) -> CircuitBreaker:
+    """The shared breaker for one mail service."""
+    key = (proto, host, int(port))
+    with _breakers_lock:
+        if key not in _breakers:
+            _breakers[key] = CircuitBreaker(f"{proto}://{host}:{port}",
+                                            int(os.getenv("MAIL_BREAKER_FAILURES", "5")),
+                                            float(os.getenv("MAIL_BREAKER_RESET_SECONDS", "30")))
+        return _breakers[key]
+
+
+def breakers() -> List[CircuitBreaker]:
+    """Every breaker made so far (for /metrics)."""
+    with _breakers_lock:
+        return list(_breakers.values())
+
+
+@contextmanager
+def guard(proto: str, host: str, port: int) -> Iterator[None]:
+    """Fail fast while the host's circuit is open; report how the block went."""
+    b = breaker(proto, host, port)
+    b.before()
+    try:
+        yield
+    except BaseException as exc:
+        b.record(exc)
+        raise
+    b.record()
+
+
+# ---------------- stale answers ---------------- #
+
+class StaleCache:
+    """Last good result per read call, returned marked stale when the host fails."""
+
+    def __init__(self, max_items: int = 1024):
+        self._items: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._max_items = max_items
+        self._lock = threading.Lock()
+
+    def serve(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        try:
+            result = fn()
+        except (HostUnavailable, TimeoutError) as exc:
+            return self._stale(key, exc)
+        except BaseException as exc:
+            if not is_host_failure(exc):
+                raise
+            return self._stale(key, exc)
+        if isinstance(result, list):
+            with self._lock:
+                self._items[key] = (time.time(), result)
+                self._items.move_to_end(key)
+                while len(self._items) > self._max_items:
+                    self._items.popitem(last=False)
+        return result
+
+    def _stale(self, key: Hashable, exc: BaseException) -> Any:
+        with self._lock:
+            entry = self._items.get(key)
+        if entry is None:
+            metrics.CACHE.inc("stale", "miss")
+            raise exc
+        metrics.CACHE.inc("stale", "hit")
+        stamp, result = entry
+        LOG.warning("serving stale result (%.0f s old): %s", time.time() - stamp, exc)
+        age = int(time.time() - stamp)
+        return [dict(item, stale=True, stale_seconds=age) if isinstance(item, dict) else item for item in result]
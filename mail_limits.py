@@ -0,0 +1,178 @@
+"""
+mail_limits.py – Bounded concurrency with a fair, bounded wait queue.
+
+A Bulkhead admits *limit* callers at a time.  Later callers wait in FIFO
+order, up to *max_queue* of them; the next one is refused at once with
+Overloaded (retryable), and a waiter whose deadline (mail_health) passes
+gives up with DeadlineExceeded.  Limits apply per process:
+
+* per mail service (protocol, host, port): MAIL_HOST_CONCURRENCY
+  connections, shared by every account on that host -- see upstream()
+* per account: its concurrency slots (MAIL_ACCOUNT_CONCURRENCY), its SMTP
+  pool and its POP mailbox actor each queue at most MAIL_QUEUE_DEPTH calls
+
+Each limit keeps QueueStats, so time spent waiting for a slot is reported
+apart from the time spent holding it (talking to the host); stats() feeds
+the mail_limit_* series on /metrics (see metrics).
+"""
+import os, math, time, threading, weakref
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Deque, Dict, Iterator, Tuple
+
+import mail_health
+
+HOST_CONCURRENCY = int(os.getenv("MAIL_HOST_CONCURRENCY", "8"))
+QUEUE_DEPTH = int(os.getenv("MAIL_QUEUE_DEPTH", "32"))
+QUEUE_TIMEOUT = float(os.getenv("MAIL_QUEUE_TIMEOUT", "30"))    # without a call deadline
+
+
+class Overloaded(RuntimeError):
+    """Too many calls already waiting; safe to retry after *retry_after* seconds."""
+
+    def __init__(self, what: str, retry_after: float):
+        self.retry_after = max(1, math.ceil(retry_after))
+        super().__init__(f"Server busy: too many requests waiting for {what}; retry after {self.retry_after}s.")
+
+
+class QueueStats:
+    """
+    Counters for one limit: admissions, refusals, queue wait and service
+    time.  *gauges* holds readers for live numbers (in_use, waiting, ...)
+    that the snapshot includes.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.wait_seconds = 0.0         # summed over admitted calls
+        self.wait_max = 0.0
+        self.served = 0
+        self.service_seconds = 0.0      # time holding the slot / talking to the host
+        self.gauges: Dict[str, Callable[[], float]] = {}
+        self._lock = threading.Lock()
+        _registry.add(self)
+
+    def record_wait(self, seconds: float) -> None:
+        with self._lock:
+            self.admitted += 1
+            self.wait_seconds += seconds
+            self.wait_max = max(self.wait_max, seconds)
+
+    def record_rejected(self) -> None:
+        with self._lock:
+            self.rejected += 1
+
+    def record_timed_out(self) -> None:
+        with self._lock:
+            self.timed_out += 1
+
+    def record_service(self, seconds: float) -> None:
+        with self._lock:
+            self.served += 1
+            self.service_seconds += seconds
+
+    def mean_service(self) -> float:
+        return self.service_seconds / self.served if self.served else 1.0
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            snap = {"admitted": self.admitted, "rejected": self.rejected, "timed_out": self.timed_out,
+                    "wait_seconds": self.wait_seconds, "wait_max": self.wait_max,
+                    "served": self.served, "service_seconds": self.service_seconds}
+        snap.update((name, read()) for name, read in list(self.gauges.items()))
+        return snap
+
+
+_registry: "weakref.WeakSet[QueueStats]" = weakref.WeakSet()
+
+
+def stats() -> Dict[str, Dict[str, float]]:
+    """Snapshot of every live limit's QueueStats, by name."""
+    return {s.name: s.snapshot() for s in list(_registry)}
+
+
+class Bulkhead:
+    """At most *limit* holders; up to *max_queue* more wait, first come first served."""
+
+    def __init__(self, name: str, limit: int, max_queue: int = QUEUE_DEPTH):
+        self.name = name
+        self.limit = max(1, limit)
+        self.max_queue = max(0, max_queue)
+        self.stats = QueueStats(name)
+        self._active = 0
+        self._waiters: Deque[threading.Event] = deque()
+        self._lock = threading.Lock()
+        self.stats.gauges.update(in_use=lambda: self._active, waiting=lambda: len(self._waiters),
+                                 capacity=lambda: self.limit)
+
+    @property
+    def in_use(self) -> int:
+        return self._active
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        """Hold one slot for the ``with`` block."""
+        self._acquire()
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.stats.record_service(time.monotonic() - start)
+            self._release()
+
+    def _acquire(self) -> None:
+        start = time.monotonic()
+        with self._lock:
+            if self._active < self.limit and not self._waiters:
+                self._active += 1
+                self.stats.record_wait(0.0)
+                return
+            if len(self._waiters) >= self.max_queue:
+                self.stats.record_rejected()
+                raise Overloaded(self.name, self.stats.mean_service() * (len(self._waiters) + 1) / self.limit)
+            waiter = threading.Event()
+            self._waiters.append(waiter)
+        left = mail_health.remaining()
+        waiter.wait(QUEUE_TIMEOUT if left is None else min(left, QUEUE_TIMEOUT))
+        with self._lock:
+            if not waiter.is_set():             # nobody handed us a slot in time
+                self._waiters.remove(waiter)
+                self.stats.record_timed_out()
+                if left is not None and left <= QUEUE_TIMEOUT:
+                    raise mail_health.DeadlineExceeded(f"Deadline passed while waiting for {self.name}.")
+                raise Overloaded(self.name, self.stats.mean_service())
+        self.stats.record_wait(time.monotonic() - start)
+
+    def _release(self) -> None:
+        with self._lock:
+            if self._waiters:
+                self._waiters.popleft().set()   # hand the slot straight to the next in line
+            else:
+                self._active -= 1
+
+
+_hosts: Dict[Tuple[str, str, int], Bulkhead] = {}
+_hosts_lock = threading.Lock()
+
+
+def host_limit(proto: str, host: str, port: int) -> Bulkhead:
+    """The process-wide connection limit for one mail service."""
+    key = (proto, host, int(port))
+    with _hosts_lock:
+        if key not in _hosts:
+            _hosts[key] = Bulkhead(f"{proto}://{host}:{port}", HOST_CONCURRENCY)
+        return _hosts[key]
+
+
+@contextmanager
+def upstream(proto: str, host: str, port: int) -> Iterator[None]:
+    """A host-wide connection slot, then the host's circuit breaker (mail_health.guard)."""
+    with host_limit(proto, host, port).slot(), mail_health.guard(proto, host, port):
+        yield
@@ -0,0 +1,201 @@
+"""
+mail_logging.py – Structured logging that never blocks the caller.
+
+setup() points the root logger at a bounded queue.  A background thread
+(logging.handlers.QueueListener) formats the records and writes them to
+stderr, or MAIL_LOG_FILE, so a slow terminal or journald never stalls the
+event loop or a tool call.  When the queue is full, records are dropped and
+counted (mail_log_dropped_total on /metrics) -- warnings included, since
+waiting for room would block the very caller the queue protects.
+
+    MAIL_LOG_FORMAT     json (default): one JSON object per line, with ts,
+                        level, logger and msg, any ``extra=`` fields, the
+                        traceback (exc) and trace_id/span_id when tracing is
+                        on; or text, for reading in a terminal
+    MAIL_LOG_LEVEL      root level (INFO)
+    MAIL_LOG_LEVELS     per-module levels, e.g. "mail_pool=DEBUG,uvicorn.access=WARNING"
+    MAIL_LOG_SAMPLE     keep that fraction of a noisy logger's (or
+                        ``extra={"event": ...}``'s) records below WARNING,
+                        e.g. "uvicorn.access=0.05,mail_pool=0.1"
+    MAIL_LOG_QUEUE      records that may wait for the writer (10000)
+
+Secrets are scrubbed before anything is written: the values of extra fields
+named like authorization, password, token, secret, cookie or code, and
+bearer tokens, ``password=...``-style pairs and AUTH arguments in messages
+and tracebacks.
+"""
+import os, re, sys, copy, json, queue, random, atexit, logging, logging.handlers
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+import metrics
+import tracing
+
+QUEUE_SIZE = int(os.getenv("MAIL_LOG_QUEUE", "10000"))
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_handler: Optional["_DroppingQueueHandler"] = None
+
+# ---------------- redaction ---------------- #
+
+REDACTED = "[redacted]"
+_SECRET_KEY = re.compile(r"authorization|passw|secret|token|cookie|api.?key|^code$|code_verifier|credential", re.I)
+_SECRET_TEXT = [
+    (re.compile(r"(\b(?:bearer|basic)\s+)[\w\-.~+/=]+", re.I), r"\1" + REDACTED),
+    (re.compile(r"(\bAUTH\s+(?:PLAIN|LOGIN|XOAUTH2|CRAM-MD5)\s+)\S+", re.I), r"\1" + REDACTED),
+    (re.compile(r"""(\b(?:password|passwd|pass|secret|token|code_verifier|code|authorization)['"]?\s*[:=]\s*['"]?)"""
+                r"""[^\s'"&,;}]+""", re.I), r"\1" + REDACTED),
+]
+
+
+def redact_text(text: str) -> str:
+    """*text* with bearer tokens, AUTH arguments and ``key=value`` secrets replaced."""
+    for pattern, repl in _SECRET_TEXT:
+        text = pattern.sub(repl, text)
+    return text
+
+
+def redact(value, key: str = ""):
+    """*value* (nested dicts / lists / strings) with secrets replaced; *key* is its field name."""
+    if isinstance(value, (int, float, bool)) or value is None:
+        return value
+    if key and _SECRET_KEY.search(key):
+        return REDACTED if value != "" else value
+    if isinstance(value, dict):
+        return {k: redact(v, str(k)) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(v) for v in value]
+    if isinstance(value, str):
+        return redact_text(value)
+    return redact_text(str(value))
+
+
+# ---------------- formatting (writer thread) ---------------- #
+
+# attributes every LogRecord has; anything else came in through extra=
+_STANDARD = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "trace_id", "span_id"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One redacted JSON object per record."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": redact_text(record.getMessage()),
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD and not key.startswith("_"):
+                entry[key] = redact(value, key)
+        if record.levelno >= logging.WARNING:
+            entry["where"] = f"{record.module}:{record.lineno}"
+        if getattr(record, "trace_id", None):
+            entry["trace_id"] = record.trace_id
+            entry["span_id"] = record.span_id
+        if record.exc_text:
+            entry["exc"] = redact_text(record.exc_text)
+        if record.stack_info:
+            entry["stack"] = record.stack_info
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    """The usual one-line format, redacted."""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        return redact_text(super().format(record))
+
+
+# ---------------- queueing (caller thread) ---------------- #
+
+class _Sampler(logging.Filter):
+    """Keeps a fraction of the records below WARNING from the listed loggers / events."""
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(getattr(record, "event", None) or "")
+        if rate is None:
+            name = record.name
+            while rate is None and name:
+                rate = self.rates.get(name)
+                name = name.rpartition(".")[0]
+        return rate is None or random.random() < rate
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Enqueues without waiting; a full queue drops the record and counts it."""
+
+    def __init__(self, q: "queue.Queue"):
+        super().__init__(q)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Everything that depends on the caller is resolved here: the message
+        # (args may change after the call), the traceback and the trace context.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        if tracing.ENABLED:
+            from opentelemetry import trace
+            ctx = trace.get_current_span().get_span_context()
+            if ctx.is_valid:
+                record.trace_id = format(ctx.trace_id, "032x")
+                record.span_id = format(ctx.span_id, "016x")
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _pairs(spec: str) -> Dict[str, str]:
+    pairs = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, value = item.partition("=")
+        if value:
+            pairs[name.strip()] = value.strip()
+    return pairs
+
+
+def setup() -> None:
+    """Route all logging through the queue and background writer (once per process)."""
+    global _listener, _handler
+    if _listener is not None:
+        return
+    root = logging.getLogger()
+    root.setLevel(os.getenv("MAIL_LOG_LEVEL", "INFO").upper())
+    for name, level in _pairs(os.getenv("MAIL_LOG_LEVELS", "")).items():
+        logging.getLogger(name).setLevel(level.upper())
+
+    path = os.getenv("MAIL_LOG_FILE")
+    out = logging.FileHandler(path, encoding="utf-8") if path else logging.StreamHandler(sys.stderr)
+    out.setFormatter(TextFormatter() if os.getenv("MAIL_LOG_FORMAT", "json") == "text" else JsonFormatter())
+
+    _handler = _DroppingQueueHandler(queue.Queue(QUEUE_SIZE))
+    rates = {name: float(rate) for name, rate in _pairs(os.getenv("MAIL_LOG_SAMPLE", "")).items()}
+    if rates:
+        _handler.addFilter(_Sampler(rates))
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(_handler)
+    _listener = logging.handlers.QueueListener(_handler.queue, out)
+    _listener.start()
+    atexit.register(_listener.stop)      # writes out whatever is still queued
+
+    metrics.collector(lambda: [("mail_log_dropped_total", "counter", "Log records dropped because the queue was full.",
+                                [({}, _handler.dropped)])])
@@ -2,68 +2,166 @@
 mail_mcp.py – Minimal MCP server for POP/IMAP/SMTP mailboxes.
 Run with:  python mail_mcp.py            # HTTP on :8088 (default)
            MCP_TRANSPORT=stdio python mail_mcp.py   # for local CLI tests
+           python mail_mcp.py --profile-startup     # where import time goes
 """
-import os, ssl, base64, email.header, email.message, logging
-from typing import List, Dict
+import os, sys
+if __name__ == "__main__" and "--profile-startup" in sys.argv:
+    import startup_profile
+    sys.exit(startup_profile.report(["mail_mcp"], cwd=os.path.dirname(os.path.abspath(__file__))))
+
+import re, ssl, contextvars, email.header, email.message, email.utils, logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timezone
+from typing import Callable, List, Dict, Optional
 from fastmcp import FastMCP
-from starlette.middleware import Middleware
-from starlette.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 import poplib, imaplib, smtplib
+import imap_compress, mail_caps, mail_health, mail_limits, mail_logging, mail_pool, mail_pop, mail_smtp, mail_tls, metrics, profiling, rate_limit, send_queue, single_flight, tracing
 
 load_dotenv()                           # pick up .env
+mail_logging.setup()                    # JSON logs through a background writer, see mail_logging
+tracing.setup("mail-mcp")               # spans to MAIL_TRACE_FILE / an OTLP collector when configured
+profiling.install_signal()              # SIGUSR2: dump a profiling window, see profiling
 LOG = logging.getLogger("mail_mcp")
-logging.basicConfig(level=logging.INFO)
 
 # ──────────────────────────  helpers  ────────────────────────── #
 
+def _verify_tls() -> bool:
+    return os.getenv("MAIL_ALLOW_SELF_SIGNED") != "1"
+
 def _ssl_ctx() -> ssl.SSLContext | None:
-    """Create a permissive SSL context if MAIL_SSL==1."""
+    """Shared SSL context (built once per profile) if MAIL_SSL==1."""
     if os.getenv("MAIL_SSL", "1") == "1":
-        ctx = ssl.create_default_context()
-        if os.getenv("MAIL_ALLOW_SELF_SIGNED") == "1":
-            ctx.check_hostname = False
-            ctx.verify_mode = ssl.CERT_NONE
-        return ctx
+        return mail_tls.client_context(verify=_verify_tls())
     return None
 
 def _connect_pop() -> poplib.POP3 | poplib.POP3_SSL:
     host = os.environ["MAIL_HOST"]
     port = int(os.getenv("MAIL_POP_PORT", "110"))
-    if _ssl_ctx():
-        pop = poplib.POP3_SSL(host, port, context=_ssl_ctx())
-    else:
-        pop = poplib.POP3(host, port)
-    pop.user(os.environ["MAIL_USER"])
-    pop.pass_(os.environ["MAIL_PASS"])
+    tls = None
+    with metrics.command("pop", "CONNECT"):
+        if _ssl_ctx():
+            tls = mail_tls.resuming("pop", host, port, verify=_verify_tls())
+            pop = poplib.POP3_SSL(host, port, context=tls, timeout=mail_health.connect_timeout())
+        else:
+            pop = poplib.POP3(host, port, mail_health.connect_timeout())
+    mail_health.arm(pop)
+    with metrics.command("pop", "AUTH"):
+        pop.user(os.environ["MAIL_USER"])
+        pop.pass_(os.environ["MAIL_PASS"])
+    if tls:
+        tls.save()
     return pop
 
 def _connect_imap() -> imaplib.IMAP4 | imaplib.IMAP4_SSL:
     host = os.environ["MAIL_HOST"]
     port = int(os.getenv("MAIL_IMAP_PORT", "993"))
-    if _ssl_ctx():
-        imap = imaplib.IMAP4_SSL(host, port, ssl_context=_ssl_ctx())
-    else:
-        imap = imaplib.IMAP4(host, port)
-        imap.starttls(_ssl_ctx())
-    imap.login(os.environ["MAIL_USER"], os.environ["MAIL_PASS"])
-    imap.select("INBOX")            # default mailbox
-    return imap
+    with metrics.command("imap", "CONNECT"):
+        if _ssl_ctx():
+            tls = mail_tls.resuming("imap", host, port, verify=_verify_tls())
+            imap = imaplib.IMAP4_SSL(host, port, ssl_context=tls, timeout=mail_health.connect_timeout())
+        else:
+            # imaplib's own STARTTLS fallback context does not verify either
+            tls = mail_tls.resuming("imap", host, port, verify=False)
+            imap = imaplib.IMAP4(host, port, mail_health.connect_timeout())
+            imap.starttls(tls)
+    mail_health.arm(imap)
+    with metrics.command("imap", "AUTH"):
+        imap.login(os.environ["MAIL_USER"], os.environ["MAIL_PASS"])
+    tls.save()
+    caps = mail_caps.ensure("imap", host, port, imap)
+    if "COMPRESS=DEFLATE" in caps and os.getenv("MAIL_IMAP_COMPRESS", "1") == "1":
+        imap_compress.enable(imap)      # RFC 4978 stream compression
+    return imap                     # mailbox is selected per checkout, see _imap()
 
 def _connect_smtp() -> smtplib.SMTP:
     host = os.environ["MAIL_HOST"]
     port = int(os.getenv("MAIL_SMTP_PORT", "587"))
-    if _ssl_ctx() and port in (465, 587):      # implicit TLS (465) or upgrade (587)
-        if port == 465:
-            smtp = smtplib.SMTP_SSL(host, port, context=_ssl_ctx())
+    tls = None
+    with metrics.command("smtp", "CONNECT"):
+        if _ssl_ctx() and port in (465, 587):      # implicit TLS (465) or upgrade (587)
+            tls = mail_tls.resuming("smtp", host, port, verify=_verify_tls())
+            if port == 465:
+                smtp = smtplib.SMTP_SSL(host, port, context=tls, timeout=mail_health.connect_timeout())
+            else:
+                smtp = smtplib.SMTP(host, port, timeout=mail_health.connect_timeout())
+                smtp.starttls(context=tls)
         else:
-            smtp = smtplib.SMTP(host, port)
-            smtp.starttls(context=_ssl_ctx())
-    else:
-        smtp = smtplib.SMTP(host, port)
-    smtp.login(os.environ["MAIL_USER"], os.environ["MAIL_PASS"])
+            smtp = smtplib.SMTP(host, port, timeout=mail_health.connect_timeout())
+    mail_health.arm(smtp)
+    with metrics.command("smtp", "AUTH"):
+        smtp.login(os.environ["MAIL_USER"], os.environ["MAIL_PASS"])
+    if tls:
+        tls.save()
+    mail_caps.record("smtp", host, port, mail_caps.smtp_caps(smtp))
     return smtp
 
+def _probe_caps() -> None:
+    """Startup / periodic capability probe (see mail_caps)."""
+    host = os.environ["MAIL_HOST"]
+    if os.getenv("MAIL_IMAP_PORT"):
+        with _IMAP_POOL.connection() as imap:
+            mail_caps.record("imap", host, int(os.environ["MAIL_IMAP_PORT"]), mail_caps.imap_caps(imap))
+    else:
+        with _pop() as pop:
+            mail_caps.record("pop", host, int(os.getenv("MAIL_POP_PORT", "110")), mail_caps.pop_caps(pop))
+    with _SMTP_POOL.connection():       # also leaves a warm session in the pool
+        pass
+
+def _guard(proto: str, port_var: str, default_port: str):
+    """Connection slot and circuit breaker for one of MAIL_HOST's services (see mail_limits)."""
+    return lambda: mail_limits.upstream(proto, os.environ["MAIL_HOST"], int(os.getenv(port_var, default_port)))
+
+@contextmanager
+def _pop():
+    """A POP session for one call; QUIT (which commits deletions) only on success."""
+    with _guard("pop", "MAIL_POP_PORT", "110")():
+        pop = _connect_pop()
+        try:
+            yield pop
+        except BaseException:
+            pop.close()
+            raise
+        pop.quit()
+
+def _logout_quietly(imap: imaplib.IMAP4) -> None:
+    try:
+        imap.logout()
+    except (imaplib.IMAP4.error, OSError):
+        pass
+
+# One pool of logged-in IMAP sessions; each fan-out branch takes its own.
+_IMAP_POOL = mail_pool.ConnectionPool(
+    _connect_imap,
+    close=_logout_quietly,
+    check=lambda imap: imap.noop()[0] == "OK",
+    max_size=int(os.getenv("MAIL_IMAP_POOL_SIZE", "4")),
+    name="imap",
+    prepare=mail_health.arm,
+    guard=_guard("imap", "MAIL_IMAP_PORT", "993"),
+)
+
+# Authenticated SMTP sessions reused across sends (RSET between messages)
+_SMTP_POOL = mail_smtp.session_pool(_connect_smtp, _guard("smtp", "MAIL_SMTP_PORT", "587"))
+
+def _quote_mailbox(name: str) -> str:
+    """Quote a mailbox name for SELECT (names may contain spaces)."""
+    return '"' + name.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+@contextmanager
+def _imap(folder: str = "INBOX"):
+    """Check out a pooled IMAP session with *folder* selected."""
+    with _IMAP_POOL.connection() as imap:
+        if getattr(imap, "_mcp_folder", None) != folder:
+            imap._mcp_folder = None
+            with metrics.command("imap", "SELECT"):
+                ok, data = imap.select(_quote_mailbox(folder))
+            if ok != "OK":
+                raise RuntimeError(f"IMAP SELECT {folder!r} failed: {data}")
+            imap._mcp_folder = folder
+        yield imap
+
 def _decode_header(raw: str) -> str:
     """Turn '=?UTF‑8?Q?=E2=9C=94?=' into readable text."""
     parts = email.header.decode_header(raw)
@@ -72,19 +170,108 @@ def _decode_header(raw: str) -> str:
         for b, enc in parts
     )
 
-# ────────────────────────── CORS Configuration ──────────────────────────── #
-
-# Fixed: 2025-07-26T22:59:00+05:00 - Updated to use Starlette CORSMiddleware per FastMCP documentation
-# This replaces the custom middleware approach which couldn't inject HTTP headers properly
-cors_middleware = [
-    Middleware(
-        CORSMiddleware,
-        allow_origins=["*"],  # Allow all origins including ChatGPT web interface
-        allow_methods=["*"],  # Allow all HTTP methods
-        allow_headers=["*"],  # Allow all headers
-        allow_credentials=True  # Enable credentials for security
-    )
-]
+_LIST_RE = re.compile(rb'\((?P<flags>[^)]*)\) (?P<delim>"(?:[^"\\]|\\.)*"|NIL) ?(?P<name>.*)$')
+_UID_RE = re.compile(rb"UID (\d+)")
+_FLAGS_RE = re.compile(rb"FLAGS \(([^)]*)\)")
+_SUMMARY_ITEMS = "(UID FLAGS BODY.PEEK[HEADER.FIELDS (FROM SUBJECT DATE)])"
+
+def _unquote(raw: bytes) -> str:
+    text = raw.decode("utf-8", "replace")
+    if len(text) >= 2 and text[0] == text[-1] == '"':
+        text = re.sub(r'\\(.)', r"\1", text[1:-1])
+    return text
+
+def _parse_list_line(item) -> Dict | None:
+    """Parse one LIST response line (names may arrive as a literal tuple)."""
+    head, literal = (item[0], item[1]) if isinstance(item, tuple) else (item, None)
+    m = _LIST_RE.match(head or b"")
+    if not m:
+        return None
+    delim = m.group("delim")
+    return {
+        "name": literal.decode("utf-8", "replace") if literal is not None else _unquote(m.group("name")),
+        "delimiter": None if delim == b"NIL" else _unquote(delim),
+        "flags": m.group("flags").decode().split(),
+    }
+
+def _fetched(data) -> None:
+    """Count the literals of a FETCH response into mail_bytes_total (see metrics)."""
+    metrics.BYTES.inc("imap", "in", amount=sum(len(item[1]) for item in data if isinstance(item, tuple)))
+
+def _list_folders() -> List[Dict]:
+    with _IMAP_POOL.connection() as imap, metrics.command("imap", "LIST"):
+        ok, data = imap.list()
+    if ok != "OK":
+        raise RuntimeError("IMAP LIST failed")
+    return [f for f in map(_parse_list_line, data) if f]
+
+def _resolve_folders(folder: str) -> List[str]:
+    """'INBOX' -> one folder, 'INBOX,Sent' -> several, '*' -> every selectable folder."""
+    if folder.strip() == "*":
+        return [f["name"] for f in _list_folders()
+                if not {"\\Noselect", "\\NonExistent"} & set(f["flags"])]
+    names = [f.strip() for f in folder.split(",") if f.strip()]
+    return names or ["INBOX"]
+
+def _fetch_summaries(imap: imaplib.IMAP4, uids: List[bytes], folder: str) -> List[Dict]:
+    """One UID FETCH for all *uids*; returned newest (highest UID) first."""
+    if not uids:
+        return []
+    with metrics.command("imap", "FETCH"):
+        ok, data = imap.uid("FETCH", b",".join(uids).decode(), _SUMMARY_ITEMS)
+    if ok != "OK":
+        raise RuntimeError("IMAP FETCH failed")
+    _fetched(data)
+    found = {}
+    for i, item in enumerate(data):
+        if not isinstance(item, tuple):
+            continue
+        meta = item[0]
+        if i + 1 < len(data) and isinstance(data[i + 1], bytes):
+            meta += data[i + 1]          # some servers send FLAGS after the literal
+        uid = _UID_RE.search(meta)
+        if not uid:
+            continue
+        flags = _FLAGS_RE.search(meta)
+        msg = email.message_from_bytes(item[1])
+        found[uid.group(1)] = {
+            "uid": uid.group(1).decode(),
+            "folder": folder,
+            "from": _decode_header(msg.get("From", "")),
+            "subject": _decode_header(msg.get("Subject", "")),
+            "date": msg.get("Date", ""),
+            "is_flagged": bool(flags) and b"\\Flagged" in flags.group(1),
+        }
+    return [found[u] for u in reversed(uids) if u in found]
+
+def _date_key(item: Dict) -> float:
+    try:
+        dt = email.utils.parsedate_to_datetime(item["date"])
+    except (TypeError, ValueError, IndexError):
+        return 0.0
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+def _fan_out(folders: List[str], per_folder: Callable[[str], List[Dict]], max_items: int) -> List[Dict]:
+    """
+    Run *per_folder* for every folder concurrently, each on its own pooled
+    session, and merge the results newest-date first.
+    """
+    if len(folders) == 1:
+        return per_folder(folders[0])[:max_items]
+    workers = min(len(folders), _IMAP_POOL.max_size)
+    # each branch runs in the caller's context: its deadline and trace span
+    contexts = [contextvars.copy_context() for _ in folders]
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="imap-fanout") as pool:
+        merged = [item for part in pool.map(lambda ctx, name: ctx.run(per_folder, name), contexts, folders)
+                  for item in part]
+    merged.sort(key=_date_key, reverse=True)
+    return merged[:max_items]
+
+def _require_inbox(folder: str) -> None:
+    if folder.strip() not in ("", "INBOX"):
+        raise RuntimeError("POP mailboxes only have INBOX; set MAIL_IMAP_PORT for folders.")
 
 # ──────────────────────────  MCP  ────────────────────────────── #
 
@@ -99,44 +286,67 @@ cors_middleware = [
 # Fixed: 2025-07-27T01:26:00+05:00 - Revert to working FastMCP setup
 # custom_middleware parameter not supported in this FastMCP version
 mcp = FastMCP("plain-mail-mcp")
+mcp.add_middleware(metrics.tool_middleware())              # latency by tool and outcome, see metrics
+mcp.add_middleware(tracing.tool_middleware())              # serialization span, see tracing
+mcp.add_middleware(profiling.tool_middleware())            # on-demand cProfile, see profiling
+mcp.add_middleware(mail_health.deadline_middleware())      # per-call deadline, see mail_health
+
+# concurrent identical reads share one upstream fetch (see single_flight);
+# listings fall back to their last good answer while the host is failing
+_READS = single_flight.SingleFlight()
+_STALE = mail_health.StaleCache()
+metrics.single_flight_collector(_READS)
 
 # ---------------- reading / listing ---------------- #
 
-@mcp.tool(description="List newest messages (optionally only flagged).")
-def list_messages(max_items: int = 10, flagged_only: bool = False) -> List[Dict]:
+@mcp.tool(description="List mailbox folders (IMAP); POP mailboxes only have INBOX.")
+@tracing.traced
+@_READS.coalesce(stale=_STALE)
+def list_folders() -> List[Dict]:
+    """
+    Each item = {name, delimiter, flags}.  Pass *name* as the *folder*
+    argument of the other tools.
+    """
+    if not os.getenv("MAIL_IMAP_PORT"):
+        return [{"name": "INBOX", "delimiter": None, "flags": []}]
+    return _list_folders()
+
+@mcp.tool(description="List newest messages (optionally only flagged). "
+                      "folder: one name, a comma-separated list, or '*' for all folders.")
+@tracing.traced
+@_READS.coalesce(stale=_STALE)
+def list_messages(max_items: int = 10, flagged_only: bool = False, folder: str = "INBOX") -> List[Dict]:
     """
     Returns a summary list.  Uses IMAP if available (better), otherwise POP.
-    Each item = {uid, from, subject, date, is_flagged}
+    Each item = {uid, folder, from, subject, date, is_flagged}
+    Several folders are queried in parallel and merged newest-first.
     """
     if os.getenv("MAIL_IMAP_PORT"):
-        imap = _connect_imap()
         search_crit = '(FLAGGED)' if flagged_only else 'ALL'
-        ok, data = imap.uid("SEARCH", None, search_crit)
-        if ok != "OK":
-            raise RuntimeError("IMAP SEARCH failed")
-        uids = data[0].split()[-max_items:]     # newest last; slice
-        results = []
-        for uid in reversed(uids):
-            ok, msgdata = imap.uid("FETCH", uid, "(FLAGS BODY.PEEK[HEADER.FIELDS (FROM SUBJECT DATE)])")
-            hdr_bytes = msgdata[0][1]
-            msg = email.message_from_bytes(hdr_bytes)
-            messages_not_found = False
-            results.append({
-                "uid": uid.decode(),
-                "from": _decode_header(msg.get("From", "")),
-                "subject": _decode_header(msg.get("Subject", "")),
-                "date": msg.get("Date", ""),
-                "is_flagged": b"\\Flagged" in msgdata[0][0]
-            })
-        imap.logout()
-        return results
+
+        def per_folder(name: str) -> List[Dict]:
+            with _imap(name) as imap:
+                with metrics.command("imap", "SEARCH"):
+                    ok, data = imap.uid("SEARCH", None, search_crit)
+                if ok != "OK":
+                    raise RuntimeError("IMAP SEARCH failed")
+                uids = data[0].split()[-max_items:]     # newest last; slice
+                return _fetch_summaries(imap, uids, name)
+
+        return _fan_out(_resolve_folders(folder), per_folder, max_items)
     # ---------- POP fallback (no flags) ----------
-    pop = _connect_pop()
-    total, _ = pop.stat()
+    _require_inbox(folder)
+    with _pop() as pop:
+        with metrics.command("pop", "STAT"):
+            total, _ = pop.stat()
+        caps = mail_caps.ensure("pop", os.environ["MAIL_HOST"], int(os.getenv("MAIL_POP_PORT", "110")), pop)
+        ordinals = list(range(max(1, total - max_items + 1), total + 1))
+        headers = mail_pop.fetch_headers(pop, ordinals, caps)
     msgs = []
-    for i in range(max(1, total - max_items + 1), total + 1):
-        hdr = pop.top(i, 0)[1]
-        msg = email.message_from_bytes(b"\n".join(hdr))
+    for i, hdr in zip(ordinals, headers):
+        if hdr is None:
+            continue
+        msg = email.message_from_bytes(hdr)
         msgs.append({
             "uid": str(i),
             "from": _decode_header(msg.get("From", "")),
@@ -144,82 +354,181 @@ def list_messages(max_items: int = 10, flagged_only: bool = False) -> List[Dict]
             "date": msg.get("Date", ""),
             "is_flagged": False
         })
-    pop.quit()
     return list(reversed(msgs))
 
+@mcp.tool(description="Search messages by text (IMAP only). "
+                      "folder: one name, a comma-separated list, or '*' for all folders.")
+@tracing.traced
+@_READS.coalesce(stale=_STALE)
+def search_messages(query: str, folder: str = "INBOX", max_items: int = 20) -> List[Dict]:
+    """
+    Full-text IMAP SEARCH; returns the same summary items as list_messages,
+    newest first.
+    """
+    if not os.getenv("MAIL_IMAP_PORT"):
+        raise RuntimeError("Search requires IMAP; set MAIL_IMAP_PORT.")
+
+    def per_folder(name: str) -> List[Dict]:
+        with _imap(name) as imap, metrics.command("imap", "SEARCH"):
+            if query.isascii():
+                quoted = query.replace("\\", "\\\\").replace('"', '\\"')
+                ok, data = imap.uid("SEARCH", None, f'TEXT "{quoted}"')
+            else:
+                imap.literal = query.encode("utf-8")
+                ok, data = imap.uid("SEARCH", "CHARSET", "UTF-8", "TEXT")
+            if ok != "OK":
+                raise RuntimeError("IMAP SEARCH failed")
+            uids = data[0].split()[-max_items:]
+            return _fetch_summaries(imap, uids, name)
+
+    return _fan_out(_resolve_folders(folder), per_folder, max_items)
+
 @mcp.tool(description="Download full RFC‑822 message by UID / POP ordinal.")
-def get_message(uid: str) -> str:
+@tracing.traced
+@_READS.coalesce()
+def get_message(uid: str, folder: str = "INBOX") -> str:
     """
-    Returns the raw message text.  Use IMAP UID or POP ordinal.
+    Returns the raw message text.  Use IMAP UID (within *folder*) or POP ordinal.
     """
     if os.getenv("MAIL_IMAP_PORT"):
-        imap = _connect_imap()
-        ok, data = imap.uid("FETCH", uid.encode(), "(RFC822)")
-        imap.logout()
-        if ok != "OK":
+        with _imap(folder) as imap, metrics.command("imap", "FETCH"):
+            ok, data = imap.uid("FETCH", uid, "(RFC822)")
+        if ok != "OK" or not data or not isinstance(data[0], tuple):
             raise RuntimeError("IMAP FETCH failed")
+        _fetched(data)
         return data[0][1].decode(errors="replace")
-    pop = _connect_pop()
-    msg_lines = pop.retr(int(uid))[1]
-    pop.quit()
+    _require_inbox(folder)
+    with _pop() as pop, metrics.command("pop", "RETR"):
+        msg_lines = mail_pop.received(pop.retr(int(uid))[1])
     return b"\n".join(msg_lines).decode(errors="replace")
 
 @mcp.tool(description="Delete message by UID / POP ordinal.")
-def delete_message(uid: str) -> str:
+@tracing.traced
+def delete_message(uid: str, folder: str = "INBOX") -> str:
     if os.getenv("MAIL_IMAP_PORT"):
-        imap = _connect_imap()
-        imap.uid("STORE", uid, "+FLAGS.SILENT", "(\\Deleted)")
-        imap.expunge()
-        imap.logout()
+        with _imap(folder) as imap:
+            with metrics.command("imap", "STORE"):
+                imap.uid("STORE", uid, "+FLAGS.SILENT", "(\\Deleted)")
+            with metrics.command("imap", "EXPUNGE"):
+                imap.expunge()
     else:
-        pop = _connect_pop()
-        pop.dele(int(uid))
-        pop.quit()
+        _require_inbox(folder)
+        with _pop() as pop:
+            with metrics.command("pop", "DELE"):
+                pop.dele(int(uid))
     return f"Message {uid} deleted."
 
 # ---------------- flag / pin (IMAP only) ---------------- #
 
 @mcp.tool(description="Flag (pin) a message (IMAP only).")
-def flag_message(uid: str) -> str:
+@tracing.traced
+def flag_message(uid: str, folder: str = "INBOX") -> str:
     if not os.getenv("MAIL_IMAP_PORT"):
         return "Flagging not supported on POP‑only mailboxes."
-    imap = _connect_imap()
-    imap.uid("STORE", uid, "+FLAGS.SILENT", "(\\Flagged)")
-    imap.logout()
+    with _imap(folder) as imap, metrics.command("imap", "STORE"):
+        imap.uid("STORE", uid, "+FLAGS.SILENT", "(\\Flagged)")
     return f"Message {uid} flagged."
 
 @mcp.tool(description="Remove flag from a message (IMAP only).")
-def unflag_message(uid: str) -> str:
+@tracing.traced
+def unflag_message(uid: str, folder: str = "INBOX") -> str:
     if not os.getenv("MAIL_IMAP_PORT"):
         return "Unflagging not supported on POP‑only mailboxes."
-    imap = _connect_imap()
-    imap.uid("STORE", uid, "-FLAGS.SILENT", "(\\Flagged)")
-    imap.logout()
+    with _imap(folder) as imap, metrics.command("imap", "STORE"):
+        imap.uid("STORE", uid, "-FLAGS.SILENT", "(\\Flagged)")
     return f"Message {uid} unflagged."
 
 # ---------------- sending ---------------- #
 
-@mcp.tool(description="Send an email.")
-def send_email(to: str, subject: str, body: str, cc: str = "", bcc: str = "") -> str:
+def _deliver(mail_from: str, rcpts: List[str], fp, size: int) -> Dict:
+    """Stream one spooled message over a pooled SMTP session (send_queue worker)."""
+    with _SMTP_POOL.connection() as smtp:
+        return mail_smtp.send_stream(smtp, mail_from, rcpts, fp, size)
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+_LIMITER = rate_limit.from_env()
+_OUTBOX = send_queue.from_env(_deliver, os.path.join(_HERE, "outbox.sqlite3"), _LIMITER)
+metrics.gauge("mail_outbox_depth", "Queued emails not yet delivered.", _OUTBOX.depth)
+
+@mcp.tool(description="Queue an email for delivery; returns a queue_id for get_send_status. "
+                      "attachments: file names under the server's attachment directory.")
+@tracing.traced
+def send_email(to: str, subject: str, body: str, cc: str = "", bcc: str = "",
+               idempotency_key: str = "", attachments: Optional[List[str]] = None) -> str:
     """
-    Simple text email.  Supports CC/BCC (comma‑separated).
+    Simple text email.  Supports CC/BCC (comma‑separated) and attachments
+    (paths under MAIL_ATTACHMENT_DIR, streamed from disk when sent).
+    Returns immediately; a retry with the same idempotency_key (or the same
+    recipients/subject/body within a few minutes) returns the original queue id.
     """
+    sender = os.environ["MAIL_USER"]
     msg = email.message.EmailMessage()
-    msg["From"] = os.environ["MAIL_USER"]
+    msg["From"] = sender
     msg["To"] = to
     if cc:
         msg["Cc"] = cc
     msg["Subject"] = subject
-    msg.set_content(body)
-    smtp = _connect_smtp()
+    msg["Date"] = email.utils.formatdate(localtime=True)
+    msg["Message-ID"] = email.utils.make_msgid()
     all_rcpts = [to] + [e.strip() for e in cc.split(",") if e] + [e.strip() for e in bcc.split(",") if e]
-    smtp.send_message(msg, from_addr=os.environ["MAIL_USER"], to_addrs=all_rcpts)
-    smtp.quit()
-    return "Email sent."
+    limit = mail_caps.smtp_size_limit(os.environ["MAIL_HOST"], int(os.getenv("MAIL_SMTP_PORT", "587")))
+    if attachments:
+        paths = mail_smtp.resolve_attachments(attachments, os.getenv("MAIL_ATTACHMENT_DIR",
+                                                                     os.path.join(_HERE, "attachments")))
+        spool = _OUTBOX.new_spool_file()
+        with open(spool, "wb") as fp:
+            mail_smtp.write_mime(fp, dict(msg.items()), body, paths)
+        if limit and os.path.getsize(spool) > limit:
+            os.remove(spool)
+            raise ValueError(f"Message exceeds the server's SIZE limit of {limit} bytes.")
+        key = idempotency_key or send_queue.content_key(sender, all_rcpts, subject, body, *paths)
+        return f"Email queued for delivery (queue_id={_OUTBOX.enqueue_file(sender, all_rcpts, spool, key)})."
+    msg.set_content(body)
+    raw = msg.as_bytes(policy=msg.policy.clone(linesep="\r\n"))
+    if limit and len(raw) > limit:
+        raise ValueError(f"Message exceeds the server's SIZE limit of {limit} bytes.")
+    key = idempotency_key or send_queue.content_key(sender, all_rcpts, subject, body)
+    return f"Email queued for delivery (queue_id={_OUTBOX.enqueue(sender, all_rcpts, raw, key)})."
+
+@mcp.tool(description="Send a templated email to many recipients over pipelined SMTP; returns a result table.")
+@tracing.traced
+def send_bulk(template: str, recipients: List[str], per_recipient_vars: Optional[Dict[str, Dict[str, str]]] = None,
+              subject: str = "") -> str:
+    """
+    One message per recipient; *template* and *subject* use $name
+    placeholders from per_recipient_vars[recipient] ($email is the recipient).
+    """
+    sender = os.environ["MAIL_USER"]
+    _LIMITER.check(len(recipients), len(recipients))
+    messages = mail_smtp.render_bulk(sender, subject, template, recipients, per_recipient_vars)
+    return mail_smtp.results_table(mail_smtp.send_bulk(_SMTP_POOL, sender, messages, _LIMITER))
+
+@mcp.tool(description="Delivery status of a queued email (queued / sending / sent / failed).")
+@tracing.traced
+def get_send_status(queue_id: str) -> Dict:
+    status = _OUTBOX.status(queue_id)
+    if status is None:
+        raise ValueError(f"Unknown queue_id {queue_id!r}")
+    return status
+
+# ---------------- metrics / profiling ---------------- #
+
+@mcp.custom_route("/metrics", methods=["GET"])
+async def metrics_endpoint(request):
+    """Prometheus scrape target (HTTP transport); see metrics.allowed for METRICS_TOKEN."""
+    from starlette.responses import PlainTextResponse
+    if not metrics.allowed(request.headers.get("authorization", "")):
+        return PlainTextResponse("Unauthorized\n", status_code=401)
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+# admin-only profiling window (MAIL_ADMIN_TOKEN), see profiling
+mcp.custom_route("/debug/profile", methods=["GET"])(profiling.endpoint)
 
 # ---------------- main entry ---------------- #
 
 if __name__ == "__main__":
+    mail_caps.start_refresh(_probe_caps)
+    _OUTBOX.start()                     # deliver what a previous run left in the spool
     mode = os.getenv("MCP_TRANSPORT", "http")
     if mode == "stdio":
         mcp.run(transport="stdio")
@@ -227,4 +536,5 @@ if __name__ == "__main__":
         port = int(os.getenv("PORT", "8088"))
         # Fixed: 2025-07-27T01:26:00+05:00 - Revert to mcp.run() since custom_middleware not supported
         # Your FastMCP version has limited parameter support, using basic approach
-        mcp.run(transport="http", host="0.0.0.0", port=port)
+        mcp.run(transport="http", host="0.0.0.0", port=port,
+                uvicorn_config={"log_config": None})    # uvicorn logs through mail_logging too
@@ -0,0 +1,136 @@
+"""
+mail_pool.py – Small thread-safe pool of logged-in mail connections.
+Shared by the MCP servers so concurrent tool calls reuse sessions instead
+of paying connect + TLS + login on every call.
+"""
+import threading, time, logging
+from collections import deque
+from contextlib import ExitStack, contextmanager
+from typing import Callable, ContextManager, Deque, Generic, Iterator, Optional, TypeVar
+
+import mail_limits
+import tracing
+
+LOG = logging.getLogger("mail_pool")
+
+T = TypeVar("T")
+
+
+class _Entry:
+    __slots__ = ("conn", "created", "uses", "idle_since")
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.created = self.idle_since = time.monotonic()
+        self.uses = 0
+
+
+class ConnectionPool(Generic[T]):
+    """
+    Keep up to *max_size* live connections created by *factory*.
+
+    Callers beyond *max_size* wait in FIFO order, at most *max_queue* of them
+    (see mail_limits.Bulkhead).
+    Idle connections are reused LIFO (the warmest one first); one that sat
+    idle longer than *max_idle* seconds is probed with *check* before it is
+    handed out.  A connection whose user raises is closed, never returned.
+    On release, *reset* (if given) returns the session to a clean state, and
+    connections past *max_uses* checkouts or *max_age* seconds are recycled.
+    *prepare* (if given) runs on every checkout, e.g. to set socket timeouts
+    for the caller's deadline, and each checkout runs inside *guard()* (see
+    mail_health.guard) so failures count against the host.
+    """
+
+    def __init__(self, factory: Callable[[], T], close: Callable[[T], None],
+                 check: Optional[Callable[[T], bool]] = None,
+                 max_size: int = 4, max_idle: float = 60.0, name: str = "pool",
+                 reset: Optional[Callable[[T], None]] = None,
+                 max_uses: int = 0, max_age: float = 0.0,
+                 prepare: Optional[Callable[[T], None]] = None,
+                 guard: Optional[Callable[[], ContextManager]] = None,
+                 max_queue: int = mail_limits.QUEUE_DEPTH):
+        self.name = name
+        self.max_size = max(1, max_size)
+        self._factory = factory
+        self._close = close
+        self._check = check
+        self._reset = reset
+        self._prepare = prepare
+        self._guard = guard
+        self._max_idle = max_idle
+        self._max_uses = max_uses
+        self._max_age = max_age
+        self._idle: Deque[_Entry] = deque()
+        self._lock = threading.Lock()
+        self._slots = mail_limits.Bulkhead(name, self.max_size, max_queue)
+        self._slots.stats.gauges["idle"] = lambda: len(self._idle)
+
+    @contextmanager
+    def connection(self) -> Iterator[T]:
+        """Check a connection out for the duration of the ``with`` block."""
+        with ExitStack() as held:
+            entry = None
+            try:
+                with tracing.span("pool.checkout", {"mail.pool": self.name}):
+                    held.enter_context(self._slots.slot())
+                    if self._guard is not None:
+                        held.enter_context(self._guard())
+                    entry = self._take()
+                    if self._prepare is not None:
+                        self._prepare(entry.conn)
+                yield entry.conn
+            except BaseException:
+                if entry is not None:
+                    self._discard(entry.conn)
+                    entry = None
+                raise
+            finally:
+                if entry is not None:
+                    self._release(entry)
+
+    def close_all(self) -> None:
+        """Close every idle connection (checked-out ones are left alone)."""
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for entry in idle:
+            self._discard(entry.conn)
+
+    def _take(self) -> _Entry:
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                entry = self._idle.pop()
+            if self._check is None or time.monotonic() - entry.idle_since < self._max_idle:
+                return entry
+            try:
+                if self._check(entry.conn):
+                    return entry
+            except Exception as e:
+                LOG.debug("%s: idle connection failed health check: %s", self.name, e)
+            self._discard(entry.conn)
+        return _Entry(self._factory())
+
+    def _release(self, entry: _Entry) -> None:
+        entry.uses += 1
+        now = time.monotonic()
+        if (self._max_uses and entry.uses >= self._max_uses) or \
+                (self._max_age and now - entry.created >= self._max_age):
+            self._discard(entry.conn)
+            return
+        if self._reset is not None:
+            try:
+                self._reset(entry.conn)
+            except Exception as e:
+                LOG.debug("%s: reset failed, dropping connection: %s", self.name, e)
+                self._discard(entry.conn)
+                return
+        entry.idle_since = now
+        with self._lock:
+            self._idle.append(entry)
+
+    def _discard(self, conn: T) -> None:
+        try:
+            self._close(conn)
+        except Exception as e:
+            LOG.debug("%s: error closing connection: %s", self.name, e)
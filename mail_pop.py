@@ -0,0 +1,119 @@
+"""
+mail_pop.py – POP3 helpers shared by the MCP servers.
+"""
+import poplib, logging
+from typing import Callable, Dict, List, Optional, Union
+
+import metrics
+
+LOG = logging.getLogger("mail_pop")
+
+PIPELINE_WINDOW = 32     # commands in flight before reading responses back
+
+
+def fetch_headers(conn: poplib.POP3, ordinals: List[int], caps: Dict[str, str]) -> List[Optional[bytes]]:
+    """
+    Header block of each message in *ordinals* (None if the server refused it).
+
+    Uses ``TOP n 0`` when advertised, pipelined in windows when the server
+    supports PIPELINING; otherwise falls back to RETR and keeps the headers.
+    """
+    if caps and "TOP" not in caps:
+        return [_headers_via_retr(conn, n) for n in ordinals]
+    if "PIPELINING" not in caps:
+        return [_top(conn, n) for n in ordinals]
+    out: List[Optional[bytes]] = []
+    for start in range(0, len(ordinals), PIPELINE_WINDOW):
+        window = ordinals[start:start + PIPELINE_WINDOW]
+        with metrics.command("pop", "TOP"):
+            for n in window:
+                conn._putcmd(f"TOP {n} 0")
+            for n in window:
+                try:
+                    out.append(_headers(received(conn._getlongresp()[1])))
+                except poplib.error_proto as e:     # -ERR has no body, stream stays in sync
+                    LOG.debug("TOP %s refused: %s", n, e)
+                    out.append(None)
+    return out
+
+
+def uid_map(conn: poplib.POP3, caps: Dict[str, str]) -> Dict[int, str]:
+    """Ordinal -> UIDL unique id for the whole maildrop ({} without UIDL)."""
+    if caps and "UIDL" not in caps:
+        return {}
+    try:
+        with metrics.command("pop", "UIDL"):
+            lines = conn.uidl()[1]
+    except poplib.error_proto:
+        return {}
+    out: Dict[int, str] = {}
+    for line in lines:
+        n, _, uid = line.decode("ascii", "replace").partition(" ")
+        out[int(n)] = uid.strip()
+    return out
+
+
+def cached_headers(conn: poplib.POP3, ordinals: List[int], caps: Dict[str, str],
+                   cache, account: str) -> List[Optional[bytes]]:
+    """
+    fetch_headers() through *cache* (see shared_state), keyed by UIDL: only
+    messages not seen before go over the wire.  Without UIDL nothing is
+    cached, since ordinals change as messages are deleted.
+    """
+    uids = uid_map(conn, caps)
+    known = cache.get_many(account, [uids[n] for n in ordinals if n in uids])
+    missing = [n for n in ordinals if uids.get(n) not in known]
+    metrics.CACHE.inc("headers", "hit", amount=len(ordinals) - len(missing))
+    metrics.CACHE.inc("headers", "miss", amount=len(missing))
+    fetched = dict(zip(missing, fetch_headers(conn, missing, caps)))
+    cache.put_many(account, {uids[n]: hdr for n, hdr in fetched.items() if hdr is not None and n in uids})
+    return [known[uids[n]] if uids.get(n) in known else fetched.get(n) for n in ordinals]
+
+
+def retr_many(conn: poplib.POP3, ordinals: List[int], caps: Dict[str, str]) -> List[Union[List[bytes], poplib.error_proto]]:
+    """Lines of each message in *ordinals*, or the error_proto the server answered with."""
+    return _pipelined(conn, [f"RETR {n}" for n in ordinals], caps, lambda: received(conn._getlongresp()[1]))
+
+
+def dele_many(conn: poplib.POP3, ordinals: List[int], caps: Dict[str, str]) -> List[Optional[poplib.error_proto]]:
+    """Mark each of *ordinals* deleted (committed by QUIT); None, or the refusal, per message."""
+    return [None if isinstance(r, bytes) else r
+            for r in _pipelined(conn, [f"DELE {n}" for n in ordinals], caps, conn._getresp)]
+
+
+def _pipelined(conn: poplib.POP3, commands: List[str], caps: Dict[str, str], read: Callable):
+    window = PIPELINE_WINDOW if "PIPELINING" in caps else 1
+    out = []
+    for start in range(0, len(commands), window):
+        chunk = commands[start:start + window]
+        with metrics.command("pop", chunk[0].split()[0]):
+            for cmd in chunk:
+                conn._putcmd(cmd)
+            for _ in chunk:
+                try:
+                    out.append(read())
+                except poplib.error_proto as e:     # -ERR has no body, stream stays in sync
+                    out.append(e)
+    return out
+
+
+def received(lines: List[bytes]) -> List[bytes]:
+    """Count a multi-line response's bytes into mail_bytes_total (see metrics)."""
+    metrics.BYTES.inc("pop", "in", amount=sum(map(len, lines)) + 2 * len(lines))
+    return lines
+
+
+def _top(conn: poplib.POP3, n: int) -> Optional[bytes]:
+    with metrics.command("pop", "TOP"):
+        return _headers(received(conn.top(n, 0)[1]))
+
+
+def _headers(lines: List[bytes]) -> bytes:
+    return b"\r\n".join(lines)
+
+
+def _headers_via_retr(conn: poplib.POP3, n: int) -> bytes:
+    with metrics.command("pop", "RETR"):
+        lines = received(conn.retr(n)[1])
+    end = lines.index(b"") if b"" in lines else len(lines)
+    return _headers(lines[:end])
@@ -0,0 +1,359 @@
+"""
+mail_smtp.py – SMTP helpers shared by the MCP servers: a pool of
+authenticated sessions reused across send_email calls, templated bulk
+sending with ESMTP PIPELINING (RFC 2920), and streamed delivery of large
+messages with CHUNKING / BDAT (RFC 3030).
+"""
+import os, re, time, uuid, base64, string, smtplib, mimetypes, threading, contextvars, logging
+from email.message import EmailMessage
+from email.utils import formatdate, make_msgid
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import mail_health
+import mail_pool
+import metrics
+import rate_limit
+
+LOG = logging.getLogger("mail_smtp")
+
+
+def _quit_quietly(smtp: smtplib.SMTP) -> None:
+    try:
+        smtp.quit()
+    except (smtplib.SMTPException, OSError):
+        smtp.close()
+
+
+def _noop_ok(smtp: smtplib.SMTP) -> bool:
+    return smtp.noop()[0] == 250
+
+
+def _rset(smtp: smtplib.SMTP) -> None:
+    code, resp = smtp.rset()
+    if code != 250:
+        raise smtplib.SMTPResponseException(code, resp)
+
+
+def session_pool(factory: Callable[[], smtplib.SMTP], guard=None, name: str = "smtp") -> mail_pool.ConnectionPool:
+    """
+    Pool of logged-in SMTP sessions made by *factory*.  Sessions are RSET
+    after every message, NOOP-checked after sitting idle, and recycled after
+    MAIL_SMTP_MAX_MESSAGES messages or MAIL_SMTP_MAX_AGE seconds.  Each
+    checkout gets the caller's socket timeout and runs under *guard*
+    (see mail_health).
+    """
+    return mail_pool.ConnectionPool(
+        factory,
+        close=_quit_quietly,
+        check=_noop_ok,
+        reset=_rset,
+        max_size=int(os.getenv("MAIL_SMTP_POOL_SIZE", "2")),
+        max_idle=float(os.getenv("MAIL_SMTP_IDLE_CHECK", "15")),
+        max_uses=int(os.getenv("MAIL_SMTP_MAX_MESSAGES", "50")),
+        max_age=float(os.getenv("MAIL_SMTP_MAX_AGE", "300")),
+        name=name,
+        prepare=mail_health.arm,
+        guard=guard,
+    )
+
+
+# ---------------- pipelined / bulk sending ---------------- #
+
+Reply = Tuple[int, str]
+
+
+def _text(reply: Tuple[int, bytes]) -> Reply:
+    code, msg = reply
+    return code, msg.decode("utf-8", "replace") if isinstance(msg, bytes) else str(msg)
+
+
+def dot_stuff(raw: bytes) -> bytes:
+    """DATA payload: leading dots doubled, terminated by CRLF.CRLF."""
+    data = re.sub(rb"(?m)^\.", b"..", raw)
+    if not data.endswith(b"\r\n"):
+        data += b"\r\n"
+    return data + b".\r\n"
+
+
+def send_pipelined(smtp: smtplib.SMTP, mail_from: str, rcpts: List[str], raw: bytes) -> Dict[str, Reply]:
+    """
+    Send one message with MAIL FROM, every RCPT TO and DATA written in a
+    single batch, then the body: two round trips instead of 3 + recipients.
+    Returns the final reply per recipient.
+    """
+    with metrics.command("smtp", "SEND"):
+        return _send_pipelined(smtp, mail_from, rcpts, raw)
+
+
+def _send_pipelined(smtp: smtplib.SMTP, mail_from: str, rcpts: List[str], raw: bytes) -> Dict[str, Reply]:
+    cmds = [f"MAIL FROM:{smtplib.quoteaddr(mail_from)}"]
+    cmds += [f"RCPT TO:{smtplib.quoteaddr(r)}" for r in rcpts]
+    cmds.append("DATA")
+    smtp.send("\r\n".join(cmds) + "\r\n")
+    mail = _text(smtp.getreply())
+    results = {r: _text(smtp.getreply()) for r in rcpts}
+    data = _text(smtp.getreply())
+    accepted = [r for r, (code, _) in results.items() if code in (250, 251)]
+    if data[0] == 354:
+        # a 354 with no accepted recipient still has to be closed with a bare "."
+        smtp.send(dot_stuff(raw) if accepted else b".\r\n")
+        if accepted:
+            metrics.BYTES.inc("smtp", "out", amount=len(raw))
+        final = _text(smtp.getreply())
+    else:
+        final = data if mail[0] == 250 else mail
+        if mail[0] == 250:
+            smtp.rset()
+    if mail[0] != 250:
+        return {r: mail for r in rcpts}
+    for r in accepted:
+        results[r] = final
+    return results
+
+
+def send_serial(smtp: smtplib.SMTP, mail_from: str, rcpts: List[str], raw: bytes) -> Dict[str, Reply]:
+    """Same result shape as send_pipelined(), for servers without PIPELINING."""
+    try:
+        with metrics.command("smtp", "SEND"):
+            refused = smtp.sendmail(mail_from, rcpts, raw)
+        metrics.BYTES.inc("smtp", "out", amount=len(raw))
+    except smtplib.SMTPRecipientsRefused as e:
+        return {r: _text(e.recipients[r]) for r in rcpts}
+    except smtplib.SMTPResponseException as e:
+        return {r: _text((e.smtp_code, e.smtp_error)) for r in rcpts}
+    return {r: _text(refused[r]) if r in refused else (250, "OK") for r in rcpts}
+
+
+def render_bulk(mail_from: str, subject: str, template: str, recipients: Iterable[str],
+                per_recipient_vars: Optional[Dict[str, Dict[str, str]]] = None) -> Iterator[Tuple[str, bytes]]:
+    """
+    Lazily render one message per recipient from ``string.Template`` text
+    (``$name`` / ``${name}``; ``$email`` is always the recipient).
+    """
+    subject_t, body_t = string.Template(subject), string.Template(template)
+    per_recipient_vars = per_recipient_vars or {}
+    for rcpt in recipients:
+        values = {"email": rcpt, **per_recipient_vars.get(rcpt, {})}
+        msg = EmailMessage()
+        msg["From"] = mail_from
+        msg["To"] = rcpt
+        msg["Subject"] = subject_t.safe_substitute(values)
+        msg["Date"] = formatdate(localtime=True)
+        msg["Message-ID"] = make_msgid()
+        msg.set_content(body_t.safe_substitute(values))
+        yield rcpt, msg.as_bytes(policy=msg.policy.clone(linesep="\r\n"))
+
+
+def send_bulk(pool: mail_pool.ConnectionPool, mail_from: str, messages: Iterable[Tuple[str, bytes]],
+              limiter: Optional[rate_limit.SendLimiter] = None) -> List[Tuple[str, int, str]]:
+    """
+    Deliver (recipient, raw) pairs over up to ``pool.max_size`` sessions.
+    Each session pulls the next message as soon as it is free, so rendering
+    stays one message ahead per session; *limiter* paces the messages,
+    with no session held while pacing, and a message whose turn would come
+    after the call's deadline is reported RateLimited instead.  Returns (recipient, code, text) in input order.
+    """
+    source = enumerate(messages)
+    lock = threading.Lock()
+    results: List[Tuple[int, str, int, str]] = []
+
+    def next_message():
+        with lock:
+            return next(source, None)
+
+    def take():
+        """Next (item, wait) with its quota reserved; refusals are recorded and skipped."""
+        while (item := next_message()) is not None:
+            if limiter is None:
+                return item, 0.0
+            try:
+                # never wait past the call's deadline: report RateLimited (with retry_after) instead
+                return item, limiter.reserve(1, 1, wait_ok=True, max_wait=mail_health.remaining())
+            except rate_limit.RateLimited as e:
+                with lock:
+                    results.append((item[0], item[1][0], 0, str(e)))
+        return None, 0.0
+
+    def worker():
+        item = None
+        try:
+            item, wait = take()
+            while item is not None:
+                time.sleep(wait)            # paced without holding a session or host slot
+                with pool.connection() as smtp:
+                    send = send_pipelined if smtp.has_extn("pipelining") else send_serial
+                    while True:
+                        i, (rcpt, raw) = item
+                        try:
+                            code, text = send(smtp, mail_from, [rcpt], raw)[rcpt]
+                        except (smtplib.SMTPException, OSError) as e:
+                            with lock:
+                                results.append((i, rcpt, 0, f"connection lost: {e}"))
+                            item = None
+                            raise                   # session is discarded by the pool
+                        with lock:
+                            results.append((i, rcpt, code, text))
+                        item, wait = take()
+                        if item is None or wait > 0:
+                            break                   # hand the session back while waiting
+        except Exception as e:                      # no session (refused, overloaded, deadline) or lost
+            LOG.warning("bulk send session failed: %s", e)
+            if item is not None:                    # reserved but never sent
+                with lock:
+                    results.append((item[0], item[1][0], 0, f"not attempted: {e}"))
+
+    # workers run in the caller's context: its deadline and trace span
+    threads = [threading.Thread(target=contextvars.copy_context().run, args=(worker,), name=f"smtp-bulk-{i}")
+               for i in range(pool.max_size)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    for i, (rcpt, _) in source:         # every session died: report what was never tried
+        results.append((i, rcpt, 0, "not attempted"))
+    return [r[1:] for r in sorted(results)]
+
+
+def results_table(results: List[Tuple[str, int, str]]) -> str:
+    """Compact fixed-width table of per-recipient results plus a summary line."""
+    width = max([len("recipient")] + [len(r) for r, _, _ in results])
+    lines = [f"{'recipient':<{width}}  code  detail"]
+    lines += [f"{r:<{width}}  {code:>4}  {text.splitlines()[0] if text else ''}" for r, code, text in results]
+    ok = sum(1 for _, code, _ in results if 200 <= code < 300)
+    lines.append(f"{ok}/{len(results)} accepted")
+    return "\n".join(lines)
+
+
+# ---------------- streamed MIME / BDAT ---------------- #
+
+CHUNK_SIZE = 1 << 20            # BDAT chunk; also bounds memory per send
+_B64_READ = 57 * 1024           # 57 raw bytes -> one 76-char base64 line
+
+
+def resolve_attachments(paths: List[str], root: str) -> List[str]:
+    """Absolute attachment paths, refusing anything outside *root*."""
+    root = os.path.realpath(root)
+    resolved = []
+    for p in paths:
+        full = os.path.realpath(os.path.join(root, p))
+        if os.path.commonpath([root, full]) != root:
+            raise ValueError(f"Attachment {p!r} is outside {root}")
+        if not os.path.isfile(full):
+            raise ValueError(f"Attachment {p!r} not found")
+        resolved.append(full)
+    return resolved
+
+
+def _header_block(msg: EmailMessage) -> bytes:
+    raw = msg.as_bytes(policy=msg.policy.clone(linesep="\r\n"))
+    return raw[:raw.index(b"\r\n\r\n") + 4]
+
+
+def write_mime(fp: BinaryIO, headers: Dict[str, str], body: str, attachments: List[str]) -> None:
+    """
+    Write a multipart/mixed message to *fp* piece by piece: the text part,
+    then each attachment file base64-encoded in fixed-size reads.  Memory
+    use does not depend on attachment size.
+    """
+    boundary = "=_" + uuid.uuid4().hex
+    top = EmailMessage()
+    for name, value in headers.items():
+        top[name] = value
+    top["MIME-Version"] = "1.0"
+    top["Content-Type"] = f'multipart/mixed; boundary="{boundary}"'
+    fp.write(_header_block(top))
+    delim = f"--{boundary}\r\n".encode()
+
+    text = EmailMessage()
+    text.set_content(body)
+    del text["MIME-Version"]
+    fp.write(delim + text.as_bytes(policy=text.policy.clone(linesep="\r\n")))
+
+    for path in attachments:
+        ctype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        part = EmailMessage()
+        part["Content-Type"] = ctype
+        part["Content-Disposition"] = "attachment"
+        part.set_param("filename", os.path.basename(path), header="Content-Disposition")
+        part["Content-Transfer-Encoding"] = "base64"
+        fp.write(b"\r\n" + delim + _header_block(part))
+        with open(path, "rb") as src:
+            while chunk := src.read(_B64_READ):
+                fp.write(base64.encodebytes(chunk).replace(b"\n", b"\r\n"))
+    fp.write(f"\r\n--{boundary}--\r\n".encode())
+
+
+def _rset_quietly(smtp: smtplib.SMTP) -> None:
+    try:
+        smtp.rset()
+    except smtplib.SMTPServerDisconnected:
+        pass
+
+
+def _bdat(smtp: smtplib.SMTP, fp: BinaryIO) -> Tuple[int, bytes]:
+    chunk = fp.read(CHUNK_SIZE)
+    while True:
+        following = fp.read(CHUNK_SIZE)
+        last = not following
+        smtp.send(f"BDAT {len(chunk)}{' LAST' if last else ''}\r\n".encode())
+        smtp.send(chunk)
+        code, resp = smtp.getreply()
+        if code != 250 or last:
+            return code, resp
+        chunk = following
+
+
+def _data(smtp: smtplib.SMTP, fp: BinaryIO) -> Tuple[int, bytes]:
+    smtp.putcmd("data")
+    code, resp = smtp.getreply()
+    if code != 354:
+        return code, resp
+    buf = bytearray()
+    line = b"\r\n"
+    for line in fp:
+        if line.startswith(b"."):
+            buf += b"."
+        buf += line
+        if len(buf) >= 65536:
+            smtp.send(bytes(buf))
+            buf.clear()
+    if not line.endswith(b"\n"):
+        buf += b"\r\n"
+    smtp.send(bytes(buf + b".\r\n"))
+    return smtp.getreply()
+
+
+def send_stream(smtp: smtplib.SMTP, mail_from: str, rcpts: List[str], fp: BinaryIO,
+                size: int) -> Dict[str, Tuple[int, bytes]]:
+    """
+    ``SMTP.sendmail`` for a message read from *fp* (CRLF line endings):
+    BDAT chunks when the server offers CHUNKING, else dot-stuffed DATA
+    streamed line by line.  Same return value and exceptions as sendmail.
+    """
+    with metrics.command("smtp", "SEND"):
+        refused = _send_stream(smtp, mail_from, rcpts, fp, size)
+    metrics.BYTES.inc("smtp", "out", amount=size)
+    return refused
+
+
+def _send_stream(smtp: smtplib.SMTP, mail_from: str, rcpts: List[str], fp: BinaryIO,
+                 size: int) -> Dict[str, Tuple[int, bytes]]:
+    smtp.ehlo_or_helo_if_needed()
+    options = [f"SIZE={size}"] if smtp.has_extn("size") else []
+    code, resp = smtp.mail(mail_from, options)
+    if code != 250:
+        _rset_quietly(smtp)
+        raise smtplib.SMTPSenderRefused(code, resp, mail_from)
+    refused = {}
+    for rcpt in rcpts:
+        code, resp = smtp.rcpt(rcpt)
+        if code not in (250, 251):
+            refused[rcpt] = (code, resp)
+    if len(refused) == len(rcpts):
+        _rset_quietly(smtp)
+        raise smtplib.SMTPRecipientsRefused(refused)
+    code, resp = _bdat(smtp, fp) if smtp.has_extn("chunking") else _data(smtp, fp)
+    if code != 250:
+        _rset_quietly(smtp)
+        raise smtplib.SMTPDataError(code, resp)
+    return refused
@@ -0,0 +1,92 @@
+"""
+mail_tls.py – Shared SSL contexts and TLS session resumption for mail clients.
+
+poplib / imaplib / smtplib all call ``context.wrap_socket(sock,
+server_hostname=host)``, so ``resuming()`` hands them a thin proxy around the
+long-lived context that offers the last session seen for the same host and
+port and times each handshake.
+"""
+import ssl, threading, time, logging
+from typing import Dict, Optional, Tuple
+
+LOG = logging.getLogger("mail_tls")
+
+_lock = threading.Lock()
+_contexts: Dict[bool, ssl.SSLContext] = {}
+_sessions: Dict[Tuple[int, str, int], ssl.SSLSession] = {}
+_stats: Dict[str, Dict[str, float]] = {}
+
+
+def client_context(verify: bool = True) -> ssl.SSLContext:
+    """
+    Return the process-wide client context for a security profile.
+    *verify=False* is the self-signed profile (no hostname / chain checks).
+    """
+    ctx = _contexts.get(verify)
+    if ctx is None:
+        with _lock:
+            ctx = _contexts.get(verify)
+            if ctx is None:
+                ctx = ssl.create_default_context()
+                if not verify:
+                    ctx.check_hostname = False
+                    ctx.verify_mode = ssl.CERT_NONE
+                _contexts[verify] = ctx
+    return ctx
+
+
+class ResumingContext:
+    """
+    Stand-in for an ``SSLContext`` bound to one (protocol, host, port).
+    Call ``save()`` once the session has exchanged data (e.g. after login):
+    TLS 1.3 tickets only arrive after the handshake completes.
+    """
+
+    def __init__(self, ctx: ssl.SSLContext, proto: str, host: str, port: int):
+        self._ctx = ctx
+        self._proto = proto
+        self._key = (id(ctx), host, port)
+        self._sock: Optional[ssl.SSLSocket] = None
+
+    def wrap_socket(self, sock, server_hostname=None, **kwargs) -> ssl.SSLSocket:
+        session = _sessions.get(self._key)
+        start = time.perf_counter()
+        try:
+            ssock = self._ctx.wrap_socket(sock, server_hostname=server_hostname,
+                                          session=session, **kwargs)
+        except (ssl.SSLError, ValueError):
+            if session is not None:          # stale ticket; next connect does a full handshake
+                _sessions.pop(self._key, None)
+            raise
+        _record(self._proto, ssock.session_reused, time.perf_counter() - start)
+        self._sock = ssock
+        return ssock
+
+    def save(self) -> None:
+        """Remember the negotiated session for the next connection."""
+        if self._sock is not None and self._sock.session is not None:
+            _sessions[self._key] = self._sock.session
+
+    def __getattr__(self, name):
+        return getattr(self._ctx, name)
+
+
+def resuming(proto: str, host: str, port: int, verify: bool = True) -> ResumingContext:
+    """Context for one connection to *host*:*port* that reuses TLS sessions."""
+    return ResumingContext(client_context(verify), proto, host, port)
+
+
+def _record(proto: str, resumed: bool, seconds: float) -> None:
+    kind = "resumed" if resumed else "full"
+    with _lock:
+        s = _stats.setdefault(proto, {"full": 0, "resumed": 0,
+                                      "full_seconds": 0.0, "resumed_seconds": 0.0})
+        s[kind] += 1
+        s[kind + "_seconds"] += seconds
+    LOG.debug("%s TLS handshake (%s) took %.1f ms", proto, kind, seconds * 1000)
+
+
+def handshake_stats() -> Dict[str, Dict[str, float]]:
+    """Per-protocol counts and cumulative seconds of full vs resumed handshakes."""
+    with _lock:
+        return {proto: dict(s) for proto, s in _stats.items()}
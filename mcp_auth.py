@@ -0,0 +1,96 @@
+"""
+mcp_auth.py – Bearer-token check in front of the MCP endpoint.
+
+``BearerAuthMiddleware`` answers 401 for any /mcp request whose
+``Authorization: Bearer`` token is not a live access token.  Lookups go
+through ``TokenCache``: a validated token's grant (account, scopes, expiry)
+is kept in-process for a few seconds, so the steady-state cost of auth is
+a dict probe rather than a token-store read.  Tools check their scope
+with ``require(grant, scope)``.
+"""
+import time, json, threading
+from typing import Dict, Optional, Tuple
+
+import metrics
+
+READ = "email:read"
+WRITE = "email:write"
+
+
+def bearer(authorization: str) -> str:
+    """The token from an ``Authorization: Bearer <token>`` value, or ''."""
+    scheme, _, token = authorization.partition(" ")
+    return token.strip() if scheme.lower() == "bearer" else ""
+
+
+class TokenCache:
+    """
+    Recently validated access tokens → grant, each kept for at most *ttl*
+    seconds (and never past the token's own expiry).  Unknown tokens are not
+    cached, so a revoked token stops working within *ttl*.
+    """
+
+    def __init__(self, store, ttl: float = 30.0, max_size: int = 4096):
+        self._store = store
+        self._ttl = ttl
+        self._max_size = max_size
+        self._entries: Dict[str, Tuple[float, Dict]] = {}
+        self._lock = threading.Lock()
+
+    def lookup(self, token: str) -> Optional[Dict]:
+        """Grant for a live access token, or None."""
+        if not token:
+            return None
+        now = time.time()
+        entry = self._entries.get(token)
+        if entry is not None and entry[0] > now:
+            metrics.CACHE.inc("auth", "hit")
+            return entry[1]
+        metrics.CACHE.inc("auth", "miss")
+        grant = self._store.get("access", token)
+        if grant is None:
+            with self._lock:
+                self._entries.pop(token, None)
+            return None
+        until = min(now + self._ttl, grant.get("expires_at", now + self._ttl))
+        with self._lock:
+            if len(self._entries) >= self._max_size:
+                self._entries.pop(next(iter(self._entries)))     # oldest first
+            self._entries[token] = (until, grant)
+        return grant
+
+
+def require(grant: Optional[Dict], scope: str) -> None:
+    """Raise PermissionError unless *grant* (None = unauthenticated local use) has *scope*."""
+    if grant is not None and scope not in grant.get("scopes", ()):
+        raise PermissionError(f"This token lacks the {scope!r} scope.")
+
+
+class BearerAuthMiddleware:
+    """ASGI middleware: 401 for requests under *paths* without a valid bearer token."""
+
+    def __init__(self, app, cache: TokenCache, paths: Tuple[str, ...] = ("/mcp",)):
+        self.app = app
+        self.cache = cache
+        self.paths = paths
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS" or not scope["path"].startswith(self.paths):
+            await self.app(scope, receive, send)
+            return
+        authorization = ""
+        for name, value in scope["headers"]:
+            if name == b"authorization":
+                authorization = value.decode("latin-1")
+                break
+        if self.cache.lookup(bearer(authorization)) is None:
+            body = json.dumps({"error": "invalid_token",
+                               "error_description": "Missing, invalid or expired bearer token"}).encode()
+            await send({"type": "http.response.start", "status": 401, "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"www-authenticate", b'Bearer error="invalid_token"'),
+            ]})
+            await send({"type": "http.response.body", "body": body})
+            return
+        await self.app(scope, receive, send)
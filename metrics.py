@@ -0,0 +1,292 @@
+"""
+metrics.py – In-process metrics, served as Prometheus text on /metrics.
+
+Recording is cheap enough to leave on everywhere: a counter or histogram
+update is a dict lookup and a few additions under the metric's own lock.
+Numbers that already live somewhere (pool occupancy, queue depths, breaker
+states, compression byte counts) are not copied as they change; collectors
+read them when /metrics is scraped.
+
+    mcp_tool_duration_seconds{tool,outcome}         histogram, per tool call
+    mail_command_duration_seconds{proto,command}    histogram, per upstream
+                                                    command (CONNECT, AUTH, TOP,
+                                                    RETR, FETCH, STORE, SEND, ...)
+    mail_bytes_total{proto,direction}               counter, message bytes
+    mail_cache_requests_total{cache,result}         counter, hit / miss / ...
+    mail_limit_*{limit}                             gauges and totals per
+                                                    connection pool, host,
+                                                    account and mailbox queue
+                                                    (mail_limits.QueueStats)
+    mail_breaker_open{breaker}                      1 while a circuit is open
+    mail_tls_handshake*_total{proto,resumed}        counters, full vs resumed
+                                                    TLS handshakes and their
+                                                    seconds (mail_tls)
+
+Each worker process keeps its own numbers; scrape every worker, or run one.
+"""
+import os, bisect, secrets, threading, time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import tracing
+
+# seconds; mail round trips run from a few ms to the request timeout
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+Sample = Tuple[Dict[str, str], float]
+_INF = 'le="+Inf"'
+
+
+def _labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Counter:
+    """Monotonic totals by label values, given positionally in *labels* order."""
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, *values, amount: float = 1) -> None:
+        with self._lock:
+            self._values[values] = self._values.get(values, 0) + amount
+
+    def render(self, out: List[str]) -> None:
+        out.append(f"# HELP {self.name} {self.help}\n# TYPE {self.name} counter")
+        with self._lock:
+            items = sorted(self._values.items())
+        out.extend(f"{self.name}{_labels(self.labels, k)} {_number(v)}" for k, v in items)
+
+
+class Histogram:
+    """Distribution of observations (seconds) by label values, in BUCKETS."""
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple, List[float]] = {}     # per-bucket counts + [sum, count]
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value: float, *values) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(values)
+            if series is None:
+                series = self._series[values] = [0.0] * (len(self.buckets) + 2)
+            if i < len(self.buckets):
+                series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, *values) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *values)
+
+    def render(self, out: List[str]) -> None:
+        out.append(f"# HELP {self.name} {self.help}\n# TYPE {self.name} histogram")
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        for key, series in items:
+            running = 0.0
+            for bound, n in zip(self.buckets, series):
+                running += n
+                le = 'le="%s"' % _number(bound)
+                out.append(f"{self.name}_bucket{_labels(self.labels, key, le)} {_number(running)}")
+            out.append(f"{self.name}_bucket{_labels(self.labels, key, _INF)} {_number(series[-1])}")
+            out.append(f"{self.name}_sum{_labels(self.labels, key)} {_number(series[-2])}")
+            out.append(f"{self.name}_count{_labels(self.labels, key)} {_number(series[-1])}")
+
+
+_metrics: List = []
+_collectors: List[Callable[[], Iterable[Tuple[str, str, str, Iterable[Sample]]]]] = []
+
+
+def collector(fn: Callable[[], Iterable[Tuple[str, str, str, Iterable[Sample]]]]):
+    """
+    Register *fn*, called on every scrape; it yields ``(name, type, help,
+    [(labels, value), ...])`` for numbers kept elsewhere.  Usable as a decorator.
+    """
+    _collectors.append(fn)
+    return fn
+
+
+TOOLS = Histogram("mcp_tool_duration_seconds", "MCP tool call latency.", ("tool", "outcome"))
+COMMANDS = Histogram("mail_command_duration_seconds", "Upstream mail command latency.", ("proto", "command"))
+BYTES = Counter("mail_bytes_total", "Message bytes exchanged with mail hosts.", ("proto", "direction"))
+CACHE = Counter("mail_cache_requests_total", "Cache lookups by result.", ("cache", "result"))
+
+
+def command(proto: str, name: str):
+    """
+    Time one upstream command (or pipelined batch of them) for the ``with``
+    block, in a ``<proto> <COMMAND>`` span when tracing is on (see tracing).
+    """
+    if tracing.ENABLED:
+        return _traced_command(proto, name)
+    return COMMANDS.time(proto, name)
+
+
+@contextmanager
+def _traced_command(proto: str, name: str) -> Iterator[None]:
+    with COMMANDS.time(proto, name), tracing.span(f"{proto} {name}", {"mail.protocol": proto, "mail.command": name}):
+        yield
+
+
+def outcome(exc: Optional[BaseException]) -> str:
+    """Coarse label for how a call ended; looks through wrapping exceptions."""
+    seen = 0
+    while exc is not None and seen < 5:
+        name = type(exc).__name__
+        if name == "Overloaded":
+            return "overloaded"
+        if name == "HostUnavailable":
+            return "unavailable"
+        if isinstance(exc, TimeoutError):
+            return "timeout"
+        if isinstance(exc, PermissionError):
+            return "denied"
+        exc, seen = exc.__cause__ or exc.__context__, seen + 1
+    return "error"
+
+
+def tool_middleware():
+    """FastMCP middleware timing every tool call into mcp_tool_duration_seconds."""
+    from fastmcp.server.middleware import Middleware
+
+    class ToolMetrics(Middleware):
+        async def on_call_tool(self, context, call_next):
+            start = time.perf_counter()
+            result = "ok"
+            try:
+                return await call_next(context)
+            except BaseException as exc:
+                result = outcome(exc)
+                raise
+            finally:
+                TOOLS.observe(time.perf_counter() - start, context.message.name, result)
+
+    return ToolMetrics()
+
+
+def render() -> str:
+    """Every metric and collector in the Prometheus text exposition format."""
+    out: List[str] = []
+    for metric in list(_metrics):
+        metric.render(out)
+    for fn in list(_collectors):
+        for name, kind, help, samples in fn():
+            out.append(f"# HELP {name} {help}\n# TYPE {name} {kind}")
+            for labels, value in samples:
+                names = tuple(labels)
+                out.append(f"{name}{_labels(names, tuple(labels[n] for n in names))} {_number(value)}")
+    return "\n".join(out) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def allowed(authorization: str) -> bool:
+    """True if METRICS_TOKEN is unset, or *authorization* is ``Bearer <METRICS_TOKEN>``."""
+    token = os.getenv("METRICS_TOKEN")
+    return not token or secrets.compare_digest(authorization.encode(), f"Bearer {token}".encode())
+
+
+# ---------------- collectors for the shared modules ---------------- #
+
+_LIMIT_TOTALS = {
+    "admitted": ("mail_limit_admitted_total", "Calls given a slot."),
+    "rejected": ("mail_limit_rejected_total", "Calls refused because the wait queue was full."),
+    "timed_out": ("mail_limit_timed_out_total", "Calls that gave up waiting for a slot."),
+    "wait_seconds": ("mail_limit_wait_seconds_total", "Time admitted calls spent queued."),
+    "served": ("mail_limit_served_total", "Calls that finished holding a slot."),
+    "service_seconds": ("mail_limit_service_seconds_total", "Time spent holding a slot."),
+}
+_LIMIT_GAUGES = {
+    "in_use": ("mail_limit_in_use", "Slots held now (connections checked out, turns running)."),
+    "waiting": ("mail_limit_waiting", "Calls queued for a slot now."),
+    "capacity": ("mail_limit_capacity", "Slots available in all."),
+    "idle": ("mail_pool_idle_connections", "Logged-in connections parked in the pool."),
+}
+
+
+@collector
+def _limits():
+    import mail_limits
+    snapshots = mail_limits.stats()
+    for key, (name, help) in _LIMIT_TOTALS.items():
+        yield name, "counter", help, [({"limit": limit}, snap[key]) for limit, snap in sorted(snapshots.items())]
+    for key, (name, help) in _LIMIT_GAUGES.items():
+        yield name, "gauge", help, [({"limit": limit}, snap[key]) for limit, snap in sorted(snapshots.items())
+                                    if key in snap]
+
+
+@collector
+def _breakers():
+    import mail_health
+    yield "mail_breaker_open", "gauge", "1 while the host's circuit is open (or half-open).", \
+        [({"breaker": b.name}, 0 if b.state == "closed" else 1) for b in mail_health.breakers()]
+
+
+@collector
+def _tls():
+    import sys
+    mail_tls = sys.modules.get("mail_tls")
+    if mail_tls is None:
+        return
+    stats = mail_tls.handshake_stats()
+    yield "mail_tls_handshakes_total", "counter", "TLS handshakes with mail hosts, full or resumed.", \
+        [({"proto": proto, "resumed": str(kind == "resumed").lower()}, s[kind])
+         for proto, s in sorted(stats.items()) for kind in ("full", "resumed")]
+    yield "mail_tls_handshake_seconds_total", "counter", "Time spent in those handshakes.", \
+        [({"proto": proto, "resumed": str(kind == "resumed").lower()}, s[kind + "_seconds"])
+         for proto, s in sorted(stats.items()) for kind in ("full", "resumed")]
+
+
+@collector
+def _compression():
+    import sys
+    imap_compress = sys.modules.get("imap_compress")    # only loaded by servers that speak IMAP
+    if imap_compress is None:
+        return
+    stats = imap_compress.stats()
+    yield "imap_compress_bytes_total", "counter", "IMAP bytes before (plain) and after (wire) DEFLATE.", \
+        [({"direction": d, "form": f}, stats[f"{f}_{d}"]) for d in ("in", "out") for f in ("wire", "plain")]
+
+
+def single_flight_collector(flights) -> None:
+    """Export a single_flight.SingleFlight's per-tool calls and coalesced calls."""
+    @collector
+    def collect():
+        stats = flights.stats()
+        yield "mcp_read_calls_total", "counter", "Coalescable read tool calls.", \
+            [({"tool": tool}, c["calls"]) for tool, c in sorted(stats.items())]
+        yield "mcp_read_coalesced_total", "counter", "Read calls that shared another call's fetch.", \
+            [({"tool": tool}, c["coalesced"]) for tool, c in sorted(stats.items())]
+
+
+def gauge(name: str, help: str, read: Callable[[], float]) -> None:
+    """Export one number read at scrape time (e.g. the outbox depth)."""
+    collector(lambda: [(name, "gauge", help, [({}, read())])])
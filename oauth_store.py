@@ -0,0 +1,148 @@
+"""
+oauth_store.py – Expiring store for OAuth codes, access and refresh tokens.
+
+Tokens are looked up by a SHA-256 of (kind, token), so the store never
+holds a usable credential and every lookup is one hash probe.  Entries
+carry their expiry: reads ignore expired ones, and a sweeper thread
+removes them in expiry order so the store only holds live grants.
+
+``MemoryTokenStore`` keeps a dict plus an expiry heap; ``SQLiteTokenStore``
+(OAUTH_TOKEN_DB) survives restarts and is shared by every worker process
+pointed at the same file.
+"""
+import os, json, time, heapq, sqlite3, hashlib, threading, logging
+from typing import Dict, List, Optional, Tuple
+
+LOG = logging.getLogger("oauth_store")
+
+
+def token_hash(kind: str, token: str) -> str:
+    return hashlib.sha256(f"{kind}:{token}".encode()).hexdigest()
+
+
+class MemoryTokenStore:
+    """In-process store: dict by token hash, min-heap by expiry for the sweeper."""
+
+    def __init__(self):
+        self._items: Dict[str, Tuple[float, Dict]] = {}
+        self._heap: List[Tuple[float, str]] = []
+        self._lock = threading.Lock()
+
+    def put(self, kind: str, token: str, data: Dict, ttl: float) -> None:
+        expires_at = time.time() + ttl
+        key = token_hash(kind, token)
+        with self._lock:
+            self._items[key] = (expires_at, data)
+            heapq.heappush(self._heap, (expires_at, key))
+
+    def get(self, kind: str, token: str) -> Optional[Dict]:
+        """The grant stored for *token*, or None if unknown or expired."""
+        item = self._items.get(token_hash(kind, token))
+        if item is None or item[0] < time.time():
+            return None
+        return item[1]
+
+    def pop(self, kind: str, token: str) -> Optional[Dict]:
+        """Like get(), but the token is used up (codes, rotated refresh tokens)."""
+        with self._lock:
+            item = self._items.pop(token_hash(kind, token), None)
+        if item is None or item[0] < time.time():
+            return None
+        return item[1]
+
+    def sweep(self) -> int:
+        """Drop expired entries; returns how many went."""
+        now = time.time()
+        removed = 0
+        with self._lock:
+            while self._heap and self._heap[0][0] < now:
+                expires_at, key = heapq.heappop(self._heap)
+                item = self._items.get(key)
+                if item is not None and item[0] == expires_at:   # not re-put since
+                    del self._items[key]
+                    removed += 1
+        return removed
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS oauth_tokens (
+    token_hash  TEXT PRIMARY KEY,
+    expires_at  REAL NOT NULL,
+    data        TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS oauth_tokens_expiry ON oauth_tokens (expires_at);
+"""
+
+
+class SQLiteTokenStore:
+    """Same interface on a WAL-mode SQLite file shared across processes."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    def _db(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.executescript(_SCHEMA)
+            self._local.db = db
+        return db
+
+    def put(self, kind: str, token: str, data: Dict, ttl: float) -> None:
+        self._db().execute("INSERT OR REPLACE INTO oauth_tokens VALUES (?, ?, ?)",
+                           (token_hash(kind, token), time.time() + ttl, json.dumps(data)))
+
+    def get(self, kind: str, token: str) -> Optional[Dict]:
+        row = self._db().execute("SELECT data FROM oauth_tokens WHERE token_hash = ? AND expires_at >= ?",
+                                 (token_hash(kind, token), time.time())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def pop(self, kind: str, token: str) -> Optional[Dict]:
+        key = token_hash(kind, token)
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute("SELECT data, expires_at FROM oauth_tokens WHERE token_hash = ?", (key,)).fetchone()
+            if row:
+                db.execute("DELETE FROM oauth_tokens WHERE token_hash = ?", (key,))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        if row is None or row[1] < time.time():
+            return None
+        return json.loads(row[0])
+
+    def sweep(self) -> int:
+        return self._db().execute("DELETE FROM oauth_tokens WHERE expires_at < ?", (time.time(),)).rowcount
+
+    def __len__(self) -> int:
+        return self._db().execute("SELECT COUNT(*) FROM oauth_tokens").fetchone()[0]
+
+
+def start_sweeper(store, interval: float = 60.0) -> threading.Thread:
+    """Daemon thread that sweeps expired tokens every *interval* seconds."""
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                removed = store.sweep()
+                if removed:
+                    LOG.debug("swept %d expired OAuth tokens", removed)
+            except Exception as e:
+                LOG.warning("OAuth token sweep failed: %s", e)
+    thread = threading.Thread(target=loop, name="oauth-sweeper", daemon=True)
+    thread.start()
+    return thread
+
+
+def from_env():
+    """SQLite store at OAUTH_TOKEN_DB if set, else in-memory."""
+    path = os.getenv("OAUTH_TOKEN_DB")
+    return SQLiteTokenStore(path) if path else MemoryTokenStore()
@@ -0,0 +1,455 @@
+"""
+plain_mail_http.py – HTTP face of plain_mail_mcp: the MCP endpoint behind
+bearer auth, plus the ChatGPT plugin manifest and OAuth routes, on one port.
+
+Imported only when the server runs over HTTP, so stdio launches never load
+FastAPI or build these routes.  ``plugin_app`` is the ASGI application
+(``uvicorn plain_mail_http:plugin_app``).
+"""
+import os
+import html
+import time
+import secrets
+import hashlib
+import base64
+import logging
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request, HTTPException
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import HTMLResponse, RedirectResponse, PlainTextResponse
+from starlette.middleware import Middleware
+
+import http_static
+import mail_caps
+import mcp_auth
+import metrics
+import oauth_store
+import profiling
+from plain_mail_mcp import mcp, ACCOUNTS, TOKENS, AUTH, _OUTBOX, _probe_caps
+
+OAUTH_CLIENT_ID = "popmail-mcp"
+OAUTH_CLIENT_SECRET = os.getenv("OAUTH_CLIENT_SECRET", secrets.token_urlsafe(32))
+OAUTH_ACCESS_TOKEN_EXPIRE_SECONDS = 3600  # 1 hour
+OAUTH_REFRESH_TOKEN_EXPIRE_DAYS = 30  # 30 days
+MCP_REQUIRE_AUTH = os.getenv("MCP_REQUIRE_AUTH", "1") not in ["0", "false", "False"]
+
+LOG = logging.getLogger("plain_mail_http")
+
+
+def generate_token(user_id: str, scopes: list = None) -> dict:
+    """Generate OAuth access and refresh tokens."""
+    if scopes is None:
+        scopes = ["email:read", "email:write"]
+        
+    access_token = f"access_{secrets.token_urlsafe(32)}"
+    refresh_token = f"refresh_{secrets.token_urlsafe(32)}"
+    expires_at = int(time.time()) + OAUTH_ACCESS_TOKEN_EXPIRE_SECONDS
+    
+    token_data = {
+        "access_token": access_token,
+        "token_type": "bearer",
+        "expires_in": OAUTH_ACCESS_TOKEN_EXPIRE_SECONDS,
+        "refresh_token": refresh_token,
+        "scope": " ".join(scopes),
+        "user_id": user_id,
+        "expires_at": expires_at
+    }
+    
+    # Store the refresh token, and the access token that selects the account for MCP tool calls
+    grant = {"user_id": user_id, "scopes": scopes}
+    TOKENS.put("refresh", refresh_token, grant, OAUTH_REFRESH_TOKEN_EXPIRE_DAYS * 24 * 3600)
+    TOKENS.put("access", access_token, dict(grant, expires_at=expires_at), OAUTH_ACCESS_TOKEN_EXPIRE_SECONDS)
+    
+    return token_data
+
+
+# The FastMCP app, serving /mcp
+# Bearer-token check on /mcp (MCP_REQUIRE_AUTH=0 turns it off for local testing)
+_MCP_MIDDLEWARE = [Middleware(mcp_auth.BearerAuthMiddleware, cache=AUTH)] if MCP_REQUIRE_AUTH else []
+app = mcp.http_app(path="/mcp", middleware=_MCP_MIDDLEWARE)
+
+
+@asynccontextmanager
+async def lifespan(_app):
+    """Per-process startup (every worker runs it): background refreshers, then the MCP session manager."""
+    # Learn what the mail host supports before the first tool call needs it
+    mail_caps.start_refresh(_probe_caps)
+    oauth_store.start_sweeper(TOKENS)
+    # Deliver mail a previous run left in the spool (retries, expired leases)
+    # without waiting for the next send_email to start the workers
+    _OUTBOX.start()
+    async with app.lifespan(app):
+        yield
+
+# Create FastAPI app for the plugin endpoints (its own /openapi.json below,
+# not FastAPI's generated one, which used to shadow it)
+plugin_app = FastAPI(lifespan=lifespan, openapi_url=None)
+
+
+def static_route(*paths: str, max_age: int = 3600):
+    """Render the decorated function's JSON once at startup and serve it from memory."""
+    def register(fn):
+        resource = http_static.json_resource(fn(), max_age)
+        for path in paths:
+            plugin_app.router.add_route(path, resource.respond, methods=["GET"])
+        return fn
+    return register
+
+# Add CORS middleware to the plugin app with explicit OPTIONS handling
+# Allow ngrok domain and local development
+allowed_origins = [
+    "https://witty-enormous-hippo.ngrok-free.app",
+    "http://localhost:8089",
+    "http://127.0.0.1:8089",
+    "http://173.212.228.93:8089"
+]
+
+plugin_app.add_middleware(
+    CORSMiddleware,
+    allow_origins=allowed_origins,
+    allow_credentials=True,
+    allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS", "HEAD"],
+    allow_headers=["*"],
+    expose_headers=["*"],
+)
+
+# Explicitly handle OPTIONS for all routes
+@plugin_app.middleware("http")
+async def add_cors_headers(request: Request, call_next):
+    response = await call_next(request)
+    if request.method == "OPTIONS":
+        response.headers["Access-Control-Allow-Origin"] = "*"
+        response.headers["Access-Control-Allow-Methods"] = "GET, POST, PUT, DELETE, OPTIONS"
+        response.headers["Access-Control-Allow-Headers"] = "*"
+    return response
+
+@plugin_app.post("/")
+async def handle_post_request(request: Request):
+    # Log the incoming request for debugging: what it is, not its headers or
+    # body, which carry bearer tokens and message text
+    if LOG.isEnabledFor(logging.DEBUG):
+        try:
+            body = await request.json()
+        except Exception as e:
+            body = {"error": str(e)}
+        LOG.debug("POST / received", extra={
+            "event": "root_post", "user_agent": request.headers.get("user-agent"),
+            "rpc_method": body.get("method") if isinstance(body, dict) else None})
+    
+    # Handle POST requests to the root endpoint
+    return {
+        "status": "success",
+        "message": "Request received",
+        "endpoints": {
+            "mcp": "/mcp",
+            "openapi": "/openapi.json",
+            "manifest": "/.well-known/ai-plugin.json"
+        }
+    }
+
+@static_route("/", "/.well-known/ai-plugin.json")
+def plugin_manifest():
+    base_url = "https://witty-enormous-hippo.ngrok-free.app"
+    return {
+        "schema_version": "v1",
+        "name_for_human": "Email Manager",
+        "name_for_model": "email_manager",
+        "description_for_human": "Manage your email - send, receive, and organize messages with ease.",
+        "description_for_model": "A tool for managing email. It can send emails, check incoming messages, and manage email folders.",
+        "auth": {"type": "oauth", "oauth_client_id": OAUTH_CLIENT_ID},
+        "api": {"type": "openapi", "url": f"{base_url}/openapi.json"},
+        "logo_url": f"{base_url}/logo.png",
+        "contact_email": "suhail.c@neomoment.org",
+        "legal_info_url": f"{base_url}/legal"
+    }
+
+@static_route("/openapi.json")
+def openapi_schema():
+    return {
+        "openapi": "3.0.1",
+        "info": {
+            "title": "Email Manager API",
+            "version": "1.0.0",
+            "description": "API for managing emails through MCP protocol"
+        },
+        "servers": [{"url": "http://173.212.228.93:8089"}],
+        "paths": {
+            "/mcp": {
+                "post": {
+                    "description": "MCP protocol endpoint for email operations",
+                    "requestBody": {
+                        "required": True,
+                        "content": {
+                            "application/json": {
+                                "schema": {"type": "object"}
+                            }
+                        }
+                    },
+                    "responses": {
+                        "200": {
+                            "description": "MCP response",
+                            "content": {
+                                "application/json": {"schema": {"type": "object"}}
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    }
+
+# Serve the logo file (read once) for all favicon requests
+_LOGO = http_static.file_resource(os.path.join(os.path.dirname(os.path.abspath(__file__)), "LogoFile.png"),
+                                  "image/png", max_age=86400)
+for _path in ("/logo.png", "/favicon.ico", "/favicon.png", "/favicon.svg"):
+    plugin_app.router.add_route(_path, _LOGO.respond, methods=["GET"])
+
+# Prometheus scrape target for this worker (see metrics); METRICS_TOKEN, if set, guards it
+@plugin_app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint(request: Request):
+    if not metrics.allowed(request.headers.get("authorization", "")):
+        return PlainTextResponse("Unauthorized\n", status_code=401)
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+# Admin-only profiling window for this worker (404 unless MAIL_ADMIN_TOKEN is set)
+plugin_app.router.add_route("/debug/profile", profiling.endpoint, methods=["GET"])
+
+# OAuth configuration endpoint required by ChatGPT
+@static_route("/.well-known/oauth-configuration")
+def oauth_config():
+    """Return OAuth configuration for ChatGPT connector."""
+    base_url = "https://witty-enormous-hippo.ngrok-free.app"
+    return {
+        "client_id": OAUTH_CLIENT_ID,
+        "redirect_uris": ["https://chat.openai.com/aip/oauth/callback"],
+        "auth_uri": f"{base_url}/oauth/authorize",
+        "token_uri": f"{base_url}/oauth/token",
+        "scopes": ["email:read", "email:write"],
+        "response_types": ["code"],
+        "grant_types": ["authorization_code", "refresh_token"],
+        "token_endpoint_auth_method": "none"
+    }
+
+# OAuth Authorization Server Metadata (RFC 8414)
+@static_route("/.well-known/oauth-authorization-server")
+def oauth_authorization_server():
+    """Return OAuth 2.0 Authorization Server Metadata."""
+    base_url = "https://witty-enormous-hippo.ngrok-free.app"
+    return {
+        "issuer": base_url,
+        "authorization_endpoint": f"{base_url}/oauth/authorize",
+        "token_endpoint": f"{base_url}/oauth/token",
+        "scopes_supported": ["email:read", "email:write"],
+        "response_types_supported": ["code"],
+        "grant_types_supported": ["authorization_code", "refresh_token"],
+        "token_endpoint_auth_methods_supported": ["none"],
+        "code_challenge_methods_supported": ["S256", "plain"]
+    }
+
+def authorization_redirect(user_id: str, params: dict, status_code: int = 307):
+    """Issue an authorization code for *user_id* and send the browser back."""
+    code = f"auth_{secrets.token_urlsafe(16)}"
+    TOKENS.put("code", code, {
+        "client_id": params["client_id"],
+        "redirect_uri": params["redirect_uri"],
+        "scope": params.get("scope"),
+        "user_id": user_id,  # the mail account the tokens will act on
+        "code_challenge": params.get("code_challenge"),
+        "code_challenge_method": params.get("code_challenge_method")
+    }, 600)  # 10 minutes
+    
+    # Redirect back with the code
+    redirect_url = f"{params['redirect_uri']}?code={code}"
+    if params.get("state"):
+        redirect_url += f"&state={params['state']}"
+    return RedirectResponse(url=redirect_url, status_code=status_code)
+
+# OAuth authorization endpoint with PKCE support
+@plugin_app.get("/oauth/authorize")
+async def oauth_authorize(
+    response_type: str,
+    client_id: str,
+    redirect_uri: str,
+    scope: str = None,
+    state: str = None,
+    code_challenge: str = None,
+    code_challenge_method: str = None
+):
+    """OAuth 2.0 authorization endpoint."""
+    if client_id != OAUTH_CLIENT_ID:
+        raise HTTPException(status_code=400, detail="Invalid client_id")
+    params = {"response_type": response_type, "client_id": client_id, "redirect_uri": redirect_uri,
+              "scope": scope, "state": state, "code_challenge": code_challenge,
+              "code_challenge_method": code_challenge_method}
+
+    # A single-mailbox server auto-approves; with several mailboxes the
+    # user picks one and proves it with that mailbox's password.
+    accounts = ACCOUNTS.ids()
+    if len(accounts) == 1:
+        return authorization_redirect(accounts[0], params)
+    hidden = "".join(f'<input type="hidden" name="{k}" value="{html.escape(v)}">'
+                     for k, v in params.items() if v)
+    return HTMLResponse(
+        "<!doctype html><title>Email Manager sign-in</title>"
+        '<form method="post" action="/oauth/authorize">' + hidden +
+        '<p><label>Account <input name="account" required></label></p>'
+        '<p><label>Mail password <input name="password" type="password" required></label></p>'
+        '<p><button type="submit">Authorize</button></p></form>')
+
+@plugin_app.post("/oauth/authorize")
+async def oauth_authorize_login(request: Request):
+    """Sign-in form post: check the mailbox password, then continue the OAuth flow."""
+    form = dict(await request.form())
+    if form.get("client_id") != OAUTH_CLIENT_ID or not form.get("redirect_uri"):
+        raise HTTPException(status_code=400, detail="Invalid client_id")
+    account = form.pop("account", "")
+    if not ACCOUNTS.verify(account, form.pop("password", "")):
+        raise HTTPException(status_code=401, detail="Invalid account or password")
+    return authorization_redirect(account, form, status_code=303)
+
+# OAuth token endpoint
+@plugin_app.post("/oauth/token")
+async def oauth_token(
+    request: Request,
+    grant_type: str = None,
+    code: str = None,
+    refresh_token: str = None,
+    redirect_uri: str = None,
+    client_id: str = None,
+    code_verifier: str = None
+):
+    """OAuth 2.0 token endpoint."""
+    try:
+        # Handle form data (standard OAuth 2.0 format)
+        if not grant_type:
+            form_data = await request.form()
+            grant_type = form_data.get("grant_type")
+            code = form_data.get("code")
+            refresh_token = form_data.get("refresh_token")
+            redirect_uri = form_data.get("redirect_uri")
+            client_id = form_data.get("client_id")
+            code_verifier = form_data.get("code_verifier")
+            
+            LOG.debug("token request", extra={"event": "oauth_token", "grant_type": grant_type,
+                                              "client_id": client_id, "pkce": bool(code_verifier)})
+        if grant_type == "authorization_code":
+            if not code or not redirect_uri or not client_id:
+                raise HTTPException(status_code=400, detail="Missing required parameters")
+            
+            # Verify the authorization code
+            code_data = TOKENS.pop("code", code)
+            if not code_data:
+                raise HTTPException(status_code=400, detail="Invalid or expired authorization code")
+            
+            # Validate PKCE if code_challenge was provided
+            if code_data.get("code_challenge"):
+                if not code_verifier:
+                    raise HTTPException(status_code=400, detail="code_verifier required for PKCE")
+                
+                # Verify code challenge
+                challenge_method = code_data.get("code_challenge_method", "S256")
+                if challenge_method == "S256":
+                    # SHA256 hash of code_verifier, base64url encoded
+                    verifier_hash = hashlib.sha256(code_verifier.encode()).digest()
+                    verifier_challenge = base64.urlsafe_b64encode(verifier_hash).decode().rstrip('=')
+                    if verifier_challenge != code_data["code_challenge"]:
+                        raise HTTPException(status_code=400, detail="Invalid PKCE code_verifier")
+                elif challenge_method == "plain":
+                    if code_verifier != code_data["code_challenge"]:
+                        raise HTTPException(status_code=400, detail="Invalid PKCE code_verifier")
+                else:
+                    raise HTTPException(status_code=400, detail="Unsupported code_challenge_method")
+            
+            # Generate tokens
+            user_id = code_data["user_id"]
+            scopes = code_data["scope"].split() if code_data["scope"] else ["email:read", "email:write"]
+            
+            return generate_token(user_id, scopes)
+            
+        elif grant_type == "refresh_token":
+            if not refresh_token:
+                raise HTTPException(status_code=400, detail="Missing refresh_token")
+            
+            # Verify and use up the refresh token (rotated below)
+            token_data = TOKENS.pop("refresh", refresh_token)
+            if not token_data:
+                raise HTTPException(status_code=400, detail="Invalid or expired refresh token")
+            
+            # Generate new tokens
+            user_id = token_data["user_id"]
+            scopes = token_data["scopes"]
+            
+            return generate_token(user_id, scopes)
+            
+        else:
+            raise HTTPException(status_code=400, detail="Unsupported grant_type")
+            
+    except HTTPException:
+        raise
+    except Exception as e:
+        LOG.exception("oauth_token failed")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@static_route("/legal", max_age=86400)
+def legal():
+    return {"message": """Of course. Integrating a ChatGPT or other Large Language Model (LLM) into a server, especially a public one like a Minecraft server (often associated with "MCP"), introduces unique challenges. It's crucial to have clear disclaimers to manage user expectations, limit your liability, and maintain a healthy community.
+
+Here are essential points and disclaimers to consider, categorized for clarity.
+
+---
+
+### **Category 1: Nature of the AI & Accuracy of Information**
+
+These disclaimers manage expectations about what the AI is and what it can do.
+
+* **AI, Not Human:** "The chat assistant you are interacting with is an AI language model (powered by OpenAI's GPT technology). It is not a human, a server administrator, or a moderator. Its responses are generated algorithmically."
+* **Potential for Inaccuracy:** "The AI's responses may be inaccurate, incomplete, or nonsensical. It can 'hallucinate' facts or make up information. Do not rely on it for critical in-game information (e.g., rare item locations, complex crafting recipes) or any real-world advice."
+* **Knowledge Cutoff:** "The AI's knowledge is based on data up to a certain point in the past and it does not have real-time information. It will not be aware of recent server events, updates, player-built structures, or rule changes unless specifically programmed to be."
+* **No Consciousness or Feelings:** "The AI does not have beliefs, opinions, or feelings. Its responses are a reflection of the patterns in the data it was trained on, not a personal viewpoint."
+* **Potential for Bias:** "The AI may generate content that reflects biases present in its training data. We do not endorse any biased, offensive, or inappropriate statements made by the AI. Please report any such instances to the server staff."
+
+---
+
+### **Category 2: User Responsibility & Conduct**
+
+These points outline how users are expected to behave when interacting with the AI.
+
+* **User is Responsible:** "You are responsible for your interactions with the AI. Attempting to 'jailbreak,' manipulate, or trick the AI into violating server rules is a violation of server rules itself."
+* **Do Not Share Personal Information:** "**NEVER** share personal information with the AI, including your real name, age, location, passwords, email address, or any other identifying details. While we strive for privacy, these conversations may be logged or processed by third parties."
+* **AI is Not a Support Ticket:** "The AI is for general queries and entertainment. It cannot resolve player disputes, investigate griefing, issue refunds, or handle technical support requests. For these issues, please contact a human staff member through the proper channels (e.g., Discord ticket, /helpop command)."
+* **Report Misconduct:** "If the AI generates content that is harmful, offensive, or breaks server rules, please take a screenshot and report it to the server staff immediately. This helps us improve the system."
+
+---
+
+### **Category 3: Privacy & Data Handling**
+
+This is crucial for transparency and legal protection.
+
+* **Interaction Logging:** "Please be aware that your conversations with the AI may be logged and reviewed by server administrators for the purposes of moderation, quality control, and system improvement."
+* **Third-Party Data Processing:** "To function, this feature sends your prompts (the questions you ask) to OpenAI (or another third-party AI provider) for processing. By using this feature, you acknowledge and agree that your data will be handled according to their respective privacy policies and terms of service."
+* **No Expectation of Privacy:** "Do not consider your conversations with the AI to be private. They are subject to review by staff and processing by third-party services."
+
+---
+
+### **Category 4: Liability & Service Availability**
+
+These are the core legal-style disclaimers to limit your liability.
+
+* **Use At Your Own Risk:** "This AI feature is provided on an 'as-is' and 'as-available' basis. You use it at your own risk. The server owners and staff are not liable for any damages, loss of items, misinformation, or negative experiences resulting from your use of the AI."
+* **No Guarantee of Service:** "We reserve the right to modify, restrict, or disable the AI feature at any time, for any reason, without notice. Access to the feature is not a guaranteed part of the server experience."
+* **Not Affiliated with OpenAI:** "This server is not an official partner of, nor is it endorsed by, OpenAI or any other AI provider. We are simply using their technology via their public API."
+
+---
+
+### **How to Present These Disclaimers**
+
+You shouldn't just hide these in a long document. Make them accessible.
+
+1.  **Initial Pop-up/Message:** The very first time a player uses the AI command, show them a condensed version of the key warnings (e.g., "This is an AI, not a human. It can be wrong. Do not share personal info. Full rules in /ai_rules.") and require them to agree.
+2.  **A Dedicated Command:** Create a command like `/ai_rules`, `/ai_disclaimer`, or `/chatgpt_info` that prints the full list of points in the game chat.
+3.  **Discord Channel:** Have a dedicated channel in your server's Discord (e.g., `#ai-info-and-rules`) with the complete disclaimers.
+4.  **MOTD (Message of the Day):** Periodically include a short reminder in the server's MOTD, like "Remember to use our AI helper responsibly! /ai_rules for info."""}
+
+# Everything else (/mcp and its session handling) goes to the FastMCP app
+plugin_app.mount("/", app)
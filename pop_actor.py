@@ -0,0 +1,305 @@
+"""
+pop_actor.py – One POP3 session per mailbox, shared by every tool call.
+
+A POP3 server locks the maildrop for one session at a time, so tool calls
+that each log in race for the lock ("mailbox locked") or queue inside the
+server.  A MailboxActor owns the account's session instead: callers queue
+commands and wait, and the actor's thread runs whatever is queued in one
+session turn -- header listings merged into a single (pipelined) TOP pass,
+RETRs and DELEs pipelined -- then QUITs, which commits the deletions.
+
+Each command carries its caller's deadline (mail_health): the caller stops
+waiting when it passes, and a command still queued by then is dropped.
+At most MAIL_QUEUE_DEPTH commands wait; more are refused with Overloaded,
+and each turn holds one of the host's connection slots (mail_limits).
+Each worker process has its own actor, so with several workers the
+server's lock still arbitrates between them.
+"""
+import queue, poplib, threading, time, logging
+from concurrent.futures import Future
+from contextlib import ExitStack
+from typing import Callable, Dict, List, Optional, Tuple
+
+import mail_health
+import mail_limits
+import mail_pop
+import metrics
+import tracing
+
+LOG = logging.getLogger("pop_actor")
+
+
+class _Op:
+    __slots__ = ("kind", "arg", "future", "deadline", "queued", "trace")
+
+    def __init__(self, kind: str, arg):
+        self.kind = kind
+        self.arg = arg
+        self.future: Future = Future()
+        self.deadline = mail_health.current_deadline()
+        self.queued = time.monotonic()
+        self.trace = tracing.current()
+
+
+class _Session:
+    """One login: the connection plus what stays fixed until QUIT."""
+
+    def __init__(self, conn: poplib.POP3, caps: Dict[str, str]):
+        self.conn = conn
+        self.caps = caps
+        # ordinals do not shift within a session; deleted ones just drop out
+        with metrics.command("pop", "LIST"):
+            self.ordinals = sorted(int(line.split()[0]) for line in conn.list()[1])
+        self.deleted: List[_Op] = []            # answered once QUIT commits them
+
+
+class MailboxActor:
+    """
+    Serializes POP3 access to one mailbox through a command queue.
+
+    *connect* opens a logged-in session and *caps* returns its CAPA map.
+    Header listings go through *header_cache* (see shared_state) when given.
+    After a batch the session stays open up to *linger* seconds for more
+    commands, and at most *max_turn* seconds in all, so new mail and
+    deletions are not held back by a busy caller.  Failures count against
+    *breaker* (mail_health.CircuitBreaker), which fails turns fast while open.
+    Each turn holds a slot of *host_limit* (mail_limits.Bulkhead) and at most
+    *max_queue* commands may wait; ``stats`` splits queue wait from service.
+    """
+
+    def __init__(self, connect: Callable[[], poplib.POP3], caps: Callable[[poplib.POP3], Dict[str, str]],
+                 header_cache=None, account: str = "", linger: float = 0.05, max_turn: float = 5.0,
+                 name: str = "pop", breaker: Optional[mail_health.CircuitBreaker] = None,
+                 host_limit: Optional[mail_limits.Bulkhead] = None, max_queue: int = mail_limits.QUEUE_DEPTH):
+        self.name = name
+        self.stats = mail_limits.QueueStats(f"pop:{name}")
+        self._breaker = breaker
+        self._host_limit = host_limit
+        self._max_queue = max_queue
+        self._connect = connect
+        self._caps = caps
+        self._cache = header_cache
+        self._account = account
+        self._linger = linger
+        self._max_turn = max_turn
+        self._queue: "queue.Queue[Optional[_Op]]" = queue.Queue()
+        self.stats.gauges["waiting"] = self._queue.qsize
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        self._stopping = False
+
+    def headers(self, newest: int) -> List[Tuple[int, Optional[bytes]]]:
+        """(ordinal, header block) of the *newest* messages (all if 0), oldest first."""
+        return self._submit("headers", newest)
+
+    def retr(self, n: int) -> List[bytes]:
+        """Lines of message *n*."""
+        return self._submit("retr", n)
+
+    def dele(self, n: int) -> None:
+        """Delete message *n*; returns once QUIT has committed it."""
+        return self._submit("dele", n)
+
+    def call(self, fn: Callable[[poplib.POP3], object]):
+        """Run *fn* on the live session (capability probes and the like)."""
+        return self._submit("call", fn)
+
+    def close(self) -> None:
+        """Stop the thread once the commands already queued are done."""
+        with self._lock:
+            self._closed = True
+            if self._thread is not None:
+                self._queue.put(None)
+
+    def _submit(self, kind: str, arg):
+        with tracing.span(f"mailbox {kind}", {"mail.mailbox": self.name}):
+            return self._wait(_Op(kind, arg))
+
+    def _wait(self, op: _Op):
+        with self._lock:
+            if self._closed:
+                raise RuntimeError(f"mailbox {self.name} is closed")
+            if self._queue.qsize() >= self._max_queue:
+                self.stats.record_rejected()
+                raise mail_limits.Overloaded(f"mailbox {self.name}", self.stats.mean_service() * self._max_queue)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f"pop-{self.name}", daemon=True)
+                self._thread.start()
+            self._queue.put(op)
+        try:
+            return op.future.result(timeout=mail_health.remaining())
+        except TimeoutError:
+            if op.future.done():        # the command itself timed out
+                raise
+            op.future.cancel()
+            raise mail_health.DeadlineExceeded(f"POP {op.kind} did not finish before the deadline.") from None
+
+    # ---------------- actor thread ---------------- #
+
+    def _run(self) -> None:
+        while not self._stopping:
+            op = self._queue.get()
+            if op is None:
+                return
+            self._turn([op] + self._drain(0))
+
+    def _drain(self, timeout: float) -> List[_Op]:
+        """Everything queued now, waiting up to *timeout* for the first command."""
+        ops: List[_Op] = []
+        try:
+            op = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            while op is not None:
+                ops.append(op)
+                op = self._queue.get_nowait()
+            self._stopping = True
+        except queue.Empty:
+            pass
+        return ops
+
+    def _turn(self, batch: List[_Op]) -> None:
+        batch = self._live(batch)
+        if not batch:
+            return
+        with ExitStack() as slot:
+            slot.enter_context(tracing.span("pop.turn", {"mail.mailbox": self.name, "mail.calls": len(batch)},
+                                            parent=batch[0].trace, links=[op.trace for op in batch[1:]]))
+            if self._host_limit is not None:
+                try:
+                    with mail_health.until(self._end(batch)):
+                        slot.enter_context(self._host_limit.slot())
+                except Exception as exc:        # no connection slot in time
+                    for op in batch:
+                        op.future.set_exception(exc)
+                    return
+            self._session(batch)
+
+    def _session(self, batch: List[_Op]) -> None:
+        try:
+            if self._breaker:
+                self._breaker.before()          # open circuit: nothing to record
+        except mail_health.HostUnavailable as exc:
+            for op in batch:
+                op.future.set_exception(exc)
+            return
+        try:
+            with mail_health.until(self._end(batch)):       # connect timeout within the callers' budget
+                conn = self._connect()
+        except Exception as exc:
+            self._record(exc)
+            for op in batch:
+                op.future.set_exception(exc)
+            return
+        deadline = time.monotonic() + self._max_turn
+        session = None
+        try:
+            session = _Session(conn, self._caps(conn))
+            while batch:
+                mail_health.arm(conn, self._end(batch))
+                self._execute(session, batch)
+                if self._stopping or time.monotonic() >= deadline:
+                    break                       # commit; later commands get a fresh turn
+                batch = self._live(self._drain(self._linger))
+                tracing.link(op.trace for op in batch)
+        except Exception as exc:               # session lost: no QUIT, no deletions
+            LOG.warning("POP session for %s failed: %s", self.name, exc)
+            self._record(exc)
+            for op in batch + (session.deleted if session else []):
+                if not op.future.done():
+                    op.future.set_exception(exc)
+            try:
+                conn.close()
+            except Exception:
+                pass
+            return
+        self._quit(session)
+
+    def _quit(self, session: _Session) -> None:
+        try:
+            session.conn.quit()
+        except Exception as exc:
+            self._record(exc)
+            for op in session.deleted:
+                if not op.future.done():
+                    op.future.set_exception(exc)
+            session.conn.close()
+            return
+        self._record()
+        for op in session.deleted:
+            if not op.future.done():
+                op.future.set_result(None)
+
+    def _record(self, exc: Optional[BaseException] = None) -> None:
+        if self._breaker:
+            self._breaker.record(exc)
+
+    def _live(self, batch: List[_Op]) -> List[_Op]:
+        """Drop commands whose caller gave up, or whose deadline has passed."""
+        now = time.monotonic()
+        live = []
+        for op in batch:
+            if op.deadline is not None and op.deadline <= now:
+                if op.future.set_running_or_notify_cancel():
+                    self.stats.record_timed_out()
+                    op.future.set_exception(mail_health.DeadlineExceeded("Deadline passed while queued."))
+            elif op.future.set_running_or_notify_cancel():
+                self.stats.record_wait(now - op.queued)
+                op.future.add_done_callback(lambda _, start=now: self.stats.record_service(time.monotonic() - start))
+                live.append(op)
+        return live
+
+    @staticmethod
+    def _end(batch: List[_Op]) -> Optional[float]:
+        """The latest deadline in *batch* (None if any caller has none)."""
+        ends = [op.deadline for op in batch]
+        return None if None in ends else max(ends)
+
+    def _execute(self, session: _Session, batch: List[_Op]) -> None:
+        """Run *batch* in order, merging runs of the same command."""
+        start = 0
+        while start < len(batch):
+            end = start + 1
+            while end < len(batch) and batch[end].kind == batch[start].kind:
+                end += 1
+            getattr(self, "_do_" + batch[start].kind)(session, batch[start:end])
+            start = end
+
+    def _do_headers(self, session: _Session, ops: List[_Op]) -> None:
+        total = len(session.ordinals)
+        want = [total if op.arg == 0 else min(max(op.arg, 0), total) for op in ops]
+        wanted = session.ordinals[total - max(want):]
+        if self._cache is not None:
+            blocks = mail_pop.cached_headers(session.conn, wanted, session.caps, self._cache, self._account)
+        else:
+            blocks = mail_pop.fetch_headers(session.conn, wanted, session.caps)
+        pairs = list(zip(wanted, blocks))
+        for op, n in zip(ops, want):
+            op.future.set_result(pairs[len(pairs) - n:])
+
+    def _do_retr(self, session: _Session, ops: List[_Op]) -> None:
+        ordinals = list(dict.fromkeys(op.arg for op in ops))
+        results = dict(zip(ordinals, mail_pop.retr_many(session.conn, ordinals, session.caps)))
+        for op in ops:
+            result = results[op.arg]
+            if isinstance(result, poplib.error_proto):
+                op.future.set_exception(result)
+            else:
+                op.future.set_result(result)
+
+    def _do_dele(self, session: _Session, ops: List[_Op]) -> None:
+        ordinals = list(dict.fromkeys(op.arg for op in ops))
+        errors = dict(zip(ordinals, mail_pop.dele_many(session.conn, ordinals, session.caps)))
+        for op in ops:
+            if errors[op.arg] is not None:
+                op.future.set_exception(errors[op.arg])
+            else:
+                session.deleted.append(op)
+        deleted = {n for n, error in errors.items() if error is None}
+        session.ordinals = [n for n in session.ordinals if n not in deleted]
+
+    def _do_call(self, session: _Session, ops: List[_Op]) -> None:
+        for op in ops:
+            try:
+                op.future.set_result(op.arg(session.conn))
+            except poplib.error_proto as exc:
+                op.future.set_exception(exc)
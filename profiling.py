@@ -0,0 +1,256 @@
+"""
+profiling.py – Profile a live server on demand.
+
+* A profiling window samples every thread's stack each
+  MAIL_PROFILE_INTERVAL seconds (default 0.005) for N seconds, or until N
+  tool calls have finished, and returns the stacks collapsed
+  (``thread;module:function;... count`` lines, as read by flamegraph.pl or
+  speedscope).  Samples are wall-clock, so threads blocked on a mail host
+  show up too.  With format ``pstats`` each tool call in the window runs
+  under cProfile instead and the merged stats come back marshalled
+  (``pstats.Stats(path)`` loads them).  On Python 3.12+ only one call at a
+  time can run under cProfile; calls overlapping it are not profiled.
+  Open one with ``GET /debug/profile?seconds=10`` (or ``calls=20``,
+  ``format=pstats``) and ``Authorization: Bearer $MAIL_ADMIN_TOKEN``; the
+  route answers 404 while MAIL_ADMIN_TOKEN is unset.  SIGUSR2 writes
+  MAIL_PROFILE_SECONDS (30) of stacks to MAIL_PROFILE_DIR instead.
+* With MAIL_PROFILE_REQUESTS=1, a tool call whose request ``_meta`` has
+  ``"profile": true`` runs under cProfile, and the top of the report is
+  returned in the result's ``_meta.profile``.
+
+Until one of these is asked for nothing samples and nothing is profiled.
+"""
+import os, io, re, sys, time, signal, marshal, pstats, cProfile, secrets, threading, contextvars, logging
+from collections import Counter
+from typing import Callable, List, Optional
+
+LOG = logging.getLogger("profiling")
+
+INTERVAL = float(os.getenv("MAIL_PROFILE_INTERVAL", "0.005"))
+SIGNAL_SECONDS = float(os.getenv("MAIL_PROFILE_SECONDS", "30"))
+REQUESTS = os.getenv("MAIL_PROFILE_REQUESTS", "0") == "1"
+MAX_SECONDS = 300.0
+FORMATS = ("collapsed", "pstats")
+
+
+class Busy(RuntimeError):
+    """Another profiling window is still open."""
+
+
+class Window:
+    """One profiling window; result() blocks until it closes."""
+
+    def __init__(self, seconds: float, calls: Optional[int], fmt: str):
+        self.format = fmt
+        self.samples = 0
+        self._end = time.monotonic() + seconds
+        self._calls_left = calls
+        self._stacks: Counter = Counter()
+        self._stats: Optional[pstats.Stats] = None
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def call_done(self) -> None:
+        with self._lock:
+            if self._calls_left is not None:
+                self._calls_left -= 1
+                if self._calls_left <= 0:
+                    self._done.set()
+
+    def add(self, profile: cProfile.Profile) -> None:
+        with self._lock:
+            if self._stats is None:
+                self._stats = pstats.Stats(profile, stream=io.StringIO())
+            else:
+                self._stats.add(profile)
+
+    def result(self) -> bytes:
+        self._thread.join()
+        if self.format == "pstats":
+            return marshal.dumps(self._stats.stats if self._stats is not None else {})
+        return "".join(f"{stack} {n}\n" for stack, n in self._stacks.most_common()).encode()
+
+    def _run(self) -> None:
+        global _window
+        me = threading.get_ident()
+        try:
+            while not self._done.wait(INTERVAL) and time.monotonic() < self._end:
+                if self.format == "collapsed":
+                    names = {t.ident: _thread_name(t.name) for t in threading.enumerate()}
+                    for ident, frame in sys._current_frames().items():
+                        if ident != me:
+                            self._stacks[_collapse(names.get(ident, "thread"), frame)] += 1
+                    self.samples += 1
+        finally:
+            with _lock:
+                _window = None
+
+
+_window: Optional[Window] = None
+_lock = threading.Lock()
+
+
+def start(seconds: float = 10.0, calls: Optional[int] = None, fmt: str = "collapsed") -> Window:
+    """Open a window of at most *seconds* (and *calls* tool calls, if given); Busy if one is open."""
+    global _window
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+    with _lock:
+        if _window is not None:
+            raise Busy("a profiling window is already open")
+        _window = Window(min(seconds, MAX_SECONDS), calls, fmt)
+        _window._thread.start()
+        return _window
+
+
+def collect(seconds: float = 10.0, calls: Optional[int] = None, fmt: str = "collapsed") -> bytes:
+    """start() and wait for the result."""
+    return start(seconds, calls, fmt).result()
+
+
+def _thread_name(name: str) -> str:
+    return re.sub(r"[-_\d]+$", "", name) or name      # one root per pool: "imap-fanout", "smtp-bulk"
+
+
+def _collapse(thread: str, frame) -> str:
+    names: List[str] = []
+    while frame is not None and len(names) < 128:
+        code = frame.f_code
+        names.append(f"{os.path.splitext(os.path.basename(code.co_filename))[0]}:{code.co_name}")
+        frame = frame.f_back
+    names.append(thread)
+    return ";".join(reversed(names))
+
+
+# ---------------- per-call cProfile ---------------- #
+
+_requested: contextvars.ContextVar[Optional[List[cProfile.Profile]]] = \
+    contextvars.ContextVar("profile_requested", default=None)
+
+
+# Since 3.12 cProfile runs on sys.monitoring, which takes one profiler per
+# interpreter: concurrent calls there go unprofiled rather than failing.
+_SHARED_PROFILER = sys.version_info >= (3, 12)
+_profiler_lock = threading.Lock()
+
+
+def run(fn: Callable, *args, **kwargs):
+    """
+    Call *fn*, under cProfile if this tool call asked for it or a pstats
+    window is open -- unless another call holds the interpreter's profiler,
+    in which case it simply runs.
+    """
+    requested = _requested.get()
+    window = _window
+    if requested is None and (window is None or window.format != "pstats"):
+        return fn(*args, **kwargs)
+    if _SHARED_PROFILER and not _profiler_lock.acquire(blocking=False):
+        return fn(*args, **kwargs)
+    try:
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:              # some other tool (a debugger, coverage) holds it
+            return fn(*args, **kwargs)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profile.disable()
+            if requested is not None:
+                requested.append(profile)
+            if window is not None and window.format == "pstats":
+                window.add(profile)
+    finally:
+        if _SHARED_PROFILER:
+            _profiler_lock.release()
+
+
+def summary(profile: cProfile.Profile, top: int = 25) -> str:
+    """The *top* functions by cumulative time, as pstats prints them."""
+    out = io.StringIO()
+    pstats.Stats(profile, stream=out).strip_dirs().sort_stats("cumulative").print_stats(top)
+    return out.getvalue().strip()
+
+
+def tool_middleware():
+    """
+    FastMCP middleware: counts tool calls for an open window, and honours
+    ``_meta.profile`` (MAIL_PROFILE_REQUESTS=1).  The profiling itself
+    happens in the tool's worker thread, in tracing.traced().
+    """
+    from fastmcp.server.middleware import Middleware
+
+    class ToolProfile(Middleware):
+        async def on_call_tool(self, context, call_next):
+            window = _window
+            if window is None and not REQUESTS:
+                return await call_next(context)
+            requested = [] if REQUESTS and _asked(context) else None
+            token = _requested.set(requested)
+            try:
+                result = await call_next(context)
+            finally:
+                _requested.reset(token)
+                if window is not None:
+                    window.call_done()
+            if requested is not None:
+                note = summary(requested[0]) if requested else "not profiled: another call held the profiler"
+                result.meta = dict(result.meta or {}, profile=note)
+            return result
+
+    return ToolProfile()
+
+
+def _asked(context) -> bool:
+    meta = getattr(getattr(context.fastmcp_context, "request_context", None), "meta", None) or {}
+    return meta.get("profile") in (True, "true", "1", 1)
+
+
+# ---------------- triggers ---------------- #
+
+async def endpoint(request):
+    """``GET /debug/profile`` (Starlette handler), admin only; see the module docstring."""
+    import anyio
+    from starlette.responses import PlainTextResponse, Response
+    token = os.getenv("MAIL_ADMIN_TOKEN")
+    if not token:
+        return PlainTextResponse("Not Found\n", status_code=404)
+    if not secrets.compare_digest(request.headers.get("authorization", "").encode(), f"Bearer {token}".encode()):
+        return PlainTextResponse("Unauthorized\n", status_code=401)
+    query = request.query_params
+    fmt = query.get("format", "collapsed")
+    try:
+        calls = int(query["calls"]) if "calls" in query else None
+        seconds = float(query.get("seconds", MAX_SECONDS if calls else 10))
+        if fmt not in FORMATS or seconds <= 0 or (calls is not None and calls <= 0):
+            raise ValueError
+    except ValueError:
+        return PlainTextResponse("Use seconds=<n> and/or calls=<n>, format=collapsed|pstats\n", status_code=400)
+    try:
+        window = start(seconds, calls, fmt)
+    except Busy as exc:
+        return PlainTextResponse(f"{exc}\n", status_code=409)
+    data = await anyio.to_thread.run_sync(window.result)
+    name = f"profile-{os.getpid()}-{int(time.time())}.{'folded' if fmt == 'collapsed' else 'pstats'}"
+    return Response(data, media_type="text/plain" if fmt == "collapsed" else "application/octet-stream",
+                    headers={"content-disposition": f'attachment; filename="{name}"'})
+
+
+def install_signal() -> None:
+    """SIGUSR2 writes a SIGNAL_SECONDS window of collapsed stacks to MAIL_PROFILE_DIR (main thread, Unix only)."""
+    signum = getattr(signal, "SIGUSR2", None)
+    if signum is not None and threading.current_thread() is threading.main_thread():
+        signal.signal(signum, lambda *_: threading.Thread(target=_dump, name="profile-signal", daemon=True).start())
+
+
+def _dump() -> None:
+    try:
+        data = collect(SIGNAL_SECONDS)
+    except Busy:
+        LOG.warning("SIGUSR2 ignored: a profiling window is already open")
+        return
+    path = os.path.join(os.getenv("MAIL_PROFILE_DIR", "/tmp"), f"profile-{os.getpid()}-{int(time.time())}.folded")
+    with open(path, "wb") as fp:
+        fp.write(data)
+    LOG.warning("wrote %g s of stacks to %s", SIGNAL_SECONDS, path)
@@ -0,0 +1,146 @@
+"""
+rate_limit.py – Token-bucket send limits matching the provider's quotas.
+
+Limits are checked when a send is admitted, before any SMTP traffic.  In
+"queue" mode an over-limit message is still accepted and scheduled for the
+moment the buckets refill; in "reject" mode (or when the wait would exceed
+*max_delay*) the call fails at once with ``RateLimited.retry_after``.
+Concurrent connections are bounded by the SMTP pool (MAIL_SMTP_POOL_SIZE)
+and per mail host by MAIL_HOST_CONCURRENCY (see mail_limits).
+"""
+import os, math, time, threading
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Tuple
+
+import shared_state
+
+
+class RateLimited(RuntimeError):
+    """Send refused by a local quota; safe to retry after *retry_after* seconds."""
+
+    def __init__(self, what: str, retry_after: float):
+        self.retry_after = math.ceil(retry_after)
+        super().__init__(f"Send rate limit reached ({what}); retry after {self.retry_after}s.")
+
+
+class TokenBucket:
+    """*capacity* tokens refilled at *rate* per second; may run into debt."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.stamp = time.monotonic()
+
+    def wait_for(self, n: float, now: float) -> float:
+        """Seconds until *n* tokens are available (0 if they are now)."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        return max(0.0, (n - self.tokens) / self.rate)
+
+    def take(self, n: float) -> None:
+        self.tokens -= n
+
+
+class SendLimiter:
+    """Messages-per-minute and recipients-per-hour buckets checked together."""
+
+    def __init__(self, messages_per_minute: float = 0, recipients_per_hour: float = 0,
+                 mode: str = "queue", max_delay: float = 900.0):
+        self.mode = mode
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+        self._clock = time.monotonic
+        self._buckets: List[Tuple[str, TokenBucket]] = []
+        if messages_per_minute > 0:
+            self._buckets.append(("messages/min", TokenBucket(messages_per_minute / 60.0, messages_per_minute)))
+        if recipients_per_hour > 0:
+            self._buckets.append(("recipients/hour", TokenBucket(recipients_per_hour / 3600.0, recipients_per_hour)))
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        with self._lock:
+            yield
+
+    def _wait(self, messages: int, recipients: int) -> Tuple[float, str]:
+        now = self._clock()
+        waits = [(bucket.wait_for(messages if name.startswith("messages") else recipients, now), name)
+                 for name, bucket in self._buckets]
+        return max(waits, default=(0.0, ""))
+
+    def check(self, messages: int, recipients: int) -> None:
+        """Raise RateLimited now if a batch this size could not go out under the policy."""
+        with self._locked():
+            wait, what = self._wait(messages, recipients)
+        if wait > 0 and (self.mode != "queue" or wait > self.max_delay):
+            raise RateLimited(what, wait)
+
+    def reserve(self, messages: int, recipients: int, wait_ok: Optional[bool] = None,
+                max_wait: Optional[float] = None) -> float:
+        """
+        Take the tokens and return how long the caller must wait before
+        sending (0 = now).  Raises RateLimited instead when waiting is not
+        allowed (reject mode) or would exceed *max_delay* (or *max_wait*,
+        e.g. what is left of the call's deadline).
+        """
+        if wait_ok is None:
+            wait_ok = self.mode == "queue"
+        limit = self.max_delay if max_wait is None else min(self.max_delay, max_wait)
+        with self._locked():
+            wait, what = self._wait(messages, recipients)
+            if wait > 0 and (not wait_ok or wait > limit):
+                raise RateLimited(what, wait)
+            for name, bucket in self._buckets:
+                bucket.take(messages if name.startswith("messages") else recipients)
+        return wait
+
+
+class SharedSendLimiter(SendLimiter):
+    """
+    The same limits with bucket levels kept in MAIL_STATE_DB under *key*, so
+    every worker process draws on one quota.  Each check or reservation is a
+    single BEGIN IMMEDIATE transaction: load levels, decide, write back.
+    """
+
+    def __init__(self, state: shared_state.StateDB, key: str, **limits):
+        super().__init__(**limits)
+        self._state = state
+        self._key = key
+        self._clock = time.time               # stamps are compared across processes
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        with self._lock:
+            db = self._state.db()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                for name, bucket in self._buckets:
+                    row = db.execute("SELECT tokens, stamp FROM rate_buckets WHERE key = ?",
+                                     (f"{self._key}:{name}",)).fetchone()
+                    bucket.tokens, bucket.stamp = row if row else (bucket.capacity, now)
+                yield
+                db.executemany("INSERT OR REPLACE INTO rate_buckets VALUES (?, ?, ?)",
+                               [(f"{self._key}:{name}", bucket.tokens, bucket.stamp)
+                                for name, bucket in self._buckets])
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+
+
+def from_env(key: str = "default") -> SendLimiter:
+    """
+    Limiter configured from MAIL_RATE_* (0 / unset = unlimited); shared
+    across worker processes under *key* when MAIL_STATE_DB is set.
+    """
+    limits = dict(
+        messages_per_minute=float(os.getenv("MAIL_RATE_MESSAGES_PER_MINUTE", "0")),
+        recipients_per_hour=float(os.getenv("MAIL_RATE_RECIPIENTS_PER_HOUR", "0")),
+        mode=os.getenv("MAIL_RATE_MODE", "queue"),
+        max_delay=float(os.getenv("MAIL_RATE_MAX_DELAY", "900")),
+    )
+    state = shared_state.state_db()
+    if state is None or not (limits["messages_per_minute"] or limits["recipients_per_hour"]):
+        return SendLimiter(**limits)
+    return SharedSendLimiter(state, key, **limits)
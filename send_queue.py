@@ -0,0 +1,318 @@
+"""
+send_queue.py – Durable outbound mail queue.
+
+``send_email`` spools the rendered message to SQLite (or, for large MIME
+messages, to a file beside it) and returns a queue id at once; background
+workers deliver it over the pooled SMTP sessions with exponential backoff.  Idempotency keys make an agent's retry of the same
+call return the original queue id instead of sending a duplicate.
+"""
+import io, os, json, time, uuid, random, sqlite3, hashlib, smtplib, threading, logging
+from contextlib import contextmanager
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional, Union
+
+import rate_limit
+
+LOG = logging.getLogger("send_queue")
+
+# deliver(mail_from, rcpts, message_stream, size) -> {refused_rcpt: (code, msg)}
+Deliver = Callable[[str, List[str], BinaryIO, int], Dict]
+# one limiter for every sender, or limiter_for(mail_from)
+Limiter = Union[rate_limit.SendLimiter, Callable[[str], Optional[rate_limit.SendLimiter]]]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id            TEXT PRIMARY KEY,
+    idem_key      TEXT NOT NULL,
+    created       REAL NOT NULL,
+    status        TEXT NOT NULL,          -- queued | sending | sent | failed
+    attempts      INTEGER NOT NULL DEFAULT 0,
+    next_attempt  REAL NOT NULL,
+    lease_until   REAL NOT NULL DEFAULT 0,
+    last_error    TEXT,
+    refused       TEXT,
+    sent_at       REAL,
+    mail_from     TEXT NOT NULL,
+    rcpts         TEXT NOT NULL,
+    message       BLOB NOT NULL,
+    message_path  TEXT                    -- spooled file instead of the blob
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt);
+DROP INDEX IF EXISTS outbox_idem;
+CREATE INDEX IF NOT EXISTS outbox_sender_idem ON outbox (mail_from, idem_key, created);
+"""
+
+
+def content_key(mail_from: str, rcpts: List[str], *parts: str) -> str:
+    """Idempotency key derived from sender, recipients and message parts."""
+    h = hashlib.sha256()
+    for part in (mail_from, ",".join(sorted(rcpts)), *parts):
+        h.update(part.encode("utf-8", "replace") + b"\0")
+    return "auto:" + h.hexdigest()
+
+
+def permanent(exc: Exception) -> bool:
+    """5xx replies will not get better by retrying; everything else might."""
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in exc.recipients.values())
+    if isinstance(exc, smtplib.SMTPResponseException):
+        return exc.smtp_code >= 500
+    return False
+
+
+class SendQueue:
+    """
+    SQLite-backed outbox drained by *workers* threads.
+
+    Explicit idempotency keys are honoured for *key_ttl* seconds, derived
+    (content) keys for *auto_key_ttl*.  A claimed message carries a lease,
+    renewed while its delivery runs, so a worker that dies mid-send leaves it
+    to be retried, not stuck, and a slow send is never claimed twice.  With a
+    *limiter*, each new message reserves send quota and is scheduled for
+    when the quota allows (or refused with RateLimited); *limiter* may also
+    be a function of the sender address, for per-account quotas.
+    """
+
+    def __init__(self, path: str, deliver: Deliver, workers: int = 2,
+                 max_attempts: int = 8, base_delay: float = 30.0, max_delay: float = 3600.0,
+                 key_ttl: float = 86400.0, auto_key_ttl: float = 600.0, lease: float = 300.0,
+                 retention: float = 7 * 86400.0, limiter: Optional[Limiter] = None):
+        self.path = path
+        self._limiter = limiter
+        self._deliver = deliver
+        self._workers = max(1, workers)
+        self._max_attempts = max_attempts
+        self._base_delay = base_delay
+        self._max_delay = max_delay
+        self._key_ttl = key_ttl
+        self._auto_key_ttl = auto_key_ttl
+        self._lease = lease
+        self._retention = retention
+        self._local = threading.local()
+        self._wake = threading.Event()
+        self._start_lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+
+    # ---------------- storage ---------------- #
+
+    def _db(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.executescript(_SCHEMA)
+            if "message_path" not in {r["name"] for r in db.execute("PRAGMA table_info(outbox)")}:
+                db.execute("ALTER TABLE outbox ADD COLUMN message_path TEXT")
+            self._local.db = db
+        return db
+
+    # ---------------- producer side ---------------- #
+
+    def new_spool_file(self) -> str:
+        """Path for a large message to be written to and passed to enqueue_file()."""
+        spool_dir = self.path + ".files"
+        os.makedirs(spool_dir, exist_ok=True)
+        return os.path.join(spool_dir, uuid.uuid4().hex + ".eml")
+
+    def enqueue_file(self, mail_from: str, rcpts: List[str], path: str, key: str) -> str:
+        """Like enqueue() for a message already written to *path*; the queue owns the file."""
+        try:
+            queue_id = self._insert(mail_from, rcpts, b"", path, key)
+        except rate_limit.RateLimited:
+            _remove(path)
+            raise
+        if not self._owns(queue_id, path):       # duplicate request: keep the original
+            _remove(path)
+        return queue_id
+
+    def enqueue(self, mail_from: str, rcpts: List[str], message: bytes, key: str) -> str:
+        """
+        Spool *message* and return its queue id, or the id of an earlier
+        request with the same idempotency *key* (see ``content_key``).
+        """
+        return self._insert(mail_from, rcpts, message, None, key)
+
+    def _owns(self, queue_id: str, path: str) -> bool:
+        row = self._db().execute("SELECT message_path FROM outbox WHERE id = ?", (queue_id,)).fetchone()
+        return row is not None and row["message_path"] == path
+
+    def _insert(self, mail_from: str, rcpts: List[str], message: bytes,
+                path: Optional[str], key: str) -> str:
+        self.start()                    # fallback; the servers start the workers at boot
+        ttl = self._auto_key_ttl if key.startswith("auto:") else self._key_ttl
+        now = time.time()
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            # keys are per sender: another account's key never answers for this one
+            row = db.execute("SELECT id FROM outbox WHERE mail_from = ? AND idem_key = ? AND created >= ?",
+                             (mail_from, key, now - ttl)).fetchone()
+            if row:
+                db.execute("COMMIT")
+                return row["id"]
+            queue_id = uuid.uuid4().hex
+            limiter = self._limiter(mail_from) if callable(self._limiter) else self._limiter
+            delay = limiter.reserve(1, len(rcpts)) if limiter else 0.0
+            db.execute(
+                "INSERT INTO outbox (id, idem_key, created, status, next_attempt, mail_from, rcpts,"
+                " message, message_path) VALUES (?, ?, ?, 'queued', ?, ?, ?, ?, ?)",
+                (queue_id, key, now, now + delay, mail_from, json.dumps(rcpts), message, path))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        self._wake.set()
+        return queue_id
+
+    def status(self, queue_id: str, mail_from: Optional[str] = None) -> Optional[Dict]:
+        """Delivery status of *queue_id*, or None if unknown (or not sent by *mail_from*, when given)."""
+        row = self._db().execute(
+            "SELECT id, status, attempts, created, next_attempt, sent_at, last_error, refused, mail_from"
+            " FROM outbox WHERE id = ?", (queue_id,)).fetchone()
+        if row is None or (mail_from is not None and row["mail_from"] != mail_from):
+            return None
+        return {
+            "queue_id": row["id"],
+            "status": row["status"],
+            "attempts": row["attempts"],
+            "created": row["created"],
+            "next_attempt": row["next_attempt"] if row["status"] == "queued" else None,
+            "sent_at": row["sent_at"],
+            "last_error": row["last_error"],
+            "refused": json.loads(row["refused"]) if row["refused"] else {},
+        }
+
+    def depth(self) -> int:
+        """Messages still waiting for delivery."""
+        return self._db().execute(
+            "SELECT COUNT(*) FROM outbox WHERE status IN ('queued', 'sending')").fetchone()[0]
+
+    # ---------------- worker side ---------------- #
+
+    def start(self) -> None:
+        """Start the delivery workers (idempotent)."""
+        if self._threads:
+            return
+        with self._start_lock:
+            if not self._threads:
+                self._threads = [threading.Thread(target=self._run, name=f"send-queue-{i}", daemon=True)
+                                 for i in range(self._workers)]
+                for t in self._threads:
+                    t.start()
+
+    def _claim(self) -> Optional[sqlite3.Row]:
+        now = time.time()
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute(
+                "SELECT * FROM outbox WHERE (status = 'queued' AND next_attempt <= ?)"
+                " OR (status = 'sending' AND lease_until < ?) ORDER BY next_attempt LIMIT 1",
+                (now, now)).fetchone()
+            if row:
+                db.execute("UPDATE outbox SET status = 'sending', lease_until = ?, attempts = attempts + 1"
+                           " WHERE id = ?", (now + self._lease, row["id"]))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return row
+
+    def _run(self) -> None:
+        last_purge = 0.0
+        while True:
+            try:
+                row = self._claim()
+                if row is None:
+                    if time.time() - last_purge > 3600:
+                        self._purge()
+                        last_purge = time.time()
+                    self._wake.wait(1.0)
+                    self._wake.clear()
+                    continue
+                self._send(row)
+            except Exception as e:             # keep the worker alive whatever happens
+                LOG.exception("send queue worker error: %s", e)
+                time.sleep(1.0)
+
+    @contextmanager
+    def _leased(self, queue_id: str) -> Iterator[None]:
+        """Keep extending *queue_id*'s lease until the block ends (large BDAT sends, limiter pacing)."""
+        done = threading.Event()
+
+        def renew():
+            while not done.wait(self._lease / 3):
+                try:
+                    self._db().execute("UPDATE outbox SET lease_until = ? WHERE id = ? AND status = 'sending'",
+                                       (time.time() + self._lease, queue_id))
+                except sqlite3.Error as e:    # the next renewal tries again
+                    LOG.warning("could not renew the lease on %s: %s", queue_id, e)
+
+        renewer = threading.Thread(target=renew, name="send-queue-lease", daemon=True)
+        renewer.start()
+        try:
+            yield
+        finally:
+            done.set()
+            renewer.join()
+
+    def _send(self, row: sqlite3.Row) -> None:
+        attempts = row["attempts"] + 1
+        path = row["message_path"]
+        try:
+            with self._leased(row["id"]):
+                refused = self._deliver_row(row, path)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if permanent(e) or attempts >= self._max_attempts or isinstance(e, FileNotFoundError):
+                LOG.warning("message %s failed permanently: %s", row["id"], error)
+                self._db().execute("UPDATE outbox SET status = 'failed', last_error = ? WHERE id = ?",
+                                   (error, row["id"]))
+                if path:
+                    _remove(path)
+            else:
+                delay = min(self._max_delay, self._base_delay * 2 ** (attempts - 1))
+                delay *= random.uniform(0.5, 1.0)      # jitter so retries do not stampede
+                LOG.info("message %s attempt %d failed, retry in %.0fs: %s", row["id"], attempts, delay, error)
+                self._db().execute(
+                    "UPDATE outbox SET status = 'queued', next_attempt = ?, last_error = ? WHERE id = ?",
+                    (time.time() + delay, error, row["id"]))
+            return
+        self._db().execute(
+            "UPDATE outbox SET status = 'sent', sent_at = ?, refused = ?, message = x'' WHERE id = ?",
+            (time.time(), json.dumps({r: [c, m.decode("utf-8", "replace") if isinstance(m, bytes) else m]
+                                      for r, (c, m) in (refused or {}).items()}), row["id"]))
+        if path:
+            _remove(path)
+
+    def _deliver_row(self, row: sqlite3.Row, path: Optional[str]) -> Dict:
+        if path:
+            with open(path, "rb") as fp:
+                return self._deliver(row["mail_from"], json.loads(row["rcpts"]), fp, os.fstat(fp.fileno()).st_size)
+        return self._deliver(row["mail_from"], json.loads(row["rcpts"]),
+                             io.BytesIO(row["message"]), len(row["message"]))
+
+    def _purge(self) -> None:
+        self._db().execute("DELETE FROM outbox WHERE status IN ('sent', 'failed') AND created < ?",
+                           (time.time() - self._retention,))
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def from_env(deliver: Deliver, default_path: str,
+             limiter: Optional[Limiter] = None) -> SendQueue:
+    """Queue configured from MAIL_SPOOL_PATH / MAIL_SEND_WORKERS / MAIL_SEND_MAX_ATTEMPTS."""
+    return SendQueue(
+        os.getenv("MAIL_SPOOL_PATH", default_path),
+        deliver,
+        workers=int(os.getenv("MAIL_SEND_WORKERS", "2")),
+        max_attempts=int(os.getenv("MAIL_SEND_MAX_ATTEMPTS", "8")),
+        base_delay=float(os.getenv("MAIL_SEND_RETRY_DELAY", "30")),
+        limiter=limiter,
+    )
@@ -0,0 +1,138 @@
+"""
+shared_state.py – State that every worker process must see the same way.
+
+Mail connections stay per process, but state a second worker would get
+wrong on its own lives in SQLite files in WAL mode (readers never block
+the writer; each thread keeps one connection):
+
+* OAuth codes and tokens          – oauth_store (OAUTH_TOKEN_DB)
+* the outbox and idempotency keys – send_queue (MAIL_SPOOL_PATH)
+* send-quota buckets and the POP header cache – MAIL_STATE_DB, below
+
+Without MAIL_STATE_DB the last two stay in process memory, which is right
+for a single worker.
+"""
+import os, time, sqlite3, threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS header_cache (
+    account   TEXT NOT NULL,
+    uid       TEXT NOT NULL,
+    headers   BLOB NOT NULL,
+    seen      REAL NOT NULL,
+    PRIMARY KEY (account, uid)
+);
+CREATE INDEX IF NOT EXISTS header_cache_seen ON header_cache (seen);
+CREATE TABLE IF NOT EXISTS rate_buckets (
+    key       TEXT PRIMARY KEY,
+    tokens    REAL NOT NULL,
+    stamp     REAL NOT NULL
+);
+"""
+
+
+class StateDB:
+    """Thread-local WAL connections to one shared state file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    def db(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.executescript(_SCHEMA)
+            self._local.db = db
+        return db
+
+
+class MemoryHeaderCache:
+    """Header blocks by (account, POP UIDL), oldest dropped past *max_items*."""
+
+    def __init__(self, max_items: int = 20000):
+        self._items: "OrderedDict[tuple, bytes]" = OrderedDict()
+        self._max_items = max_items
+        self._lock = threading.Lock()
+
+    def get_many(self, account: str, uids: Iterable[str]) -> Dict[str, bytes]:
+        with self._lock:
+            return {uid: self._items[(account, uid)] for uid in uids if (account, uid) in self._items}
+
+    def put_many(self, account: str, headers: Dict[str, bytes]) -> None:
+        with self._lock:
+            for uid, hdr in headers.items():
+                self._items[(account, uid)] = hdr
+            while len(self._items) > self._max_items:
+                self._items.popitem(last=False)
+
+
+_TOUCH_SECONDS = 3600.0         # how stale a hit's seen time may get before it is refreshed
+
+
+class SQLiteHeaderCache:
+    """Same interface in MAIL_STATE_DB; entries unseen for *max_age* seconds are purged."""
+
+    def __init__(self, state: StateDB, max_age: float = 30 * 86400.0):
+        self._state = state
+        self._max_age = max_age
+        self._last_purge = 0.0
+
+    def get_many(self, account: str, uids: Iterable[str]) -> Dict[str, bytes]:
+        uids = list(uids)
+        out: Dict[str, bytes] = {}
+        stale: List[str] = []
+        now = time.time()
+        db = self._state.db()
+        for start in range(0, len(uids), 500):           # stay under SQLite's parameter limit
+            chunk = uids[start:start + 500]
+            marks = ",".join("?" * len(chunk))
+            for uid, hdr, seen in db.execute(f"SELECT uid, headers, seen FROM header_cache"
+                                             f" WHERE account = ? AND uid IN ({marks})", (account, *chunk)):
+                out[uid] = hdr
+                if now - seen > _TOUCH_SECONDS:
+                    stale.append(uid)
+        # mark hits as seen so mail still in the mailbox is never purged;
+        # at most one write per entry per _TOUCH_SECONDS
+        for start in range(0, len(stale), 500):
+            chunk = stale[start:start + 500]
+            marks = ",".join("?" * len(chunk))
+            db.execute(f"UPDATE header_cache SET seen = ? WHERE account = ? AND uid IN ({marks})",
+                       (now, account, *chunk))
+        return out
+
+    def put_many(self, account: str, headers: Dict[str, bytes]) -> None:
+        now = time.time()
+        db = self._state.db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.executemany("INSERT OR REPLACE INTO header_cache VALUES (?, ?, ?, ?)",
+                           [(account, uid, hdr, now) for uid, hdr in headers.items()])
+            if now - self._last_purge > 3600:
+                db.execute("DELETE FROM header_cache WHERE seen < ?", (now - self._max_age,))
+                self._last_purge = now
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+
+_state: Optional[StateDB] = None
+
+
+def state_db() -> Optional[StateDB]:
+    """The MAIL_STATE_DB file, or None when state stays in process memory."""
+    global _state
+    path = os.getenv("MAIL_STATE_DB")
+    if path and (_state is None or _state.path != path):
+        _state = StateDB(path)
+    return _state if path else None
+
+
+def header_cache():
+    state = state_db()
+    return SQLiteHeaderCache(state) if state else MemoryHeaderCache()
@@ -0,0 +1,93 @@
+"""
+single_flight.py – One upstream call for concurrent identical reads.
+
+Sync tools run in FastMCP's worker threads.  When several of them ask for
+the same thing at once (two agents polling ``list_messages(20)``), the
+first becomes the leader and does the POP/IMAP work; the others wait for
+it and get the same result, or the same exception.  Nothing is cached:
+a call that starts after the leader finished does its own fetch.
+
+Results are shared between callers, so tools must not mutate them.
+"""
+import functools, inspect, threading
+from collections import defaultdict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """In-flight calls by key, with per-name call / coalesced counters."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self._counts: Dict[str, Dict[str, int]] = defaultdict(lambda: {"calls": 0, "coalesced": 0})
+
+    def do(self, key: Hashable, fn: Callable[[], Any], name: str = "") -> Any:
+        """Run *fn*, unless a call with the same *key* is in flight: then wait for its result."""
+        with self._lock:
+            counts = self._counts[name]
+            counts["calls"] += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                counts["coalesced"] += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+        except BaseException as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def coalesce(self, scope: Optional[Callable[[], Hashable]] = None, stale=None):
+        """
+        Decorator: share concurrent calls whose arguments (defaults filled
+        in) are equal.  *scope*, if given, is called first and joins the key,
+        so calls for different accounts never share a result.  With *stale*
+        (a mail_health.StaleCache) the last good result under the same key
+        is returned, marked stale, when the mail host fails.
+        """
+        def decorate(fn):
+            signature = inspect.signature(fn)
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                bound = signature.bind(*args, **kwargs)
+                bound.apply_defaults()
+                key = (fn.__name__, scope() if scope else None, _freeze(bound.arguments))
+                call = lambda: self.do(key, lambda: fn(*args, **kwargs), fn.__name__)
+                return stale.serve(key, call) if stale is not None else call()
+            return wrapper
+        return decorate
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """``{tool: {"calls": n, "coalesced": m}}``; m of the n calls shared another's fetch."""
+        with self._lock:
+            return {name: dict(counts) for name, counts in self._counts.items()}
+
+
+def _freeze(value) -> Hashable:
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+smoke_fake_mail.py – End-to-end check of both MCP servers against fake_mail.
+
+Starts the fake POP3/IMAP/SMTP servers (with STARTTLS, which mail_mcp
+requires), runs plain_mail_mcp.py and mail_mcp.py over stdio with their
+MAIL_* settings pointing there, and calls list_messages, get_message,
+delete_message, send_email and get_send_status on each.  Exits non-zero on
+the first failure.
+
+    python smoke_fake_mail.py [plain_mail_mcp|mail_mcp ...]
+"""
+import os, sys, time, asyncio, tempfile
+
+from fastmcp.client import Client
+from fastmcp.client.transports import PythonStdioTransport
+
+import fake_mail
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SERVERS = ["plain_mail_mcp", "mail_mcp"]
+
+
+async def smoke(server: str, fake: fake_mail.FakeMail, spool_dir: str) -> None:
+    env = {**os.environ, **fake.env(), "MCP_TRANSPORT": "stdio", "MAIL_SEND_RETRY_DELAY": "1",
+           "MAIL_SPOOL_PATH": os.path.join(spool_dir, server + ".sqlite3"),
+           "MAIL_ATTACHMENT_DIR": spool_dir, "MAIL_LOG_LEVEL": "WARNING"}
+    transport = PythonStdioTransport(os.path.join(HERE, server + ".py"), env=env, cwd=HERE, python_cmd=sys.executable)
+    async with Client(transport) as client:
+        listed = (await client.call_tool("list_messages", {"max_items": 5})).structured_content["result"]
+        assert listed, "list_messages returned nothing"
+        uid = listed[0]["uid"]
+        print(f"  list_messages: {len(listed)} messages, first uid {uid}")
+
+        raw = (await client.call_tool("get_message", {"uid": uid})).data
+        assert "Subject:" in raw, raw[:200]
+        fake_uid = int(raw.partition("Message-ID: <")[2].partition(".")[0])   # the store's uid, not the POP ordinal
+        print(f"  get_message: {len(raw)} characters")
+
+        reply = (await client.call_tool("delete_message", {"uid": uid})).data
+        print(f"  delete_message: {reply}")
+
+        sent = len(fake.store.sent)
+        reply = (await client.call_tool("send_email", {"to": "someone@example.com", "subject": f"smoke {server}",
+                                                        "body": "hello from the smoke test"})).data
+        queue_id = reply.rpartition("queue_id=")[2].rstrip(").")
+        deadline = time.monotonic() + 30
+        while True:
+            status = (await client.call_tool("get_send_status", {"queue_id": queue_id})).structured_content
+            if status["status"] in ("sent", "failed") or time.monotonic() > deadline:
+                break
+            await asyncio.sleep(0.2)
+        assert status["status"] == "sent", status
+        assert len(fake.store.sent) == sent + 1
+        print(f"  send_email: {queue_id} {status['status']}")
+
+    # the deletion is committed when the session ends (POP QUIT / IMAP expunge)
+    for _ in range(50):
+        if fake_uid not in fake.store.folders["INBOX"].uids:
+            break
+        time.sleep(0.1)
+    assert fake_uid not in fake.store.folders["INBOX"].uids, "delete_message was not committed"
+
+
+def main() -> int:
+    servers = sys.argv[1:] or SERVERS
+    with tempfile.TemporaryDirectory() as spool_dir:
+        for server in servers:
+            print(server)
+            with fake_mail.FakeMail(fake_mail.Store(messages=20), tls=True) as fake:
+                try:
+                    asyncio.run(smoke(server, fake, spool_dir))
+                except Exception as exc:
+                    print(f"FAILED: {type(exc).__name__}: {exc}")
+                    return 1
+    print("OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
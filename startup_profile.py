@@ -0,0 +1,41 @@
+"""
+startup_profile.py – Where a server's cold start goes.
+
+``python mail_mcp.py --profile-startup`` (or plain_mail_mcp.py) imports the
+server again in a fresh interpreter under ``-X importtime`` and prints the
+slowest modules, self time per top-level package, and the wall-clock total.
+"""
+import re, sys, time, subprocess
+from collections import defaultdict
+from typing import List
+
+_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)")
+
+
+def report(modules: List[str], cwd: str, top: int = 25) -> int:
+    """Profile ``import <modules>`` from *cwd*; returns the child's exit status."""
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + ", ".join(modules)],
+                          cwd=cwd, capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    rows = []
+    for line in proc.stderr.splitlines():
+        m = _LINE.match(line)
+        if m:
+            rows.append((int(m.group(1)) / 1000, int(m.group(2)) / 1000, len(m.group(3)) // 2, m.group(4)))
+    if proc.returncode:
+        sys.stderr.write(proc.stderr[-2000:])
+
+    by_package = defaultdict(float)
+    for self_ms, _, _, name in rows:
+        by_package[name.split(".")[0]] += self_ms
+
+    print(f"Cold start of {', '.join(modules)}: {wall * 1000:.0f} ms wall, "
+          f"{sum(r[0] for r in rows):.0f} ms in {len(rows)} imports")
+    print(f"\nSlowest imports (cumulative, nesting shown by indent):\n{'self ms':>9}{'cum ms':>9}  module")
+    for self_ms, cum_ms, depth, name in sorted(rows, key=lambda r: -r[1])[:top]:
+        print(f"{self_ms:>9.1f}{cum_ms:>9.1f}  {'  ' * min(depth, 8)}{name}")
+    print(f"\nSelf time by top-level package:\n{'ms':>9}  package")
+    for package, ms in sorted(by_package.items(), key=lambda kv: -kv[1])[:top]:
+        print(f"{ms:>9.1f}  {package}")
+    return proc.returncode
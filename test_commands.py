@@ -11,16 +11,16 @@ import time
 import os
 
 def test_http_server():
-    """Test MCP server via HTTP (server must be running on port 8088)"""
+    """Test MCP server via HTTP (server must be running on port 8089)"""
     
     print("=== HTTP SERVER TESTING ===")
     print("First, start your server with: python mail_mcp.py")
-    print("Server should be running on: http://173.212.228.93:8088/mcp/")
+    print("Server should be running on: http://173.212.228.93:8089/mcp/")
     print()
     
     # Basic server check
     print("1. TEST: Check if server is responding")
-    print("Command: curl -H \"Accept: text/event-stream\" http://173.212.228.93:8088/mcp/")
+    print("Command: curl -H \"Accept: text/event-stream\" http://173.212.228.93:8089/mcp/")
     print("Expected: {'jsonrpc': '2.0', 'id': 'server-error', 'error': {'code': -32600, 'message': 'Bad Request: Missing session ID'}}")
     print("(This error means server is working - it needs proper MCP session)")
     print()
@@ -147,10 +147,10 @@ def show_manual_testing_steps():
     steps = [
         "1. Start your MCP server:",
         "   Command: python mail_mcp.py",
-        "   You should see: Server running on http://0.0.0.0:8088/mcp/",
+        "   You should see: Server running on http://0.0.0.0:8089/mcp/",
         "",
         "2. Test server is responding:",
-        "   Command: curl -H \"Accept: text/event-stream\" http://173.212.228.93:8088/mcp/",
+        "   Command: curl -H \"Accept: text/event-stream\" http://173.212.228.93:8089/mcp/",
         "   Expected: Error about missing session ID (this is good!)",
         "",
         "3. To test tools, you need email credentials in .env file:",
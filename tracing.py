@@ -0,0 +1,154 @@
+"""
+tracing.py – OpenTelemetry spans from the MCP request down to each mail command.
+
+FastMCP already opens a span per MCP request (``tools/call <tool>``) through
+the OpenTelemetry API.  Beneath it these helpers add:
+
+    tool <tool>             the tool function (traced())
+    serialize <tool>        turning its return value into the MCP result
+    pool.checkout           waiting for a pooled session, connecting if needed
+    mailbox <command>       a call queued on a POP mailbox actor; the actor's
+                            pop.turn span is its child and links to every
+                            other call served in the same session
+    <proto> <COMMAND>       each upstream command (metrics.command), e.g.
+                            "pop CONNECT", "pop AUTH", "pop TOP", "smtp SEND"
+
+setup() installs a tracer provider when MAIL_TRACE_FILE (spans as JSON
+lines) or OTEL_EXPORTER_OTLP_ENDPOINT (an OTLP/HTTP collector) is set.
+MAIL_TRACE_SAMPLE of the traces are kept (default 0.05, decided once per
+trace so a trace is never half recorded); spans are exported in batches
+from a background thread.  Needs opentelemetry-sdk, plus
+opentelemetry-exporter-otlp-proto-http for a collector.  Otherwise every
+helper here costs one flag check.
+"""
+import os, time, functools, contextvars, logging
+from contextlib import nullcontext
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import profiling
+
+LOG = logging.getLogger("tracing")
+
+SAMPLE = float(os.getenv("MAIL_TRACE_SAMPLE", "0.05"))
+
+ENABLED = False
+_tracer = None
+_NULL = nullcontext()
+# set per tool call by tool_middleware(); traced() notes when the function returned
+_returned: contextvars.ContextVar[Optional[List[int]]] = contextvars.ContextVar("trace_returned", default=None)
+
+
+def setup(service: str = "plain-mail-mcp") -> bool:
+    """Install the tracer provider described by the environment (once); True if spans are recorded."""
+    global ENABLED, _tracer
+    if ENABLED:
+        return True
+    path = os.getenv("MAIL_TRACE_FILE")
+    endpoint = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT") or os.getenv("OTEL_EXPORTER_OTLP_TRACES_ENDPOINT")
+    if not (path or endpoint):
+        return False
+    try:
+        from opentelemetry import trace
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+        from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+    except ImportError:
+        LOG.warning("tracing is configured but opentelemetry-sdk is not installed; no spans are recorded")
+        return False
+    provider = TracerProvider(
+        resource=Resource.create({} if os.getenv("OTEL_SERVICE_NAME") else {"service.name": service}),
+        sampler=ParentBased(TraceIdRatioBased(SAMPLE)))
+    if path:
+        out = open(path, "a", encoding="utf-8")
+        provider.add_span_processor(BatchSpanProcessor(
+            ConsoleSpanExporter(out=out, formatter=lambda span: span.to_json(indent=None) + "\n")))
+    if endpoint:
+        try:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        except ImportError:
+            LOG.warning("OTEL_EXPORTER_OTLP_ENDPOINT is set but opentelemetry-exporter-otlp-proto-http is not installed")
+        else:
+            provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    trace.set_tracer_provider(provider)
+    _tracer = trace.get_tracer("mail")
+    ENABLED = True
+    LOG.info("tracing %.0f%% of requests to %s", SAMPLE * 100, " and ".join(filter(None, [path, endpoint])))
+    return True
+
+
+def span(name: str, attributes: Optional[Dict[str, Any]] = None, parent=None, links: Iterable = ()):
+    """
+    Context manager: a child span of the current one (or of the *parent*
+    context from current()), with links to the contexts in *links*.
+    """
+    if not ENABLED:
+        return _NULL
+    return _tracer.start_as_current_span(name, context=parent, attributes=attributes, links=_links(links))
+
+
+def link(contexts: Iterable) -> None:
+    """Link the current span to the spans of *contexts* (work it took on after starting)."""
+    if ENABLED:
+        from opentelemetry import trace
+        current_span = trace.get_current_span()
+        for found in _links(contexts):
+            current_span.add_link(found.context)
+
+
+def _links(contexts: Iterable) -> list:
+    from opentelemetry import trace
+    return [trace.Link(trace.get_current_span(ctx).get_span_context()) for ctx in contexts if ctx is not None]
+
+
+def current():
+    """The current trace context, for work handed to another thread (None when off)."""
+    if not ENABLED:
+        return None
+    from opentelemetry import context
+    return context.get_current()
+
+
+def traced(fn: Callable) -> Callable:
+    """
+    Decorator for tool functions: a ``tool <name>`` span around each call,
+    which also runs under cProfile when profiling asks for it.
+    """
+    name = f"tool {fn.__name__}"
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if not ENABLED:
+            return profiling.run(fn, *args, **kwargs)
+        with span(name):
+            result = profiling.run(fn, *args, **kwargs)
+        returned = _returned.get()
+        if returned is not None:
+            returned.append(time.time_ns())
+        return result
+    return wrapper
+
+
+def tool_middleware():
+    """
+    FastMCP middleware adding a ``serialize <tool>`` span: from the traced()
+    function's return to the end of the call, which is FastMCP turning the
+    return value into content and structured output.
+    """
+    from fastmcp.server.middleware import Middleware
+
+    class ToolSpans(Middleware):
+        async def on_call_tool(self, context, call_next):
+            if not ENABLED:
+                return await call_next(context)
+            returned: List[int] = []
+            token = _returned.set(returned)
+            try:
+                result = await call_next(context)
+            finally:
+                _returned.reset(token)
+            if returned:
+                _tracer.start_span(f"serialize {context.message.name}", start_time=returned[-1]).end()
+            return result
+
+    return ToolSpans()
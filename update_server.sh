@@ -80,8 +80,8 @@ if systemctl is-active --quiet popmailmcp; then
     # Test if server is responding
     echo ""
     echo "Testing server response..."
-    if curl -s -f http://localhost:8088/mcp/ > /dev/null; then
-        echo "✓ MCP server is responding on port 8088"
+    if curl -s -f http://localhost:${MCP_PORT:-8089}/mcp/ > /dev/null; then
+        echo "✓ MCP server is responding on port ${MCP_PORT:-8089}"
     else
         echo "⚠ MCP server connectivity test failed"
     fi
@@ -96,7 +96,7 @@ fi
 echo ""
 echo "=== Update Complete ==="
 echo "ChatGPT compatibility fix has been applied and tested."
-echo "Server URL for ChatGPT: http://173.212.228.93:8088/mcp/"
+echo "Server URL for ChatGPT: http://173.212.228.93:${MCP_PORT:-8089}/mcp/"
 echo ""
 echo "Next: Test the connector in ChatGPT with the server URL"
 echo ""